@@ -1,4 +1,36 @@
 import random
+from collections import namedtuple
+
+ORIENTATIONS = ('up', 'down', 'left', 'right')
+
+# (dx, dy) of every cell relative to the head, head first
+OFFSETS = {
+    'up': ((0, 0), (0, 1), (-2, 1), (-1, 1), (1, 1), (2, 1), (0, 2), (0, 3), (-1, 3), (1, 3)),
+    'down': ((0, 0), (0, -1), (-2, -1), (-1, -1), (1, -1), (2, -1), (0, -2), (0, -3), (-1, -3), (1, -3)),
+    'left': ((0, 0), (-1, 0), (-1, -2), (-1, -1), (-1, 1), (-1, 2), (-2, 0), (-3, 0), (-3, -1), (-3, 1)),
+    'right': ((0, 0), (1, 0), (1, -2), (1, -1), (1, 1), (1, 2), (2, 0), (3, 0), (3, -1), (3, 1)),
+}
+
+# Boards are square, MIN_BOARD_SIZE to MAX_BOARD_SIZE cells a side (a plane
+# is 5 cells across and 4 long). A fleet gets at least CELLS_PER_PLANE cells
+# of board per plane (one plane on the smallest boards) so random placement
+# rarely has to start over (see test_airplane.py), and counts stay below 255
+# so they fit the uint8 fields of the wire formats.
+MIN_BOARD_SIZE = 5
+MAX_BOARD_SIZE = 100
+CELLS_PER_PLANE = 30
+PLANES_LIMIT = 200
+
+# Random placement: draws in a row that may miss before a fleet starts over,
+# and fleets started before giving up
+PLACEMENT_MISSES = 200
+FLEET_RESTARTS = 100
+
+# A legal placement: cells are (x, y) like Avion.get_positions, and mask has
+# bit y * cols + x set for each cell, matching bitboard.Board
+Footprint = namedtuple('Footprint', ['x', 'y', 'orientation', 'mask', 'cells'])
+
+_footprint_tables = {}
 
 class Pozitie:
     def __init__(self, x=0, y=0):
@@ -6,37 +38,139 @@ class Pozitie:
         self.y = y
 
 class Avion:
-    def __init__(self, pozitieCap: Pozitie, orientare: str):
+    def __init__(self, pozitieCap: Pozitie, orientare: str, rng=random):
         self.pozCap = pozitieCap
         self.orientare = orientare
-        # Generate a random color for each airplane
+        # Generate a random color for each airplane; pass a seeded
+        # random.Random as rng for reproducible games
         self.color = (
-            random.randint(0, 255),
-            random.randint(0, 255),
-            random.randint(0, 255)
+            rng.randint(0, 255),
+            rng.randint(0, 255),
+            rng.randint(0, 255)
         )
 
     def get_positions(self):
-        positions = []
         x, y = self.pozCap.x, self.pozCap.y
-        if self.orientare == 'up':
-            positions = [(x, y), (x, y+1), (x-2, y+1), (x-1, y+1), (x+1, y+1), (x+2, y+1), (x, y+2), (x, y+3), (x-1, y+3), (x+1, y+3)]
-        elif self.orientare == 'down':
-            positions = [(x, y), (x, y-1), (x-2, y-1), (x-1, y-1), (x+1, y-1), (x+2, y-1), (x, y-2), (x, y-3), (x-1, y-3), (x+1, y-3)]
-        elif self.orientare == 'left':
-            positions = [(x, y), (x-1, y), (x-1, y-2), (x-1, y-1), (x-1, y+1), (x-1, y+2), (x-2, y), (x-3, y), (x-3, y-1), (x-3, y+1)]
-        elif self.orientare == 'right':
-            positions = [(x, y), (x+1, y), (x+1, y-2), (x+1, y-1), (x+1, y+1), (x+1, y+2), (x+2, y), (x+3, y), (x+3, y-1), (x+3, y+1)]
-        return positions
-
-def can_place_airplane(grid, airplane):
-    for pos in airplane.get_positions():
-        if pos[0] < 0 or pos[0] >= len(grid[0]) or pos[1] < 0 or pos[1] >= len(grid):
-            return False
-        if grid[pos[1]][pos[0]] != (255, 255, 255):
-            return False
-    return True
-
-def place_airplane(grid, airplane):
-    for pos in airplane.get_positions():
-        grid[pos[1]][pos[0]] = airplane.color
\ No newline at end of file
+        return [(x + dx, y + dy) for dx, dy in OFFSETS.get(self.orientare, ())]
+
+def footprint_table(cols, rows=None):
+    """All legal placements on a cols x rows board, keyed by (x, y, orientation).
+
+    Built once per board size; later calls return the cached table.
+    """
+    rows = cols if rows is None else rows
+    table = _footprint_tables.get((cols, rows))
+    if table is None:
+        table = {}
+        for y in range(rows):
+            for x in range(cols):
+                for orientation in ORIENTATIONS:
+                    cells = tuple((x + dx, y + dy) for dx, dy in OFFSETS[orientation])
+                    if all(0 <= cx < cols and 0 <= cy < rows for cx, cy in cells):
+                        mask = 0
+                        for cx, cy in cells:
+                            mask |= 1 << (cy * cols + cx)
+                        table[(x, y, orientation)] = Footprint(x, y, orientation, mask, cells)
+        _footprint_tables[(cols, rows)] = table
+    return table
+
+def plane_limit(size):
+    """The most planes a fleet may have on a size x size board"""
+    return min(max(size * size // CELLS_PER_PLANE, 1), PLANES_LIMIT)
+
+def valid_mode(size, planes):
+    """Whether a game can be played with planes planes on a size x size board"""
+    return (isinstance(size, int) and isinstance(planes, int) and
+            MIN_BOARD_SIZE <= size <= MAX_BOARD_SIZE and 1 <= planes <= plane_limit(size))
+
+def orientation_of(head, cells, cols=10, rows=None):
+    """Orientation of the plane made of (row, col) cells with its head at head, or None.
+
+    Checked against OFFSETS directly, so it costs the same on any board size
+    and never builds the footprint table.
+    """
+    rows = cols if rows is None else rows
+    row, col = head
+    placed = set(cells)
+    for orientation in ORIENTATIONS:
+        plane = {(row + dy, col + dx) for dx, dy in OFFSETS[orientation]}
+        if plane == placed and all(0 <= r < rows and 0 <= c < cols for r, c in plane):
+            return orientation
+    return None
+
+def get_footprint(airplane, cols=10, rows=None):
+    """The airplane's footprint, or None if it does not fit on the board"""
+    return footprint_table(cols, rows).get((airplane.pozCap.x, airplane.pozCap.y, airplane.orientare))
+
+def iter_placements(planes, cols=10, rows=None, occupied=0):
+    """Yield every set of `planes` non-overlapping footprints as a tuple.
+
+    Each set is produced once (footprints in table order) and overlap is
+    checked with a single AND against the running occupancy mask.
+    """
+    footprints = list(footprint_table(cols, rows).values())
+    chosen = []
+
+    def extend(start, mask):
+        if len(chosen) == planes:
+            yield tuple(chosen)
+            return
+        for index in range(start, len(footprints)):
+            footprint = footprints[index]
+            if not footprint.mask & mask:
+                chosen.append(footprint)
+                yield from extend(index + 1, mask | footprint.mask)
+                chosen.pop()
+
+    return extend(0, occupied)
+
+def random_placements(rng=random, planes=3, size=10):
+    """Pick non-overlapping placements; returns the (row, col, orientation) of each head.
+
+    Cells come from OFFSETS rather than the footprint table, whose bitmasks
+    cost tens of megabytes on the largest boards. Planes placed early can
+    leave no room for the rest, so after PLACEMENT_MISSES draws in a row that
+    do not fit, the fleet starts over; after FLEET_RESTARTS of those, raises
+    ValueError as no fleet is likely to fit.
+    """
+    for _ in range(FLEET_RESTARTS):
+        placements = []
+        occupied = set()
+        misses = 0
+        while len(placements) < planes and misses < PLACEMENT_MISSES:
+            x, y, orientation = rng.randrange(size), rng.randrange(size), rng.choice(ORIENTATIONS)
+            cells = [(x + dx, y + dy) for dx, dy in OFFSETS[orientation]]
+            if not all(0 <= cx < size and 0 <= cy < size for cx, cy in cells) or \
+                    occupied.intersection(cells):
+                misses += 1
+                continue
+            misses = 0
+            occupied.update(cells)
+            placements.append((y, x, orientation))
+        if len(placements) == planes:
+            return placements
+    raise ValueError(f"Could not fit {planes} planes on a {size} x {size} board")
+
+def random_fleet(rng=random, planes=3, size=10):
+    """random_placements as (head, cells) with (row, col) pairs"""
+    return [((row, col), [[row + dy, col + dx] for dx, dy in OFFSETS[orientation]])
+            for row, col, orientation in random_placements(rng, planes, size)]
+
+def can_place_airplane(grid, airplane, occupied=None):
+    """Check the airplane fits on the grid without overlapping another plane.
+
+    Pass the grid's occupancy mask as `occupied` to skip the colour checks.
+    """
+    footprint = get_footprint(airplane, len(grid[0]), len(grid))
+    if footprint is None:
+        return False
+    if occupied is not None:
+        return not footprint.mask & occupied
+    return all(grid[y][x] == (255, 255, 255) for x, y in footprint.cells)
+
+def place_airplane(grid, airplane, occupied=0):
+    """Colour the airplane's cells and return the updated occupancy mask"""
+    footprint = get_footprint(airplane, len(grid[0]), len(grid))
+    for x, y in footprint.cells:
+        grid[y][x] = airplane.color
+    return occupied | footprint.mask
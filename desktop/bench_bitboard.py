@@ -0,0 +1,95 @@
+"""Compare shot resolution on colour grids and shot lists against the bitboard engine.
+
+Usage: python bench_bitboard.py [games]
+"""
+import random
+import sys
+import time
+
+from airplane import ORIENTATIONS, Avion, Pozitie, can_place_airplane, place_airplane
+from bitboard import Board, WHITE
+
+
+def random_fleet(rng, planes=3):
+    """Return a colour grid, its (row, col) heads and the placed planes"""
+    grid = [[WHITE for _ in range(10)] for _ in range(10)]
+    heads = []
+    airplanes = []
+    while len(airplanes) < planes:
+        airplane = Avion(Pozitie(rng.randrange(10), rng.randrange(10)), rng.choice(ORIENTATIONS))
+        if can_place_airplane(grid, airplane):
+            place_airplane(grid, airplane)
+            heads.append((airplane.pozCap.y, airplane.pozCap.x))
+            airplanes.append(airplane)
+    return grid, heads, airplanes
+
+
+def play_lists(grid, heads, order):
+    """The original server logic: list membership, any() over heads, colour compare"""
+    shots = []
+    shot_results = {}
+    heads_hit = 0
+    for row, col in order:
+        if (row, col) in shots:
+            continue
+        shots.append((row, col))
+        if any(row == hr and col == hc for hr, hc in heads):
+            shot_results[(row, col)] = "head"
+            heads_hit += 1
+            if heads_hit >= len(heads):
+                return len(shots)
+        elif grid[row][col] != WHITE:
+            shot_results[(row, col)] = "hit"
+        else:
+            shot_results[(row, col)] = "miss"
+    return len(shots)
+
+
+def play_bitboard(board, order):
+    shots = 0
+    for row, col in order:
+        result = board.fire(row, col)
+        if result is None:
+            continue
+        shots += 1
+        if result == "head" and board.all_heads_hit():
+            return shots
+    return shots
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(0)
+    cells = [(row, col) for row in range(10) for col in range(10)]
+    setups = []
+    for _ in range(games):
+        grid, heads, airplanes = random_fleet(rng)
+        order = cells[:]
+        rng.shuffle(order)
+        # Every shot is sent twice, as the full-state clients do
+        order = [cell for cell in order for _ in range(2)]
+        setups.append((grid, heads, airplanes, order))
+
+    start = time.perf_counter()
+    list_shots = [play_lists(grid, heads, order) for grid, heads, _, order in setups]
+    list_time = time.perf_counter() - start
+
+    boards = []
+    for _, heads, airplanes, _ in setups:
+        board = Board()
+        for airplane in airplanes:
+            board.add_plane((airplane.pozCap.y, airplane.pozCap.x),
+                            [(y, x) for x, y in airplane.get_positions()])
+        boards.append(board)
+    start = time.perf_counter()
+    bit_shots = [play_bitboard(board, setup[3]) for board, setup in zip(boards, setups)]
+    bit_time = time.perf_counter() - start
+
+    assert list_shots == bit_shots
+    print(f"{games} games, {sum(bit_shots) / games:.1f} shots per game")
+    print(f"lists/colours: {list_time * 1e6 / games:8.2f} us/game")
+    print(f"bitboards:     {bit_time * 1e6 / games:8.2f} us/game  ({list_time / bit_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
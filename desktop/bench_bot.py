@@ -0,0 +1,51 @@
+"""Time the bot's targeting and count the shots it needs to kill every head.
+
+Usage: python bench_bot.py [games]
+"""
+import random
+import sys
+import time
+
+import bot
+from airplane import random_fleet
+from bitboard import Board
+
+
+def play(rng, choose):
+    board = Board()
+    for head, cells in random_fleet(rng):
+        board.add_plane(head, cells)
+    shots = 0
+    elapsed = 0.0
+    while not board.all_heads_hit():
+        start = time.perf_counter()
+        row, col = choose(board)
+        elapsed += time.perf_counter() - start
+        board.fire(row, col)
+        shots += 1
+    return shots, elapsed
+
+
+def random_shot(rng):
+    def choose(board):
+        while True:
+            row, col = rng.randrange(board.size), rng.randrange(board.size)
+            if not board.is_shot(row, col):
+                return row, col
+    return choose
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    bot.targeter()  # build the tables outside the timing
+
+    for name, choose in (("density", bot.next_shot), ("random", random_shot(random.Random(1)))):
+        rng = random.Random(0)
+        results = [play(rng, choose) for _ in range(games)]
+        shots = sum(shots for shots, _ in results)
+        elapsed = sum(elapsed for _, elapsed in results)
+        print(f"{name:8} {shots / games:6.1f} shots to win  {elapsed * 1e6 / shots:8.1f} us/move")
+
+
+if __name__ == "__main__":
+    main()
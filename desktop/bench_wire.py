@@ -0,0 +1,92 @@
+"""Compare the framed binary wire format against the old pickle messages.
+
+Usage: python bench_wire.py [turns]
+"""
+import pickle
+import random
+import sys
+import time
+
+import wire
+from bench_bitboard import random_fleet
+from bitboard import Board, WHITE
+
+
+def sample_turns(rng, turns):
+    """Client states and server replies as they look over a game.
+
+    The old server sent opponent_shots as a list of cells; the wire format
+    carries the board's shots mask.
+    """
+    grid, heads, airplanes = random_fleet(rng)
+    board = Board()
+    for airplane in airplanes:
+        board.add_plane((airplane.pozCap.y, airplane.pozCap.x),
+                        [(y, x) for x, y in airplane.get_positions()])
+    cells = [(row, col) for row in range(10) for col in range(10)]
+    rng.shuffle(cells)
+    shots = [[False] * 10 for _ in range(10)]
+    samples = []
+    for turn in range(turns):
+        row, col = cells[turn % len(cells)]
+        shots[row][col] = True
+        board.fire(row, col)
+        state = {"grid": grid, "shots": shots, "head_positions": heads}
+        update = {
+            "opponent_ready": True,
+            "your_turn": turn % 2 == 0,
+            "placement_phase": False,
+            "opponent_shots": list(board.shot_cells()),
+            "heads_hit": board.heads_hit,
+            "opponent_heads_hit": 0,
+            "shot_results": {(row, col): board.result_at(row, col)},
+        }
+        samples.append((state, update, dict(update, opponent_shots=board.shots)))
+    return samples
+
+
+def timed(function, items):
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    return results, (time.perf_counter() - start) * 1e6 / len(items)
+
+
+def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    samples = sample_turns(random.Random(0), turns)
+    states = [state for state, _, _ in samples]
+    updates = [update for _, update, _ in samples]
+    wire_messages = [update for _, _, update in samples]
+
+    pickled_states, pickle_state_enc = timed(pickle.dumps, states)
+    pickled_updates, pickle_update_enc = timed(pickle.dumps, updates)
+    _, pickle_state_dec = timed(pickle.loads, pickled_states)
+    _, pickle_update_dec = timed(pickle.loads, pickled_updates)
+
+    occupied = wire.matrix_mask([[colour != WHITE for colour in line] for line in states[0]["grid"]])
+    wire_states, wire_state_enc = timed(
+        lambda s: wire.encode_state(10, occupied, wire.matrix_mask(s["shots"]), s["head_positions"]),
+        states)
+    wire_updates, wire_update_enc = timed(wire.encode_update, wire_messages)
+    _, wire_state_dec = timed(lambda frame: wire.Decoder().feed(frame), wire_states)
+    _, wire_update_dec = timed(lambda frame: wire.Decoder().feed(frame), wire_updates)
+
+    def per_turn(frames):
+        return sum(map(len, frames)) / len(frames)
+
+    print(f"{turns} turns (one client state and one server reply each)")
+    print(f"{'':8} {'bytes/turn':>10} {'encode us':>10} {'decode us':>10}")
+    print(f"{'pickle':8} {per_turn(pickled_states) + per_turn(pickled_updates):10.0f} "
+          f"{pickle_state_enc + pickle_update_enc:10.2f} {pickle_state_dec + pickle_update_dec:10.2f}")
+    print(f"{'wire':8} {per_turn(wire_states) + per_turn(wire_updates):10.0f} "
+          f"{wire_state_enc + wire_update_enc:10.2f} {wire_state_dec + wire_update_dec:10.2f}")
+
+    # A reply split at every byte still decodes to the same message
+    decoder = wire.Decoder()
+    decoded = [message for byte in wire_updates[-1] for message in decoder.feed(bytes([byte]))]
+    assert decoded[0]["shot_results"] == updates[-1]["shot_results"]
+    assert decoded[0]["opponent_shots"] == wire_messages[-1]["opponent_shots"]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Bitboard rules engine shared by the desktop game, the desktop server and the web server.
+
+Each player's board keeps its planes, heads, the shots it received and the hits
+among those shots as plain integers, one bit per cell (bit row * size + col).
+Resolving a shot, rejecting a duplicate and checking for a win are then a
+handful of bit operations instead of scans over colour grids and shot lists.
+"""
+
+BOARD_SIZE = 10
+WHITE = (255, 255, 255)
+
+try:
+    popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def popcount(value):
+        return bin(value).count("1")
+
+
+def cell_bit(row, col, size=BOARD_SIZE):
+    return 1 << (row * size + col)
+
+
+def iter_cells(mask, size=BOARD_SIZE):
+    """Yield the (row, col) of every set bit, lowest first"""
+    while mask:
+        low = mask & -mask
+        index = low.bit_length() - 1
+        yield divmod(index, size)
+        mask ^= low
+
+
+class Board:
+    """One player's fleet and the shots fired at it"""
+    __slots__ = ("size", "occupied", "heads", "shots", "hits")
+
+    def __init__(self, size=BOARD_SIZE):
+        self.size = size
+        self.occupied = 0
+        self.heads = 0
+        self.shots = 0
+        self.hits = 0
+
+    def bit(self, row, col):
+        return 1 << (row * self.size + col)
+
+    def add_plane(self, head, cells) -> bool:
+        """Add a plane given (row, col) cells; returns False if it overlaps another plane"""
+        mask = 0
+        for row, col in cells:
+            mask |= self.bit(row, col)
+        if self.occupied & mask:
+            return False
+        self.occupied |= mask
+        self.heads |= self.bit(*head)
+        return True
+
+    def load_grid(self, grid, head_positions, empty=WHITE):
+        """Rebuild the fleet from a colour grid and a list of (row, col) heads"""
+        occupied = 0
+        for row, line in enumerate(grid):
+            for col, colour in enumerate(line):
+                if colour != empty:
+                    occupied |= self.bit(row, col)
+        heads = 0
+        for row, col in head_positions:
+            heads |= self.bit(row, col)
+        self.occupied = occupied
+        self.heads = heads
+
+    def load_masks(self, occupied, head_positions):
+        """Rebuild the fleet from an occupancy mask and a list of (row, col) heads"""
+        heads = 0
+        for row, col in head_positions:
+            heads |= self.bit(row, col)
+        self.occupied = occupied
+        self.heads = heads
+
+    @property
+    def planes(self) -> int:
+        return popcount(self.heads)
+
+    @property
+    def heads_hit(self) -> int:
+        return popcount(self.heads & self.shots)
+
+    def is_shot(self, row, col) -> bool:
+        return bool(self.shots & self.bit(row, col))
+
+    def fire(self, row, col):
+        """Resolve a shot at this board: 'head', 'hit', 'miss', or None if already shot"""
+        bit = self.bit(row, col)
+        if self.shots & bit:
+            return None
+        self.shots |= bit
+        if self.occupied & bit:
+            self.hits |= bit
+            return "head" if self.heads & bit else "hit"
+        return "miss"
+
+    def result_at(self, row, col):
+        """Result of an earlier shot, or None if the cell was never shot"""
+        bit = self.bit(row, col)
+        if not self.shots & bit:
+            return None
+        if self.hits & bit:
+            return "head" if self.heads & bit else "hit"
+        return "miss"
+
+    def shot_cells(self):
+        return iter_cells(self.shots, self.size)
+
+    def shot_results(self) -> dict:
+        """All shot results keyed by (row, col)"""
+        return {cell: self.result_at(*cell) for cell in self.shot_cells()}
+
+    def all_heads_hit(self) -> bool:
+        return bool(self.heads) and not self.heads & ~self.shots
+
+    def all_cells_hit(self) -> bool:
+        return bool(self.occupied) and not self.occupied & ~self.shots
@@ -0,0 +1,103 @@
+"""Computer opponent shared by the desktop server and the web server.
+
+The bot needs no memory of its own: everything it knows is on the opponent's
+bitboards (the shots it fired and which of them hit a plane or a head). Each
+turn it rebuilds that evidence and scores every cell with a probability
+density over the placements that still fit it, all as NumPy array
+operations over every placement's cells, worked out from airplane.py's
+OFFSETS.
+"""
+import numpy as np
+
+from airplane import OFFSETS, ORIENTATIONS
+from bitboard import BOARD_SIZE
+
+# How much more likely a placement is for each unexplained hit it covers
+HIT_WEIGHT = 8.0
+# Largest placement x cell matrix kept dense (float32 entries)
+DENSE_LIMIT = 1 << 16
+
+_targeters = {}
+
+
+def mask_vector(mask, cells):
+    """Unpack a bitmask into a 0/1 float vector, cell i at index i"""
+    raw = np.frombuffer(mask.to_bytes((cells + 7) // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder="little")[:cells].astype(np.float32)
+
+
+class Targeter:
+    """The cells of every placement on one board size, built once.
+
+    Up to DENSE_LIMIT entries the placements are a placement x cell 0/1
+    matrix and the per-shot sums are two matrix products. Past it (the
+    matrix would be 1.5 GB at 100 x 100) they stay rows of cell indexes:
+    sums over a placement's cells become gathers and per-cell totals
+    bincounts, O(placements) per shot whatever the board size.
+    """
+
+    def __init__(self, size=BOARD_SIZE):
+        self.size = size
+        self.cells = size * size
+        # Every head and orientation, in footprint_table order; heads come first in OFFSETS
+        offsets = np.array([OFFSETS[orientation] for orientation in ORIENTATIONS])
+        head_y, head_x = np.divmod(np.arange(self.cells), size)
+        xs = head_x[:, None, None] + offsets[None, :, :, 0]
+        ys = head_y[:, None, None] + offsets[None, :, :, 1]
+        fits = ((xs >= 0) & (xs < size) & (ys >= 0) & (ys < size)).all(axis=2)
+        self.footprints = (ys * size + xs)[fits]
+        self.head = self.footprints[:, 0]
+        self.cover = None
+        if len(self.footprints) * self.cells <= DENSE_LIMIT:
+            self.cover = np.zeros((len(self.footprints), self.cells), dtype=np.float32)
+            np.put_along_axis(self.cover, self.footprints, 1.0, axis=1)
+
+    def per_placement(self, values):
+        """Sum of values over each placement's cells"""
+        if self.cover is not None:
+            return self.cover @ values
+        return values[self.footprints].sum(axis=1)
+
+    def per_cell(self, weights):
+        """Sum of the weights of the placements covering each cell"""
+        if self.cover is not None:
+            return weights @ self.cover
+        return np.bincount(self.footprints.ravel(), minlength=self.cells,
+                           weights=np.repeat(weights, self.footprints.shape[1]))
+
+    def heatmaps(self, board):
+        """Occupancy and head densities per cell for the planes still alive on board"""
+        shots = mask_vector(board.shots, self.cells)
+        hits = mask_vector(board.hits, self.cells)
+        heads = mask_vector(board.hits & board.heads, self.cells)
+        misses = shots - hits
+
+        # A live plane covers no miss and no killed head, and its head was never shot
+        blocked = self.per_placement(misses + heads)
+        alive = (blocked == 0) & (shots[self.head] == 0)
+        weights = alive * (1.0 + HIT_WEIGHT * self.per_placement(hits - heads))
+
+        occupancy = self.per_cell(weights)
+        head_density = np.bincount(self.head, weights=weights, minlength=self.cells)
+        return occupancy, head_density, shots
+
+    def next_shot(self, board):
+        """(row, col) of the unshot cell most likely to be a head"""
+        occupancy, head_density, shots = self.heatmaps(board)
+        # Heads win the game; occupancy breaks ties while hunting
+        score = head_density + 1e-3 * occupancy
+        score[shots > 0] = -1.0
+        return divmod(int(np.argmax(score)), self.size)
+
+
+def targeter(size=BOARD_SIZE):
+    table = _targeters.get(size)
+    if table is None:
+        table = _targeters[size] = Targeter(size)
+    return table
+
+
+def next_shot(board):
+    """The bot's next shot at the opponent's board"""
+    return targeter(board.size).next_shot(board)
+
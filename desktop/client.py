@@ -1,45 +1,128 @@
+"""Pygame client for the desktop server.
+
+Usage: python client.py [--size N] [--planes P]
+
+The server pairs players asking for the same board and plane count, and
+falls back to the default board if the one asked for is not allowed.
+"""
+import argparse
 import pygame
+import queue
 import socket
-import pickle
+import threading
 from airplane import *
+import wire
+from bitboard import BOARD_SIZE, cell_bit, iter_cells
+from engine import MAX_PLANES
 
 class GameState:
-    def __init__(self):
+    def __init__(self, size, planes):
+        self.size = size
         self.placement_phase = True
         self.my_turn = False
         self.planes_placed = 0
-        self.max_airplanes = 3
+        self.max_airplanes = planes
         self.opponent_ready = False
         self.heads_hit = 0
         self.opponent_heads_hit = 0
-        self.my_shots = [[False for _ in range(10)] for _ in range(10)]
-        self.opponent_shots = [[False for _ in range(10)] for _ in range(10)]
+        # Masks and sets rather than grids, so nothing is rebuilt per frame on big boards
+        self.my_shots = 0  # bitmask of the cells I fired at, as sent to the server
+        self.opponent_shots = []
         self.head_positions = []
+        self.occupied = 0  # bitmask of my planes' cells, as returned by place_airplane
         self.shot_results = {}
-        self.flags = [[False for _ in range(10)] for _ in range(10)]  # Added flags grid
+        self.flags = set()  # (row, col) of unshot cells marked as deduced empty
 
 class NetworkClient:
-    def __init__(self):
+    """Talks to the server from background threads so the render loop never blocks.
+
+    send() queues a state for the sender thread and returns at once; the
+    receiver thread queues every update the server pushes, and poll() drains
+    them.
+    """
+    def __init__(self, size, planes):
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server = "localhost"
         self.port = 5555
         self.addr = (self.server, self.port)
+        self.decoder = wire.Decoder()
+        self.pending = []
+        self.inbound = queue.Queue()
+        self.outbound = queue.Queue()
+        self.connected = False
+        self.last_sent = None
+        # The board the server gave us, which HELLO may change from the one asked for
+        self.size, self.planes = size, planes
         self.id = self.connect()
         
     def connect(self):
         try:
             self.client.connect(self.addr)
-            return self.client.recv(2048).decode()
+            self.client.sendall(wire.encode_join(self.size, self.planes))
+            hello = wire.recv_message(self.client, self.decoder, self.pending)
+            player_id, self.size, self.planes = hello["player_id"], hello["size"], hello["planes"]
         except:
-            pass
-            
-    def send(self, data):
+            return None
+        self.connected = True
+        for target in (self.send_loop, self.receive_loop):
+            threading.Thread(target=target, daemon=True).start()
+        return player_id
+
+    def send_loop(self):
+        while self.connected:
+            frame = self.outbound.get()
+            if frame is None:
+                break
+            try:
+                self.client.sendall(frame)
+            except socket.error as e:
+                print(e)
+                self.connected = False
+
+    def receive_loop(self):
         try:
-            self.client.send(pickle.dumps(data))
-            return pickle.loads(self.client.recv(2048))
-        except socket.error as e:
+            while True:
+                message = wire.recv_message(self.client, self.decoder, self.pending)
+                if message is None:
+                    break
+                self.inbound.put(message)
+        except (socket.error, wire.WireError) as e:
             print(e)
-            return None
+        self.connected = False
+        self.outbound.put(None)
+
+    def send(self, data):
+        """Queue the local state, unless it is what the server already has"""
+        state = (data["occupied"], data["shots"], len(data["head_positions"]))
+        if state == self.last_sent:
+            return
+        self.last_sent = state
+        self.outbound.put(wire.encode_state(self.size, data["occupied"], data["shots"],
+                                            data["head_positions"]))
+
+    def poll(self):
+        """Every update received since the last call, oldest first"""
+        updates = []
+        while True:
+            try:
+                updates.append(self.inbound.get_nowait())
+            except queue.Empty:
+                return updates
+
+    def close(self):
+        self.connected = False
+        self.outbound.put(None)
+        try:
+            # shutdown wakes the receiver thread, which close alone would not
+            self.client.shutdown(socket.SHUT_RDWR)
+            self.client.close()
+        except socket.error:
+            pass
+
+parser = argparse.ArgumentParser(description="Airplane game client")
+parser.add_argument("--size", type=int, default=BOARD_SIZE, help="cells per side of the board")
+parser.add_argument("--planes", type=int, default=MAX_PLANES, help="planes per fleet")
+args = parser.parse_args()
 
 # Initialize pygame
 pygame.init()
@@ -60,7 +143,9 @@ GRAY = (100, 100, 100)
 PADDING = 20
 TOP_MARGIN = 60
 GRID_SPACING = 40
-ROWS = COLS = 10
+
+network = NetworkClient(args.size, args.planes)
+ROWS = COLS = network.size
 
 # Calculate grid dimensions
 cell_size = min((WIDTH - 2 * PADDING - GRID_SPACING) // (2 * COLS),
@@ -72,9 +157,15 @@ grid1_y = PADDING + TOP_MARGIN
 grid2_x = PADDING + COLS * cell_size + GRID_SPACING
 grid2_y = PADDING + TOP_MARGIN
 
-game_state = GameState()
-network = NetworkClient()
+game_state = GameState(network.size, network.planes)
 my_grid = [[(255, 255, 255) for _ in range(COLS)] for _ in range(ROWS)]
+
+# Both boards' empty cells never change, so they are drawn once
+blank_grid = pygame.Surface((COLS * cell_size, ROWS * cell_size))
+blank_grid.fill(WHITE)
+for line in range(ROWS + 1):
+    pygame.draw.line(blank_grid, BLACK, (0, line * cell_size), (COLS * cell_size, line * cell_size))
+    pygame.draw.line(blank_grid, BLACK, (line * cell_size, 0), (line * cell_size, ROWS * cell_size))
 current_orientation = 'up'
 font = pygame.font.Font(None, 36)
 
@@ -117,27 +208,26 @@ clock = pygame.time.Clock()
 while run:
     clock.tick(60)
     
-    # Get network data
-    try:
-        game_data = network.send({
-            "grid": my_grid,
-            "shots": game_state.my_shots,
-            "head_positions": game_state.head_positions
-        })
-        
-        if game_data:
-            game_state.opponent_ready = game_data.get("opponent_ready", False)
-            game_state.my_turn = game_data.get("your_turn", False)
-            game_state.placement_phase = game_data.get("placement_phase", True)
-            game_state.opponent_shots = game_data.get("opponent_shots", [])
-            game_state.heads_hit = game_data.get("heads_hit", 0)
-            game_state.opponent_heads_hit = game_data.get("opponent_heads_hit", 0)
-            if "shot_results" in game_data:
-                game_state.shot_results.update(game_data["shot_results"])
-    except:
+    # Send local changes and apply whatever the server pushed, without waiting
+    if not network.connected:
         run = False
         print("Couldn't get game")
         break
+    network.send({
+        "occupied": game_state.occupied,
+        "shots": game_state.my_shots,
+        "head_positions": game_state.head_positions
+    })
+
+    for game_data in network.poll():
+        game_state.opponent_ready = game_data.get("opponent_ready", False)
+        game_state.my_turn = game_data.get("your_turn", False)
+        game_state.placement_phase = game_data.get("placement_phase", True)
+        game_state.opponent_shots = list(iter_cells(game_data.get("opponent_shots", 0), ROWS))
+        game_state.heads_hit = game_data.get("heads_hit", 0)
+        game_state.opponent_heads_hit = game_data.get("opponent_heads_hit", 0)
+        if "shot_results" in game_data:
+            game_state.shot_results.update(game_data["shot_results"])
 
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
@@ -163,8 +253,8 @@ while run:
                     grid2_y <= pos[1] < grid2_y + ROWS * cell_size):
                     col = (pos[0] - grid2_x) // cell_size
                     row = (pos[1] - grid2_y) // cell_size
-                    if not game_state.my_shots[row][col]:  # Only flag unshot cells
-                        game_state.flags[row][col] = not game_state.flags[row][col]  # Toggle flag
+                    if not game_state.my_shots & cell_bit(row, col, ROWS):  # Only flag unshot cells
+                        game_state.flags ^= {(row, col)}  # Toggle flag
                 continue
             
             # Left click handling
@@ -176,8 +266,8 @@ while run:
                             col = (pos[0] - grid1_x) // cell_size
                             row = (pos[1] - grid1_y) // cell_size
                             airplane = Avion(Pozitie(col, row), current_orientation)
-                            if can_place_airplane(my_grid, airplane):
-                                place_airplane(my_grid, airplane)
+                            if can_place_airplane(my_grid, airplane, game_state.occupied):
+                                game_state.occupied = place_airplane(my_grid, airplane, game_state.occupied)
                                 game_state.planes_placed += 1
                                 game_state.head_positions.append((row, col))
                 
@@ -186,41 +276,33 @@ while run:
                         grid2_y <= pos[1] < grid2_y + ROWS * cell_size):
                         col = (pos[0] - grid2_x) // cell_size
                         row = (pos[1] - grid2_y) // cell_size
-                        if not game_state.my_shots[row][col]:
-                            game_state.my_shots[row][col] = True
-                            game_state.flags[row][col] = False  # Remove flag if cell is shot
+                        if not game_state.my_shots & cell_bit(row, col, ROWS):
+                            game_state.my_shots |= cell_bit(row, col, ROWS)
+                            game_state.flags.discard((row, col))  # Remove flag if cell is shot
+                            game_state.my_turn = False  # one shot per turn; the server ignores more
 
     win.fill(SKY_BLUE)
 
-    # Draw grids
-    for row in range(ROWS):
-        for col in range(COLS):
-            # Left grid (my grid)
-            rect1 = pygame.Rect(grid1_x + col * cell_size, 
-                              grid1_y + row * cell_size, 
-                              cell_size, cell_size)
-            pygame.draw.rect(win, my_grid[row][col], rect1)
-            pygame.draw.rect(win, BLACK, rect1, 1)
-
-            # Right grid (opponent's grid)
-            rect2 = pygame.Rect(grid2_x + col * cell_size, 
-                              grid2_y + row * cell_size, 
-                              cell_size, cell_size)
-            pygame.draw.rect(win, WHITE, rect2)
-            pygame.draw.rect(win, BLACK, rect2, 1)
+    # Draw grids, then my planes' cells over the left one
+    win.blit(blank_grid, (grid1_x, grid1_y))
+    win.blit(blank_grid, (grid2_x, grid2_y))
+    for row, col in iter_cells(game_state.occupied, ROWS):
+        rect1 = pygame.Rect(grid1_x + col * cell_size, 
+                          grid1_y + row * cell_size, 
+                          cell_size, cell_size)
+        pygame.draw.rect(win, my_grid[row][col], rect1)
+        pygame.draw.rect(win, BLACK, rect1, 1)
 
     # Draw shots and flags
     if not game_state.placement_phase:
         # Draw my shots and flags on right grid
-        for row in range(ROWS):
-            for col in range(COLS):
-                if game_state.my_shots[row][col]:
-                    shot_result = game_state.shot_results.get((row, col), "miss")
-                    draw_shot_marker(win, grid2_x + col * cell_size, 
-                                   grid2_y + row * cell_size, shot_result)
-                elif game_state.flags[row][col]:  # Draw flags on unshot cells
-                    draw_flag(win, grid2_x + col * cell_size, 
-                            grid2_y + row * cell_size)
+        for row, col in iter_cells(game_state.my_shots, ROWS):
+            shot_result = game_state.shot_results.get((row, col), "miss")
+            draw_shot_marker(win, grid2_x + col * cell_size, 
+                           grid2_y + row * cell_size, shot_result)
+        for row, col in game_state.flags:  # Flags are only ever on unshot cells
+            draw_flag(win, grid2_x + col * cell_size, 
+                    grid2_y + row * cell_size)
 
         # Draw opponent's shots on my grid
         for shot in game_state.opponent_shots:
@@ -252,8 +334,9 @@ while run:
     win.blit(score_text, score_rect)
     
     # Check for winner
-    if game_state.heads_hit >= 3 or game_state.opponent_heads_hit >= 3:
-        winner = "You win!" if game_state.heads_hit >= 3 else "Opponent wins!"
+    if game_state.heads_hit >= game_state.max_airplanes or \
+            game_state.opponent_heads_hit >= game_state.max_airplanes:
+        winner = "You win!" if game_state.heads_hit >= game_state.max_airplanes else "Opponent wins!"
         winner_text = font.render(winner, True, BLACK)
         winner_rect = winner_text.get_rect(center=(WIDTH // 2, HEIGHT // 2))
         pygame.draw.rect(win, WHITE, winner_rect.inflate(20, 20))
@@ -261,4 +344,5 @@ while run:
 
     pygame.display.update()
 
+network.close()
 pygame.quit()
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""Headless game engine: the rules without pygame or sockets.
+
+    game = new_game(seed=1)
+    place(game, 1, row, col, 'up')   # each player places their planes
+    fire(game, 1, row, col)          # 'miss', 'hit', 'head' or None
+    winner(game)                     # 1, 2 or None
+
+Placement uses the footprint table from airplane.py and shots the bitboards
+from bitboard.py. All randomness comes from game.rng, seeded by new_game, so
+a game replays exactly from its seed.
+"""
+import random
+
+from airplane import footprint_table, random_placements
+from bitboard import BOARD_SIZE, Board
+
+MAX_PLANES = 3
+PLAYERS = (1, 2)
+
+
+def opponent(player):
+    return 3 - player
+
+
+class Game:
+    __slots__ = ("size", "planes", "boards", "current_player", "placement_phase", "shots", "rng")
+
+    def __init__(self, size=BOARD_SIZE, planes=MAX_PLANES, seed=None):
+        self.size = size
+        self.planes = planes
+        # Player 1's fleet sits on boards[1]; shots land on the target's board
+        self.boards = {player: Board(size) for player in PLAYERS}
+        self.current_player = 1
+        self.placement_phase = True
+        self.shots = {player: 0 for player in PLAYERS}
+        self.rng = random.Random(seed)
+
+
+def new_game(size=BOARD_SIZE, planes=MAX_PLANES, seed=None):
+    return Game(size, planes, seed)
+
+
+def place(game, player, row, col, orientation):
+    """Place a plane with its head at (row, col); False if it does not fit"""
+    board = game.boards[player]
+    if not game.placement_phase or board.planes >= game.planes:
+        return False
+    footprint = footprint_table(game.size).get((col, row, orientation))
+    if footprint is None or footprint.mask & board.occupied:
+        return False
+    board.occupied |= footprint.mask
+    board.heads |= board.bit(row, col)
+    if all(board.planes >= game.planes for board in game.boards.values()):
+        game.placement_phase = False
+    return True
+
+
+def place_random(game, player):
+    """Fill the player's fleet with random placements drawn from game.rng"""
+    while game.boards[player].planes < game.planes:
+        # Placements that overlap planes already on the board are skipped
+        for row, col, orientation in random_placements(
+                game.rng, game.planes - game.boards[player].planes, game.size):
+            place(game, player, row, col, orientation)
+
+
+def fire(game, player, row, col):
+    """Resolve player's shot; None if it is not their turn or the cell was shot"""
+    if game.placement_phase or game.current_player != player or winner(game):
+        return None
+    result = game.boards[opponent(player)].fire(row, col)
+    if result is None:
+        return None
+    game.shots[player] += 1
+    game.current_player = opponent(player)
+    return result
+
+
+def winner(game):
+    """The player who hit every enemy head, or None while the game goes on"""
+    for player in PLAYERS:
+        if game.boards[opponent(player)].all_heads_hit():
+            return player
+    return None
@@ -1,18 +1,23 @@
+"""Two players taking turns at one screen.
+
+Usage: python main.py [--size N] [--planes P]
+"""
+import argparse
 import pygame
 from airplane import *
+from bitboard import BOARD_SIZE, Board, popcount
+from engine import MAX_PLANES
 
 class GameState:
-    def __init__(self):
+    def __init__(self, size=BOARD_SIZE, planes=MAX_PLANES):
         self.current_player = 1
-        self.max_airplanes = 3
+        self.max_airplanes = planes
         self.player1_airplanes = 0
         self.player2_airplanes = 0
         self.placement_phase = True
-        # New attributes for shooting phase
-        self.shots_grid1 = [[False for _ in range(10)] for _ in range(10)]  # Track shots on grid 1
-        self.shots_grid2 = [[False for _ in range(10)] for _ in range(10)]  # Track shots on grid 2
-        self.hits_player1 = 0  # Track hits for player 1
-        self.hits_player2 = 0  # Track hits for player 2
+        # Player 1's fleet sits on grid 1, player 2's on grid 2; shots are tracked on the target board
+        self.board1 = Board(size)
+        self.board2 = Board(size)
         
     def can_place_airplane(self, player):
         if player == 1:
@@ -32,10 +37,18 @@ class GameState:
     def switch_turn(self):
         self.current_player = 3 - self.current_player  # Switches between 1 and 2
         
+    @property
+    def hits_player1(self):
+        return popcount(self.board2.hits)
+
+    @property
+    def hits_player2(self):
+        return popcount(self.board1.hits)
+
     def get_winner(self):
-        if self.hits_player1 >= 30:  # Each plane has 10 cells, 3 planes = 30 hits needed
+        if self.board2.all_cells_hit():  # Every cell of every plane must be hit
             return 1
-        elif self.hits_player2 >= 30:
+        elif self.board1.all_cells_hit():
             return 2
         return None
 
@@ -52,17 +65,25 @@ RED = (255, 0, 0)
 BLUE = (0, 0, 255)
 GRAY = (128, 128, 128)
 
+parser = argparse.ArgumentParser(description="Two-player airplane game on one screen")
+parser.add_argument("--size", type=int, default=BOARD_SIZE, help="cells per side of the board")
+parser.add_argument("--planes", type=int, default=MAX_PLANES, help="planes per fleet")
+args = parser.parse_args()
+if not valid_mode(args.size, args.planes):
+    parser.error(f"boards are {MIN_BOARD_SIZE} to {MAX_BOARD_SIZE} cells wide and hold "
+                 f"at most {plane_limit(args.size)} planes at size {args.size}")
+
 # pygame setup
 pygame.init()
 screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
 clock = pygame.time.Clock()
 running = True
 
-game_state = GameState()
+game_state = GameState(args.size, args.planes)
 font = pygame.font.Font(None, 36)
 
 # Grid settings
-ROWS, COLS = 10, 10
+ROWS = COLS = args.size
 PADDING = 20
 GRID_SPACING = 40
 
@@ -83,12 +104,11 @@ grid_colors2 = [[(255, 255, 255) for _ in range(COLS)] for _ in range(ROWS)]
 
 current_orientation = 'up'
 
-def process_shot(grid_colors, shots_grid, row, col):
-    """Process a shot and return whether it was a hit"""
-    shots_grid[row][col] = True
-    if grid_colors[row][col] != WHITE:  # If the cell is not white, it's a hit
-        return True
-    return False
+def place_on_board(grid_colors, board, airplane):
+    """Place a plane on the colour grid and on the player's board"""
+    place_airplane(grid_colors, airplane)
+    board.add_plane((airplane.pozCap.y, airplane.pozCap.x),
+                    [(y, x) for x, y in airplane.get_positions()])
 
 def draw_shot_marker(screen, x, y, is_hit):
     """Draw a marker for a shot (X for miss, circle for hit)"""
@@ -129,7 +149,7 @@ while running:
                         row = (mouse_y - grid1_y) // cell_size
                         airplane = Avion(Pozitie(col, row), current_orientation)
                         if can_place_airplane(grid_colors, airplane):
-                            place_airplane(grid_colors, airplane)
+                            place_on_board(grid_colors, game_state.board1, airplane)
                             game_state.add_airplane(1)
                             game_state.switch_turn()
                 elif grid2_x <= mouse_x < grid2_x + COLS * cell_size and grid2_y <= mouse_y < grid2_y + ROWS * cell_size:
@@ -138,7 +158,7 @@ while running:
                         row = (mouse_y - grid2_y) // cell_size
                         airplane = Avion(Pozitie(col, row), current_orientation)
                         if can_place_airplane(grid_colors2, airplane):
-                            place_airplane(grid_colors2, airplane)
+                            place_on_board(grid_colors2, game_state.board2, airplane)
                             game_state.add_airplane(2)
                             game_state.switch_turn()
             else:
@@ -148,18 +168,14 @@ while running:
                     if grid2_x <= mouse_x < grid2_x + COLS * cell_size and grid2_y <= mouse_y < grid2_y + ROWS * cell_size:
                         col = (mouse_x - grid2_x) // cell_size
                         row = (mouse_y - grid2_y) // cell_size
-                        if not game_state.shots_grid2[row][col]:  # Check if not already shot
-                            if process_shot(grid_colors2, game_state.shots_grid2, row, col):
-                                game_state.hits_player1 += 1
+                        if game_state.board2.fire(row, col) is not None:  # None if already shot
                             game_state.switch_turn()
                 else:
                     # Player 2 shoots at grid 1
                     if grid1_x <= mouse_x < grid1_x + COLS * cell_size and grid1_y <= mouse_y < grid1_y + ROWS * cell_size:
                         col = (mouse_x - grid1_x) // cell_size
                         row = (mouse_y - grid1_y) // cell_size
-                        if not game_state.shots_grid1[row][col]:  # Check if not already shot
-                            if process_shot(grid_colors, game_state.shots_grid1, row, col):
-                                game_state.hits_player2 += 1
+                        if game_state.board1.fire(row, col) is not None:  # None if already shot
                             game_state.switch_turn()
 
     # Fill background
@@ -187,14 +203,14 @@ while running:
             # Draw shot markers
             if not game_state.placement_phase:
                 # Draw shots on grid 1
-                if game_state.shots_grid1[row][col]:
-                    is_hit = grid_colors[row][col] != WHITE
+                if game_state.board1.is_shot(row, col):
+                    is_hit = game_state.board1.result_at(row, col) != "miss"
                     draw_shot_marker(screen, grid1_x + col * cell_size, 
                                    grid1_y + row * cell_size, is_hit)
                 
                 # Draw shots on grid 2
-                if game_state.shots_grid2[row][col]:
-                    is_hit = grid_colors2[row][col] != WHITE
+                if game_state.board2.is_shot(row, col):
+                    is_hit = game_state.board2.result_at(row, col) != "miss"
                     draw_shot_marker(screen, grid2_x + col * cell_size, 
                                    grid2_y + row * cell_size, is_hit)
 
@@ -211,8 +227,8 @@ while running:
         p1_text = f"P1 Planes: {game_state.player1_airplanes}/{game_state.max_airplanes}"
         p2_text = f"P2 Planes: {game_state.player2_airplanes}/{game_state.max_airplanes}"
     else:
-        p1_text = f"P1 Hits: {game_state.hits_player1}/30"
-        p2_text = f"P2 Hits: {game_state.hits_player2}/30"
+        p1_text = f"P1 Hits: {game_state.hits_player1}/{popcount(game_state.board2.occupied)}"
+        p2_text = f"P2 Hits: {game_state.hits_player2}/{popcount(game_state.board1.occupied)}"
     
     p1_planes = font.render(p1_text, True, BLACK)
     p2_planes = font.render(p2_text, True, BLACK)
@@ -0,0 +1,280 @@
+"""Exact odds of where the planes are, from the shots fired at a board.
+
+Every fleet (set of non-overlapping placements, the bot's placement order
+as in airplane.iter_placements) that fits the evidence is equally likely:
+no plane covers a miss, every hit is a plane's body and every head shot is
+a plane's head. Over those fleets, Analysis gives for each cell the chance
+that a plane covers it and that it is a head.
+
+The fleets are kept as an array of placement indexes. Every fleet of an
+empty board is enumerated once per board size and plane count and shared;
+each Analysis filters its copy by the shots that are new since its last
+update, so following a game costs a few array operations per shot. When the
+empty board has more than ARRANGEMENT_LIMIT fleets, they are enumerated from
+the evidence instead, placing planes over hits first, which only fits late
+in a game on boards larger than 12 x 12.
+
+Enumeration is bounded in every way: a cheap estimate of the fleet count
+turns down evidence that would have too many before anything is built, the
+fleets go into an array of at most FLEET_ENTRIES placement indexes, and the
+search gives up after STEPS_PER_FLEET steps per fleet allowed.
+"""
+import math
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+import bot
+from airplane import footprint_table
+from bitboard import BOARD_SIZE, popcount
+from engine import MAX_PLANES
+
+ARRANGEMENT_LIMIT = 1 << 20
+# Most placement indexes held by one enumeration (16 MB), whatever the plane count
+FLEET_ENTRIES = 1 << 22
+# Partial fleets tried per fleet allowed before an enumeration gives up
+STEPS_PER_FLEET = 2
+# Placements whose overlaps with all the others are counted for an estimate
+ESTIMATE_SAMPLE = 64
+
+_fleets = {}  # (size, planes) -> every fleet of the empty board, or None if too many
+
+# Analysis.probabilities: per-cell arrays, and the count and shots mask of
+# the update they come from
+Posterior = namedtuple("Posterior", ["arrangements", "occupancy", "heads", "shots"])
+
+
+class TooManyArrangements(ValueError):
+    """Too many fleets fit; searched is False when the estimate alone said so"""
+
+    def __init__(self, message, searched=True):
+        super().__init__(message)
+        self.searched = searched
+
+
+def mask_bools(mask, cells):
+    return bot.mask_vector(mask, cells) > 0
+
+
+def fleet_limit(planes, limit=ARRANGEMENT_LIMIT):
+    """The most fleets of planes planes an enumeration may hold"""
+    return min(limit, FLEET_ENTRIES // planes)
+
+
+def estimate_fleets(size, planes, allowed=None, required=0):
+    """Roughly how many fleets of allowed placements cover the required cells.
+
+    Every planes-subset of the n placements, times the chance that none of
+    its pairs overlap (the share of overlapping pairs, measured on a sample
+    of the placements) and that each required cell is covered, as if cells
+    were independent. Within a few percent of the count on an empty board;
+    neighbouring hits make it low, which costs only a failed enumeration.
+    """
+    footprints = bot.targeter(size).footprints
+    if allowed is not None:
+        footprints = footprints[np.asarray(allowed, dtype=np.int64)]
+    n = len(footprints)
+    if n < planes:
+        return 0.0
+    # Bit k of a cell is set when the k-th sampled placement covers it
+    sample = footprints[np.linspace(0, n - 1, min(n, ESTIMATE_SAMPLE)).astype(np.int64)]
+    bits = np.zeros(size * size, dtype=np.uint64)
+    for k, cells in enumerate(sample):
+        bits[cells] |= np.uint64(1 << k)
+    overlaps = np.bitwise_or.reduce(bits[footprints], axis=1)
+    overlapping = sum(int(np.count_nonzero(overlaps >> np.uint64(k) & np.uint64(1)))
+                      for k in range(len(sample))) - len(sample)
+    apart = 1.0 - overlapping / (len(sample) * max(n - 1, 1))
+    if apart <= 0.0:
+        return 0.0 if planes > 1 else float(n)
+    log_count = (math.lgamma(n + 1) - math.lgamma(planes + 1) - math.lgamma(n - planes + 1) +
+                 math.comb(planes, 2) * math.log(apart))
+    if required:
+        cover = np.bincount(footprints.ravel(), minlength=size * size)
+        for cell in np.flatnonzero(mask_bools(required, size * size)):
+            if not cover[cell]:
+                return 0.0
+            log_count += math.log(-math.expm1(planes * math.log1p(-cover[cell] / n)))
+    return math.exp(min(log_count, 700.0))
+
+
+def enumerate_fleets(size, planes, allowed=None, required=0, limit=ARRANGEMENT_LIMIT):
+    """Every fleet of allowed placements covering the required cells, as an (n, planes) array.
+
+    Planes over the lowest required cell not yet covered are placed first,
+    then the rest in placement order, so each fleet comes up once. Raises
+    TooManyArrangements, without trying, when the estimate is past
+    fleet_limit(planes, limit) fleets, and once more fleets than that turn up
+    or the search runs out of steps.
+    """
+    limit = fleet_limit(planes, limit)
+    estimate = estimate_fleets(size, planes, allowed, required)
+    if estimate > limit:
+        raise TooManyArrangements(f"About {estimate:.3g} fleets fit the evidence, more than {limit}",
+                                  searched=False)
+    masks = [footprint.mask for footprint in footprint_table(size).values()]
+    if allowed is None:
+        allowed = range(len(masks))
+    allowed = list(allowed)
+    covering = {}  # required cell -> allowed placements covering it
+    fleets = np.empty((min(limit, 1024), planes), dtype=np.int32)
+    count = 0
+    steps = STEPS_PER_FLEET * limit
+    chosen = []
+
+    def extend(start, occupied, uncovered):
+        nonlocal fleets, count, steps
+        steps -= 1
+        if steps < 0:
+            raise TooManyArrangements(f"Gave up counting the fleets that fit the evidence "
+                                      f"after {STEPS_PER_FLEET * limit} steps")
+        if len(chosen) == planes:
+            if not uncovered:
+                if count == len(fleets):
+                    if count == limit:
+                        raise TooManyArrangements(f"More than {limit} fleets fit the evidence")
+                    fleets = np.resize(fleets, (min(2 * count, limit), planes))
+                fleets[count] = chosen
+                count += 1
+            return
+        if uncovered:
+            low = uncovered & -uncovered
+            if low not in covering:
+                covering[low] = [index for index in allowed if masks[index] & low]
+            for index in covering[low]:
+                if not masks[index] & occupied:
+                    chosen.append(index)
+                    extend(start, occupied | masks[index], uncovered & ~masks[index])
+                    chosen.pop()
+            return
+        for position in range(start, len(allowed)):
+            index = allowed[position]
+            if not masks[index] & occupied:
+                chosen.append(index)
+                extend(position + 1, occupied | masks[index], 0)
+                chosen.pop()
+
+    extend(0, 0, required)
+    return fleets[:count].copy()
+
+
+def empty_board_fleets(size, planes):
+    """Every fleet of the empty board, built once; None if there are too many"""
+    key = (size, planes)
+    if key not in _fleets:
+        try:
+            _fleets[key] = enumerate_fleets(size, planes)
+        except TooManyArrangements:
+            _fleets[key] = None
+    return _fleets[key]
+
+
+class Analysis:
+    """The fleets of one board that fit the shots fired at it so far"""
+
+    def __init__(self, size=BOARD_SIZE, planes=MAX_PLANES, limit=ARRANGEMENT_LIMIT):
+        self.size = size
+        self.planes = planes
+        self.cells = size * size
+        self.limit = fleet_limit(planes, limit)
+        self.targeter = bot.targeter(size)
+        self.fleets = None
+        self.shots = self.hits = self.heads = 0  # the evidence the fleets fit
+        self.failed = None  # shots fired when there were last too many fleets
+        self.lock = threading.Lock()
+
+    @property
+    def count(self):
+        return len(self.fleets) if self.fleets is not None else None
+
+    @property
+    def nbytes(self):
+        """Memory held by the fleets (shared with the empty-board cache until the first shot)"""
+        fleets = self.fleets
+        return fleets.nbytes if fleets is not None else 0
+
+    def update(self, shots, hits, heads):
+        """Bring the fleets up to date with the masks of shots, hits and heads hit.
+
+        Evidence that does not extend the last update's (another game on
+        the same board) starts over. Raises TooManyArrangements, and after
+        a search that gave up, raises it again without trying until size
+        more shots are in.
+        """
+        with self.lock:
+            hits &= shots
+            heads &= hits
+            known = self.shots
+            if shots & known != known or hits & known != self.hits or heads & known != self.heads:
+                self.fleets = self.failed = None
+                self.shots = self.hits = self.heads = 0
+            if self.fleets is None:
+                if self.failed is not None and popcount(shots) < self.failed + self.size:
+                    raise TooManyArrangements(f"More than {self.limit} fleets fit the evidence")
+                self.fleets = empty_board_fleets(self.size, self.planes)
+                self.shots = self.hits = self.heads = 0
+                if self.fleets is None or len(self.fleets) > self.limit:
+                    self.fleets = None
+                    self._enumerate(shots, hits, heads)
+            self._filter(shots & ~self.shots, hits & ~self.hits, heads & ~self.heads)
+            self.shots, self.hits, self.heads = shots, hits, heads
+            return self
+
+    def _unfit(self, shots, hits, heads):
+        """Per placement, whether the evidence rules it out"""
+        footprints = self.targeter.footprints
+        misses = mask_bools(shots & ~hits, self.cells)
+        bodies = mask_bools(hits & ~heads, self.cells)
+        head_shots = mask_bools(heads, self.cells)
+        # A miss under it, a body hit at its head or a head hit elsewhere in it
+        return (misses[footprints].any(axis=1) | bodies[footprints[:, 0]] |
+                head_shots[footprints[:, 1:]].any(axis=1))
+
+    def _enumerate(self, shots, hits, heads):
+        """Enumerate the fleets fitting the evidence, which then needs no filtering"""
+        allowed = np.flatnonzero(~self._unfit(shots, hits, heads)).tolist()
+        self.shots, self.hits, self.heads = shots, hits, heads
+        try:
+            self.fleets = enumerate_fleets(self.size, self.planes, allowed, hits, self.limit)
+        except TooManyArrangements as e:
+            if e.searched:
+                self.failed = popcount(shots)
+            raise
+        self.failed = None
+
+    def _filter(self, shots, hits, heads):
+        """Keep the fleets that fit the evidence of newly shot cells"""
+        if not shots or not len(self.fleets):
+            return
+        keep = ~self._unfit(shots, hits, heads)[self.fleets].any(axis=1)
+        # Each new hit must be under one of the fleet's planes
+        for cell in np.flatnonzero(mask_bools(hits, self.cells)):
+            covers = (self.targeter.footprints == cell).any(axis=1)
+            keep &= covers[self.fleets].any(axis=1)
+        self.fleets = self.fleets[keep]
+
+    def probabilities(self):
+        """The Posterior of the last update: per cell, the share of fitting fleets with a plane / a head there"""
+        with self.lock:
+            fleets, shots = self.fleets, self.shots
+        if fleets is None:
+            raise ValueError("Analysis has not been updated")
+        if not len(fleets):
+            zeros = np.zeros(self.cells)
+            return Posterior(0, zeros, zeros, shots)
+        counts = np.bincount(fleets.ravel(), minlength=len(self.targeter.footprints)).astype(float)
+        occupancy = self.targeter.per_cell(counts) / len(fleets)
+        heads = np.bincount(self.targeter.head, weights=counts, minlength=self.cells) / len(fleets)
+        return Posterior(len(fleets), occupancy, heads, shots)
+
+
+def analyze(board, planes=MAX_PLANES, analysis=None):
+    """The Analysis of board (a Board or Observations) holding planes planes.
+
+    Pass the Analysis returned by the previous call for the same board to
+    update it with only the shots fired since.
+    """
+    if analysis is None or (analysis.size, analysis.planes) != (board.size, planes):
+        analysis = Analysis(board.size, planes)
+    return analysis.update(board.shots, board.hits, board.heads)
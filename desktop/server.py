@@ -1,156 +1,249 @@
-import socket
-import pickle
-from collections import defaultdict
+import asyncio
+import os
 import signal
 import sys
-import threading
+import bot
+from airplane import random_fleet, valid_mode
+from bitboard import BOARD_SIZE, Board, iter_cells
+from engine import MAX_PLANES
+import wire
 
-class GameServer:
-    def __init__(self):
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        
-        # Set a timeout on the socket so accept() doesn't block forever
-        self.server.settimeout(1.0)
-        
-        self.server.bind(('localhost', 5555))
-        self.server.listen(2)
-        print("Server started, waiting for connections...")
-        
-        self.games = {}
-        self.players = {}
-        self.grids = {}
-        self.shots = defaultdict(list)
-        self.head_positions = defaultdict(list)
-        self.heads_hit = defaultdict(int)
+# Seconds a player waits alone before the bot takes the other seat; 0 disables it
+BOT_TIMEOUT = float(os.environ.get("AVIOANE_BOT_TIMEOUT", "30"))
+
+class Game:
+    """One two-player game; games share nothing but the server"""
+    __slots__ = ("game_id", "size", "planes", "players", "boards", "current_player",
+                 "placement_phase", "bot")
+
+    def __init__(self, game_id, size=BOARD_SIZE, planes=MAX_PLANES):
+        self.game_id = game_id
+        self.size = size
+        self.planes = planes
+        self.players = {}  # player_id -> StreamWriter
+        self.boards = {}
         self.current_player = "1"
         self.placement_phase = True
-        self.running = True
-        
-        # Set up signal handler
-        signal.signal(signal.SIGINT, self.signal_handler)
-        
-    def signal_handler(self, sig, frame):
-        print("\nShutting down server...")
-        self.shutdown()
-        sys.exit(0)
-        
-    def shutdown(self):
-        self.running = False
-        # Close all client connections
-        for conn in self.players.values():
-            try:
-                conn.close()
-            except:
-                pass
-        # Close server socket
+        self.bot = None  # player id of the bot seat, if the bot plays
+
+    def add_bot(self):
+        """Seat the computer opponent as player 2 with a random fleet"""
+        self.bot = "2"
+        board = self.boards[self.bot] = Board(self.size)
+        for head, cells in random_fleet(planes=self.planes, size=self.size):
+            board.add_plane(head, cells)
+        self.check_placement()
+
+    def run_bot(self):
+        """Let the bot take its turn, if it is the bot's turn"""
+        while self.bot == self.current_player and not self.placement_phase and not self.is_over():
+            target_id = "2" if self.bot == "1" else "1"
+            row, col = bot.next_shot(self.boards[target_id])
+            self.boards[target_id].fire(row, col)
+            self.current_player = target_id
+
+    def check_placement(self):
+        """End the placement phase once both players placed their planes"""
+        if self.placement_phase:
+            if len(self.boards) == 2:
+                planes_placed_p1 = self.boards["1"].planes
+                planes_placed_p2 = self.boards["2"].planes
+                if planes_placed_p1 >= self.planes and planes_placed_p2 >= self.planes:
+                    self.placement_phase = False
+                    print(f"Game {self.game_id}: placement phase complete, starting game")
+
+    def is_over(self):
+        return any(board.all_heads_hit() for board in self.boards.values())
+
+    def apply_state(self, player_id, data):
+        """Apply a client STATE message and return the result of its new shot.
+
+        Only the player whose turn it is can shoot, once per turn: the first
+        new cell of the shots mask is fired at and any others are ignored.
+        """
+        if data["size"] != self.size:
+            raise wire.WireError(f"Board of size {data['size']} sent to a game of size {self.size}")
+        cells = self.size * self.size
+        if data["occupied"] >> cells or data["shots"] >> cells:
+            raise wire.WireError(f"Cells outside the {self.size}x{self.size} board")
+        # Update server state, only rebuilding the board when a plane was added
+        board = self.boards.setdefault(player_id, Board(self.size))
+        head_positions = data["head_positions"]
+        if len(head_positions) != board.planes:
+            if not all(0 <= row < self.size and 0 <= col < self.size for row, col in head_positions):
+                raise wire.WireError(f"Head outside the {self.size}x{self.size} board")
+            board.load_masks(data["occupied"], head_positions)
+
+        # Check if placement phase is complete
+        self.check_placement()
+
+        opponent_id = "2" if player_id == "1" else "1"
+        target = self.boards.get(opponent_id)
+        if target is None or self.placement_phase or self.current_player != player_id or self.is_over():
+            return {}
+        new_shot = next(iter_cells(data["shots"] & ~target.shots, self.size), None)
+        if new_shot is None:
+            return {}
+        shot_results = {new_shot: target.fire(*new_shot)}
+        self.current_player = opponent_id
+        self.run_bot()
+        return shot_results
+
+    def view(self, player_id, shot_results=None):
+        """The update a player sees; shot_results are their newly resolved shots"""
+        board = self.boards.get(player_id)
+        target = self.boards.get("2" if player_id == "1" else "1")
+        return {
+            "opponent_ready": len(self.boards) == 2,
+            "your_turn": self.current_player == player_id,
+            "placement_phase": self.placement_phase,
+            "opponent_shots": board.shots if board else 0,
+            "heads_hit": target.heads_hit if target else 0,
+            "opponent_heads_hit": board.heads_hit if board else 0,
+            "shot_results": shot_results or {}
+        }
+
+class GameServer:
+    def __init__(self, host='localhost', port=5555, bot_timeout=BOT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.bot_timeout = bot_timeout
+        self.server = None
+        self.games = {}
+        self.waiting = {}  # (size, planes) -> game with one player, waiting for an opponent
+        self.next_game_id = 0
+        self.stopping = None
+
+    def join(self, writer, mode):
+        """Pair the new player with the one waiting on the same board, or open a new game"""
+        game = self.waiting.get(mode)
+        if game is None:
+            game = Game(str(self.next_game_id), *mode)
+            self.next_game_id += 1
+            self.games[game.game_id] = game
+            self.waiting[mode] = game
+            if self.bot_timeout > 0:
+                asyncio.get_running_loop().call_later(self.bot_timeout, self.fill_with_bot, game)
+        player_id = str(len(game.players) + 1)
+        game.players[player_id] = writer
+        if len(game.players) == 2:
+            del self.waiting[mode]
+        return game, player_id
+
+    def fill_with_bot(self, game):
+        """Give a player who waited too long the bot as opponent"""
+        mode = (game.size, game.planes)
+        if self.waiting.get(mode) is not game or not game.players:
+            return
+        del self.waiting[mode]
+        game.add_bot()
+        print(f"Bot joined game {game.game_id}")
+        for player_id, writer in game.players.items():
+            writer.write(wire.encode_update(game.view(player_id), game.size))
+
+    def leave(self, game, player_id):
+        """End the game when one of its players leaves"""
+        game.players.pop(player_id, None)
+        mode = (game.size, game.planes)
+        if self.waiting.get(mode) is game:
+            del self.waiting[mode]
+        if self.games.pop(game.game_id, None) is not None:
+            print(f"Game {game.game_id} ended")
+        # The opponent has nobody left to play against
+        for writer in game.players.values():
+            writer.close()
+
+    async def read_join(self, reader, decoder):
+        """The (size, planes) the client's JOIN asks for, or None if it hung up first"""
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                return None
+            for message in decoder.feed(data):
+                if message["type"] == wire.JOIN:
+                    mode = (message["size"], message["planes"])
+                    # HELLO tells the client which board it got
+                    return mode if valid_mode(*mode) else (BOARD_SIZE, MAX_PLANES)
+
+    async def handle_client(self, reader, writer):
+        decoder = wire.Decoder()
         try:
-            self.server.close()
-        except:
-            pass
-        
-    def handle_client(self, conn, player_id):
-        while self.running:
-            try:
-                data = pickle.loads(conn.recv(4096))
+            mode = await self.read_join(reader, decoder)
+        except (ConnectionError, wire.WireError) as e:
+            print("Error before joining:", e)
+            mode = None
+        if mode is None:
+            writer.close()
+            return
+        game, player_id = self.join(writer, mode)
+        addr = writer.get_extra_info('peername')
+        print(f"Player {player_id} of game {game.game_id} ({game.size}x{game.size}, "
+              f"{game.planes} planes) connected from {addr}")
+
+        try:
+            writer.write(wire.encode_hello(player_id, game.size, game.planes))
+            await writer.drain()
+            while True:
+                data = await reader.read(4096)
                 if not data:
                     break
-
-                # Update server state
-                self.grids[player_id] = data["grid"]
-                if "head_positions" in data:
-                    self.head_positions[player_id] = data["head_positions"]
-                    
+                messages = [message for message in decoder.feed(data) if message["type"] == wire.STATE]
+                if not messages:
+                    continue
+                replies = [
+                    wire.encode_update(game.view(player_id, game.apply_state(player_id, message)),
+                                       game.size)
+                    for message in messages
+                ]
+                # Every message in the read is answered with a single write,
+                # and the opponent is pushed the new state of the game
+                writer.write(b"".join(replies))
                 opponent_id = "2" if player_id == "1" else "1"
-                current_shots = data.get("shots", [])
-                
-                shot_results = {}
-                # Process new shots
-                for row in range(len(current_shots)):
-                    for col in range(len(current_shots[row])):
-                        if current_shots[row][col] and (row, col) not in self.shots[player_id]:
-                            self.shots[player_id].append((row, col))
-                            # Check if it's a head shot
-                            if (row, col) in self.head_positions[opponent_id]:
-                                shot_results[(row, col)] = "head"
-                                self.heads_hit[player_id] += 1
-                            # Check if it's a body shot
-                            elif opponent_id in self.grids and self.grids[opponent_id][row][col] != (255, 255, 255):
-                                shot_results[(row, col)] = "hit"
-                            else:
-                                shot_results[(row, col)] = "miss"
-
-                # Check if placement phase is complete
-                if self.placement_phase:
-                    if len(self.grids) == 2:
-                        planes_placed_p1 = len(self.head_positions["1"])
-                        planes_placed_p2 = len(self.head_positions["2"])
-                        if planes_placed_p1 >= 3 and planes_placed_p2 >= 3:
-                            self.placement_phase = False
-                            print("Placement phase complete, starting game")
-
-                # Prepare response
-                response = {
-                    "opponent_ready": len(self.grids) == 2,
-                    "your_turn": self.current_player == player_id,
-                    "placement_phase": self.placement_phase,
-                    "opponent_shots": self.shots[opponent_id],
-                    "heads_hit": self.heads_hit[player_id],
-                    "opponent_heads_hit": self.heads_hit[opponent_id],
-                    "shot_results": shot_results
-                }
-
-                # Switch turns if a shot was made
-                if shot_results and not self.placement_phase:
-                    self.current_player = opponent_id
-
-                conn.send(pickle.dumps(response))
-                
-            except Exception as e:
-                print(f"Error handling client {player_id}:", e)
-                break
-                
-        print(f"Client {player_id} disconnected")
-        if player_id in self.players:
-            del self.players[player_id]
-        conn.close()
-
-    def run(self):
-        while self.running:
+                opponent = game.players.get(opponent_id)
+                if opponent is not None:
+                    opponent.write(wire.encode_update(game.view(opponent_id), game.size))
+                await writer.drain()
+                if opponent is not None:
+                    try:
+                        await opponent.drain()
+                    except ConnectionError:
+                        pass  # the opponent's own handler sees it and ends the game
+        except (ConnectionError, wire.WireError) as e:
+            print(f"Error handling player {player_id} of game {game.game_id}:", e)
+        finally:
+            print(f"Player {player_id} of game {game.game_id} disconnected")
+            self.leave(game, player_id)
+            writer.close()
+
+    def shutdown(self):
+        if self.stopping and not self.stopping.is_set():
+            print("\nShutting down server...")
+            self.stopping.set()
+
+    async def run(self):
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
             try:
-                conn, addr = self.server.accept()
-                player_id = str(len(self.players) + 1)
-                print(f"Player {player_id} connected from {addr}")
-                
-                conn.send(str.encode(player_id))
-                self.players[player_id] = conn
-                
-                # Start a new thread for this client
-                client_thread = threading.Thread(
-                    target=self.handle_client,
-                    args=(conn, player_id)
-                )
-                client_thread.daemon = True
-                client_thread.start()
-                
-                if len(self.players) > 2:
-                    print("Extra player tried to connect")
-                    conn.close()
-                
-            except socket.timeout:
-                # This allows checking the running flag periodically
-                continue
-            except KeyboardInterrupt:
-                break
-            except Exception as e:
-                print(f"Error accepting connection: {e}")
-                if not self.running:
-                    break
+                loop.add_signal_handler(sig, self.shutdown)
+            except NotImplementedError:  # Windows
+                pass
+
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print("Server started, waiting for connections...")
+        async with self.server:
+            await self.stopping.wait()
+            self.server.close()
+            # Close all client connections
+            for game in list(self.games.values()):
+                for writer in list(game.players.values()):
+                    writer.close()
+            await self.server.wait_closed()
 
 if __name__ == "__main__":
     server = GameServer()
     try:
-        server.run()
+        asyncio.run(server.run())
     except KeyboardInterrupt:
         print("\nReceived keyboard interrupt, shutting down...")
-        server.shutdown()
\ No newline at end of file
+        sys.exit(0)
@@ -0,0 +1,118 @@
+"""Play batches of headless self-play games across a process pool.
+
+Usage: python simulate.py [--games N] [--workers W] [--batch B] [--seed S]
+                          [--strategy density|random|parity|hunt]
+                          [--opponent density|random|parity|hunt]
+
+Prints running totals as batches finish: games per second, average shots
+to win, who wins and how many heads the loser had hit when the game ended.
+Strategies are the classes in strategies.py; play_game and run_batches are
+also what tournament.py plays with.
+"""
+import argparse
+import os
+import random
+import signal
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import engine
+from strategies import STRATEGIES, Observations
+
+
+def observe(board):
+    """What the player firing at board can see of it"""
+    return Observations(board.size, board.planes, board.shots, board.hits, board.heads & board.shots)
+
+
+def play_game(seed, strategies):
+    """Play one game between player 1 and 2's strategy classes.
+
+    Returns (winner, winner's shots, heads the loser hit, forfeit): forfeit
+    is True when the loser broke the rules rather than lost their last head.
+    A strategy whose placement is illegal, or that fires outside the board or
+    at a cell already shot, loses.
+    """
+    game = engine.new_game(seed=seed)
+    players = {player: strategies[player](random.Random(f"{seed}:{player}"))
+               for player in engine.PLAYERS}
+    for player in engine.PLAYERS:
+        fleet = players[player].place(game.size, game.planes)
+        if len(fleet) != game.planes or \
+                not all(engine.place(game, player, row, col, orientation)
+                        for row, col, orientation in fleet):
+            return engine.opponent(player), 0, 0, True
+    while engine.winner(game) is None:
+        player = game.current_player
+        row, col = players[player].next_shot(observe(game.boards[engine.opponent(player)]))
+        if not (0 <= row < game.size and 0 <= col < game.size) or \
+                engine.fire(game, player, row, col) is None:
+            winner = engine.opponent(player)
+            return winner, game.shots[winner], game.boards[winner].heads_hit, True
+    winner = engine.winner(game)
+    return winner, game.shots[winner], game.boards[winner].heads_hit, False
+
+
+def run_batches(function, batches, workers):
+    """Yield function(*batch) for every batch as they finish, across a process pool.
+
+    Workers leave Ctrl-C to this process: the KeyboardInterrupt reaches the
+    caller and the batches not started yet are dropped.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=signal.signal,
+                               initargs=(signal.SIGINT, signal.SIG_IGN))
+    try:
+        futures = [pool.submit(function, *batch) for batch in batches]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def play_batch(first_seed, count, strategy, opponent_strategy):
+    """Play count games seeded first_seed, first_seed + 1, ... and aggregate them"""
+    strategies = {1: STRATEGIES[strategy], 2: STRATEGIES[opponent_strategy]}
+    wins = Counter()
+    shots = 0
+    loser_heads = Counter()
+    for seed in range(first_seed, first_seed + count):
+        winner, winner_shots, heads, _ = play_game(seed, strategies)
+        wins[winner] += 1
+        shots += winner_shots
+        loser_heads[heads] += 1
+    return {"games": count, "wins": wins, "shots": shots, "loser_heads": loser_heads}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless self-play simulation")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--strategy", choices=STRATEGIES, default="density")
+    parser.add_argument("--opponent", choices=STRATEGIES, default=None,
+                        help="player 2's strategy (default: same as --strategy)")
+    args = parser.parse_args()
+    opponent_strategy = args.opponent or args.strategy
+
+    totals = {"games": 0, "wins": Counter(), "shots": 0, "loser_heads": Counter()}
+    start = time.perf_counter()
+    batches = [(args.seed + first, min(args.batch, args.games - first), args.strategy, opponent_strategy)
+               for first in range(0, args.games, args.batch)]
+    for batch in run_batches(play_batch, batches, args.workers):
+        totals["games"] += batch["games"]
+        totals["wins"].update(batch["wins"])
+        totals["shots"] += batch["shots"]
+        totals["loser_heads"].update(batch["loser_heads"])
+        elapsed = time.perf_counter() - start
+        games = totals["games"]
+        heads = " ".join(f"{h}:{totals['loser_heads'][h] / games:.1%}"
+                         for h in sorted(totals["loser_heads"]))
+        print(f"{games:8d} games  {games / elapsed:8.0f} games/s  "
+              f"{totals['shots'] / games:5.1f} shots to win  "
+              f"P1 {totals['wins'][1] / games:.1%}  loser heads hit {heads}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
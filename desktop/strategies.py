@@ -0,0 +1,114 @@
+"""Placement and targeting strategies for simulate.py and tournament.py.
+
+A strategy is a class constructed with a random.Random and providing
+
+    place(board_size, n_planes)  -> [(row, col, orientation), ...] head and
+                                    orientation of each plane, as engine.place
+    next_shot(observations)      -> (row, col) of an unshot cell
+
+observations is everything the shooter can see of the opponent's board: its
+size and plane count, and bitmasks (bit row * size + col, as in bitboard.py)
+of the cells shot, the shots that hit a plane and the heads among them.
+bot.next_shot takes it as it would a Board.
+
+Any class with these methods can take part: tournament.py loads
+"module:Class" or "path/to/file.py:Class" as well as the names in
+STRATEGIES. Deriving from Strategy gives random placement and helpers.
+"""
+from collections import namedtuple
+
+from airplane import random_placements
+from bitboard import iter_cells
+
+Observations = namedtuple("Observations", ["size", "planes", "shots", "hits", "heads"])
+
+
+class Strategy:
+    """Random placement; subclasses choose the shots"""
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def place(self, board_size, n_planes):
+        return random_placements(self.rng, n_planes, board_size)
+
+    def next_shot(self, observations):
+        raise NotImplementedError
+
+    @staticmethod
+    def unshot(observations, mask=None):
+        """Unshot cells as (row, col), restricted to mask if given"""
+        size = observations.size
+        free = ((1 << size * size) - 1) & ~observations.shots
+        return list(iter_cells(free if mask is None else free & mask, size))
+
+
+class RandomStrategy(Strategy):
+    """Any cell not shot yet"""
+
+    def next_shot(self, observations):
+        return self.rng.choice(self.unshot(observations))
+
+
+def parity_mask(size, parity=0):
+    """Bits of the cells with (row + col) % 2 == parity"""
+    mask = 0
+    for row in range(size):
+        for col in range(size):
+            if (row + col) % 2 == parity:
+                mask |= 1 << (row * size + col)
+    return mask
+
+
+class ParityStrategy(Strategy):
+    """Random cells of one checkerboard colour first.
+
+    Every plane covers cells of both colours, so the first pass finds each
+    of them; the other colour is shot after it.
+    """
+
+    def __init__(self, rng):
+        super().__init__(rng)
+        self.parity = rng.randrange(2)
+        self.masks = {}
+
+    def next_shot(self, observations):
+        mask = self.masks.get(observations.size)
+        if mask is None:
+            mask = self.masks[observations.size] = parity_mask(observations.size, self.parity)
+        return self.rng.choice(self.unshot(observations, mask) or self.unshot(observations))
+
+
+class HuntTargetStrategy(ParityStrategy):
+    """Hunt on the checkerboard; after a body hit, shoot the cells around it.
+
+    A hit that is not a head means a head is nearby, so the unshot
+    neighbours of body hits are fired at before hunting goes on.
+    """
+
+    def next_shot(self, observations):
+        size = observations.size
+        targets = []
+        for row, col in iter_cells(observations.hits & ~observations.heads, size):
+            for r, c in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1)):
+                if 0 <= r < size and 0 <= c < size and not observations.shots >> (r * size + c) & 1:
+                    targets.append((r, c))
+        if targets:
+            return self.rng.choice(targets)
+        return super().next_shot(observations)
+
+
+class DensityStrategy(Strategy):
+    """The computer opponent's probability-density targeting from bot.py"""
+
+    def next_shot(self, observations):
+        import bot  # NumPy is only needed by this strategy
+        return bot.next_shot(observations)
+
+
+STRATEGIES = {
+    "random": RandomStrategy,
+    "parity": ParityStrategy,
+    "hunt": HuntTargetStrategy,
+    "density": DensityStrategy,
+}
@@ -0,0 +1,31 @@
+"""Random fleets fill every mode valid_mode allows.
+
+Run with python -m pytest from desktop/.
+"""
+import random
+
+import pytest
+
+from airplane import MAX_BOARD_SIZE, MIN_BOARD_SIZE, OFFSETS, plane_limit, random_placements, valid_mode
+
+SEEDS = 20
+
+
+@pytest.mark.parametrize("size", range(MIN_BOARD_SIZE, MAX_BOARD_SIZE + 1))
+def test_densest_fleet_fits(size):
+    planes = plane_limit(size)
+    assert valid_mode(size, planes)
+    for seed in range(SEEDS):
+        placements = random_placements(random.Random(seed), planes, size)
+        assert len(placements) == planes
+        occupied = set()
+        for row, col, orientation in placements:
+            cells = {(col + dx, row + dy) for dx, dy in OFFSETS[orientation]}
+            assert all(0 <= x < size and 0 <= y < size for x, y in cells)
+            assert not occupied & cells
+            occupied |= cells
+
+
+def test_impossible_fleet_is_reported():
+    with pytest.raises(ValueError):
+        random_placements(random.Random(0), 2, MIN_BOARD_SIZE)
@@ -0,0 +1,237 @@
+"""Round-robin tournament between placement and targeting strategies.
+
+Usage: python tournament.py [--strategies random,parity,hunt,density]
+                            [--games N] [--workers W] [--batch B] [--seed S]
+                            [--results tournament.jsonl]
+
+Every pair of strategies plays N games through simulate.play_game, swapping
+who fires first each game. Strategies are the names in strategies.STRATEGIES,
+or plugins given as "module:Class" or "path/to/file.py:Class" (see
+strategies.py for the interface). A strategy whose placement is illegal, or
+that fires outside the board or at a cell already shot, loses that game.
+
+Batches of games are spread over a process pool (simulate.run_batches) and
+every finished batch is appended to the results file as one JSON line, so an
+interrupted run picks up where it stopped when started again with the same
+file, seed and batch size; adding strategies or games to a finished run
+plays only what is new.
+Once every batch is in, prints each strategy's rating and a table of win
+rates. Ratings are on the Elo scale (400 points for 10:1 odds, averaging
+1500), fitted to all the results at once so they do not depend on the order
+the batches finished in.
+"""
+import argparse
+import importlib
+import importlib.util
+import itertools
+import json
+import math
+import os
+import time
+from collections import Counter
+
+import engine
+from simulate import play_game, run_batches
+from strategies import STRATEGIES
+
+_loaded = {}
+
+
+def load_strategy(spec):
+    """The strategy class named by spec: a built-in name, module:Class or file.py:Class"""
+    strategy = _loaded.get(spec)
+    if strategy is not None:
+        return strategy
+    if spec in STRATEGIES:
+        strategy = STRATEGIES[spec]
+    else:
+        location, _, attribute = spec.rpartition(":")
+        if not location or not attribute:
+            raise ValueError(f"Unknown strategy {spec!r}; use one of {', '.join(STRATEGIES)}, "
+                             "module:Class or path/to/file.py:Class")
+        if location.endswith(".py"):
+            module_spec = importlib.util.spec_from_file_location(
+                os.path.splitext(os.path.basename(location))[0], location)
+            module = importlib.util.module_from_spec(module_spec)
+            module_spec.loader.exec_module(module)
+        else:
+            module = importlib.import_module(location)
+        strategy = getattr(module, attribute)
+    _loaded[spec] = strategy
+    return strategy
+
+
+def game_seed(seed, first, second, index):
+    # Strings seed random.Random the same way in every process
+    return f"{seed}:{first}:{second}:{index}"
+
+
+def play_batch(seed, first, second, start, count):
+    """Play games start .. start + count - 1 of a pairing; first is player 1 in even games"""
+    classes = (load_strategy(first), load_strategy(second))
+    winners = []
+    shots = {first: 0, second: 0}
+    forfeits = Counter()
+    for index in range(start, start + count):
+        sides = classes if index % 2 == 0 else classes[::-1]
+        names = (first, second) if index % 2 == 0 else (second, first)
+        winner, winner_shots, _, forfeit = play_game(game_seed(seed, first, second, index),
+                                                  dict(zip(engine.PLAYERS, sides)))
+        name = names[winner - 1]
+        winners.append("a" if name == first else "b")
+        shots[name] += winner_shots
+        if forfeit:
+            forfeits[names[2 - winner]] += 1
+    return {"a": first, "b": second, "start": start, "count": count,
+            "winners": "".join(winners), "shots": shots, "forfeits": dict(forfeits)}
+
+
+def read_results(path):
+    """(header, batches) from a results file; a torn last line is cut off"""
+    if not os.path.exists(path):
+        return None, []
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    lines = [json.loads(line) for line in data[:end].decode().splitlines() if line.strip()]
+    return (lines[0] if lines else None), lines[1:]
+
+
+def pending_batches(strategies, games, batch, done):
+    """(first, second, start, count) of every batch not in done"""
+    for first, second in itertools.combinations(sorted(strategies), 2):
+        for start in range(0, games, batch):
+            if (first, second, start) not in done:
+                yield first, second, start, min(batch, games - start)
+
+
+def standings(batches):
+    """Per strategy: games, wins, shots in the games it won, forfeits"""
+    table = {}
+    pairs = {}
+    for result in batches:
+        a, b = result["a"], result["b"]
+        a_wins = result["winners"].count("a")
+        b_wins = len(result["winners"]) - a_wins
+        for name, won in ((a, a_wins), (b, b_wins)):
+            row = table.setdefault(name, {"games": 0, "wins": 0, "shots": 0, "forfeits": 0})
+            row["games"] += result["count"]
+            row["wins"] += won
+            row["shots"] += result["shots"].get(name, 0)
+            row["forfeits"] += result["forfeits"].get(name, 0)
+        pair = pairs.setdefault((a, b), [0, 0])
+        pair[0] += a_wins
+        pair[1] += b_wins
+    return table, pairs
+
+
+def ratings(names, pairs, iterations=1000):
+    """Bradley-Terry strengths fitted by minorization-maximization, on the Elo scale.
+
+    Each pairing gets half a win each way so a strategy that never wins
+    still has a finite rating.
+    """
+    wins = {(a, b): w + 0.5 for (a, b), (w, _) in pairs.items()}
+    wins.update({(b, a): l + 0.5 for (a, b), (_, l) in pairs.items()})
+    strength = {name: 1.0 for name in names}
+    for _ in range(iterations):
+        updated = {}
+        for name in names:
+            total = sum(w for (winner, _), w in wins.items() if winner == name)
+            games = sum((wins[name, other] + wins[other, name]) / (strength[name] + strength[other])
+                        for other in names if (name, other) in wins)
+            updated[name] = total / games if games else strength[name]
+        # Pin the geometric mean at 1 so the ratings average 1500
+        scale = math.exp(sum(math.log(value) for value in updated.values()) / len(updated))
+        converged = all(abs(updated[name] / scale - strength[name]) < 1e-9 for name in names)
+        strength = {name: value / scale for name, value in updated.items()}
+        if converged:
+            break
+    return {name: 1500 + 400 * math.log10(strength[name]) for name in names}
+
+
+def report(names, batches):
+    table, pairs = standings(batches)
+    names = [name for name in names if name in table]
+    if not names:
+        return
+    elo = ratings(names, pairs)
+    width = max(len(name) for name in names + ["strategy"])
+    print(f"\n{'strategy':{width}} {'elo':>6} {'games':>8} {'win rate':>9} "
+          f"{'shots/win':>10} {'forfeits':>9}")
+    for name in sorted(names, key=elo.get, reverse=True):
+        row = table[name]
+        print(f"{name:{width}} {elo[name]:6.0f} {row['games']:8d} "
+              f"{row['wins'] / row['games']:9.1%} "
+              f"{row['shots'] / row['wins'] if row['wins'] else 0:10.1f} {row['forfeits']:9d}")
+
+    # Row's win rate against column
+    column = max(width, 8)
+    print(f"\n{'':{width}} " + " ".join(f"{name:>{column}}" for name in names))
+    for name in names:
+        cells = []
+        for other in names:
+            if other == name:
+                cells.append(f"{'-':>{column}}")
+                continue
+            won, lost = pairs.get((name, other)) or pairs.get((other, name), [0, 0])[::-1]
+            cells.append(f"{won / (won + lost):{column}.1%}" if won + lost else f"{'':{column}}")
+        print(f"{name:{width}} " + " ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Round-robin strategy tournament")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES),
+                        help="comma-separated names, module:Class or file.py:Class")
+    parser.add_argument("--games", type=int, default=1000, help="games per pairing")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--results", default="tournament.jsonl")
+    args = parser.parse_args()
+    names = list(dict.fromkeys(name.strip() for name in args.strategies.split(",") if name.strip()))
+    if len(names) < 2:
+        parser.error("a tournament needs at least two strategies")
+    for name in names:
+        try:
+            load_strategy(name)
+        except (ValueError, ImportError, OSError, AttributeError) as e:
+            parser.error(str(e))
+
+    header, batches = read_results(args.results)
+    if header is None:
+        header = {"seed": args.seed, "batch": args.batch}
+        with open(args.results, "w") as f:
+            f.write(json.dumps(header) + "\n")
+    elif (header["seed"], header["batch"]) != (args.seed, args.batch):
+        parser.error(f"{args.results} was played with --seed {header['seed']} "
+                     f"--batch {header['batch']}; pass those to resume it")
+    done = {(result["a"], result["b"], result["start"]) for result in batches}
+    todo = list(pending_batches(names, args.games, args.batch, done))
+    total = sum(count for *_, count in todo)
+    if batches:
+        print(f"Resuming {args.results}: {len(done)} batches done, {len(todo)} to play")
+
+    start = time.perf_counter()
+    played = 0
+    try:
+        with open(args.results, "a") as out:
+            for result in run_batches(play_batch, [(args.seed, *batch) for batch in todo],
+                                      args.workers):
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                batches.append(result)
+                played += result["count"]
+                elapsed = time.perf_counter() - start
+                print(f"{played:8d}/{total} games  {played / elapsed:8.0f} games/s  "
+                      f"{result['a']} {result['winners'].count('a')}-"
+                      f"{result['winners'].count('b')} {result['b']}", flush=True)
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; run again with --results {args.results} to resume")
+    report(names, [result for result in batches if result["a"] in names and result["b"] in names])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Framed binary wire format for the desktop TCP server and client.
+
+Every message is a frame: a 5-byte header (payload length as uint32, message
+type as uint8) followed by a struct-packed payload. Boards travel as bitmasks
+laid out like bitboard.Board, one bit per cell, so a turn costs a few dozen
+bytes instead of a pickled colour grid.
+
+    JOIN    client -> server, first: board size and plane count wanted
+    HELLO   server -> client: player id, board size and plane count of the game
+    STATE   client -> server: board size, occupied mask, shots mask, heads
+    UPDATE  server -> client: flags, heads hit, opponent shots mask, shot results
+
+Masks are decoded as ints; iter_cells turns them back into (row, col) cells.
+
+Decoder buffers partial reads, and several frames can be sent in one write.
+"""
+import struct
+from itertools import chain
+
+from bitboard import BOARD_SIZE
+
+HEADER = struct.Struct("!IB")
+MAX_FRAME = 1 << 20
+
+HELLO, STATE, UPDATE, JOIN = 1, 2, 3, 4
+
+RESULTS = ("miss", "hit", "head")
+RESULT_CODES = {result: code for code, result in enumerate(RESULTS)}
+
+_FLAG_OPPONENT_READY = 1
+_FLAG_YOUR_TURN = 2
+_FLAG_PLACEMENT = 4
+
+_BITS = bytes.maketrans(b"\x00\x01", b"01")
+
+_MODE = struct.Struct("!BB")   # board size, planes
+_HELLO = struct.Struct("!BBB")  # player id, board size, planes
+_COUNT = struct.Struct("!H")
+_CELL = struct.Struct("!BB")
+_RESULT = struct.Struct("!BBB")
+_UPDATE = struct.Struct("!BBBB")  # size, flags, heads hit, opponent heads hit
+
+
+class WireError(Exception):
+    pass
+
+
+def _mask_bytes(size: int) -> int:
+    return (size * size + 7) // 8
+
+
+def frame(msg_type: int, payload: bytes) -> bytes:
+    return HEADER.pack(len(payload), msg_type) + payload
+
+
+def encode_join(size: int, planes: int) -> bytes:
+    return frame(JOIN, _MODE.pack(size, planes))
+
+
+def encode_hello(player_id: str, size: int, planes: int) -> bytes:
+    return frame(HELLO, _HELLO.pack(int(player_id), size, planes))
+
+
+def matrix_mask(matrix) -> int:
+    """Bitmask of the truthy cells of a square matrix, bit row * size + col"""
+    return int(bytes(map(bool, chain.from_iterable(matrix))).translate(_BITS)[::-1], 2)
+
+
+def encode_state(size: int, occupied: int, shots: int, head_positions) -> bytes:
+    """Encode the client's occupancy and shots masks and its (row, col) heads"""
+    width = _mask_bytes(size)
+    payload = [
+        struct.pack("!B", size),
+        occupied.to_bytes(width, "big"),
+        shots.to_bytes(width, "big"),
+        _COUNT.pack(len(head_positions)),
+    ]
+    payload.extend(_CELL.pack(row, col) for row, col in head_positions)
+    return frame(STATE, b"".join(payload))
+
+
+def encode_update(update: dict, size: int = BOARD_SIZE) -> bytes:
+    """Encode a server response; opponent_shots may be a list of cells or a mask"""
+    flags = 0
+    if update.get("opponent_ready"):
+        flags |= _FLAG_OPPONENT_READY
+    if update.get("your_turn"):
+        flags |= _FLAG_YOUR_TURN
+    if update.get("placement_phase"):
+        flags |= _FLAG_PLACEMENT
+    opponent_shots = update.get("opponent_shots", 0)
+    if not isinstance(opponent_shots, int):
+        opponent_shots = sum(1 << (row * size + col) for row, col in opponent_shots)
+    shot_results = update.get("shot_results", {})
+    payload = [
+        _UPDATE.pack(size, flags, update.get("heads_hit", 0), update.get("opponent_heads_hit", 0)),
+        opponent_shots.to_bytes(_mask_bytes(size), "big"),
+        _COUNT.pack(len(shot_results)),
+    ]
+    payload.extend(_RESULT.pack(row, col, RESULT_CODES[result])
+                   for (row, col), result in shot_results.items())
+    return frame(UPDATE, b"".join(payload))
+
+
+def _decode_join(payload: bytes) -> dict:
+    size, planes = _MODE.unpack(payload)
+    return {"size": size, "planes": planes}
+
+
+def _decode_hello(payload: bytes) -> dict:
+    player_id, size, planes = _HELLO.unpack(payload)
+    return {"player_id": str(player_id), "size": size, "planes": planes}
+
+
+def _decode_state(payload: bytes) -> dict:
+    size = payload[0]
+    width = _mask_bytes(size)
+    offset = 1
+    occupied = int.from_bytes(payload[offset:offset + width], "big")
+    offset += width
+    shots = int.from_bytes(payload[offset:offset + width], "big")
+    offset += width
+    count, = _COUNT.unpack_from(payload, offset)
+    offset += _COUNT.size
+    heads = [_CELL.unpack_from(payload, offset + i * _CELL.size) for i in range(count)]
+    return {"size": size, "occupied": occupied, "shots": shots, "head_positions": heads}
+
+
+def _decode_update(payload: bytes) -> dict:
+    size, flags, heads_hit, opponent_heads_hit = _UPDATE.unpack_from(payload)
+    width = _mask_bytes(size)
+    offset = _UPDATE.size
+    opponent_shots = int.from_bytes(payload[offset:offset + width], "big")
+    offset += width
+    count, = _COUNT.unpack_from(payload, offset)
+    offset += _COUNT.size
+    shot_results = {}
+    for row, col, code in _RESULT.iter_unpack(payload[offset:offset + count * _RESULT.size]):
+        shot_results[(row, col)] = RESULTS[code]
+    return {
+        "opponent_ready": bool(flags & _FLAG_OPPONENT_READY),
+        "your_turn": bool(flags & _FLAG_YOUR_TURN),
+        "placement_phase": bool(flags & _FLAG_PLACEMENT),
+        "opponent_shots": opponent_shots,
+        "heads_hit": heads_hit,
+        "opponent_heads_hit": opponent_heads_hit,
+        "shot_results": shot_results,
+    }
+
+
+_DECODERS = {HELLO: _decode_hello, STATE: _decode_state, UPDATE: _decode_update,
+             JOIN: _decode_join}
+
+
+def decode(msg_type: int, payload: bytes) -> dict:
+    try:
+        message = _DECODERS[msg_type](payload)
+    except KeyError:
+        raise WireError(f"Unknown message type {msg_type}")
+    except (IndexError, struct.error) as e:
+        raise WireError(f"Malformed message: {e}")
+    message["type"] = msg_type
+    return message
+
+
+class Decoder:
+    """Turn a byte stream into messages, however it was split into reads"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes) -> list:
+        """Add received bytes and return every message now complete"""
+        self.buffer += data
+        messages = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            length, msg_type = HEADER.unpack_from(self.buffer, offset)
+            if length > MAX_FRAME:
+                raise WireError(f"Frame of {length} bytes is too large")
+            end = offset + HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            messages.append(decode(msg_type, bytes(self.buffer[offset + HEADER.size:end])))
+            offset = end
+        del self.buffer[:offset]
+        return messages
+
+
+def recv_message(sock, decoder: Decoder, pending: list, bufsize: int = 4096):
+    """Block until a message arrives on sock; None if the peer closed it.
+
+    Extra messages that arrived in the same read are kept in pending.
+    """
+    while not pending:
+        data = sock.recv(bufsize)
+        if not data:
+            return None
+        pending.extend(decoder.feed(data))
+    return pending.pop(0)
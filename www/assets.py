@@ -0,0 +1,331 @@
+"""Fingerprinted, precompressed copies of the files under static/.
+
+Usage: python assets.py
+
+Run at deploy time (see render.yml and the Procfile). Each file in ASSETS is
+minified, named after a hash of its content (script.js becomes
+script.3f9c2a1b7d04.js) and written to build/ with .gz and, when the brotli
+module is installed, .br variants next to it. References between assets are
+rewritten to the new names first, so index.html, built last, changes whenever
+anything it loads does. build/manifest.json maps each name to its build.
+
+AssetFiles serves /static: a fingerprinted name is answered from memory in
+the encoding the client prefers, with an ETag and a year of immutable
+caching, since its content can never change under that name. Anything else
+comes from static/ as before, revalidated on every use. Without a build the
+originals are served as they are.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(HERE, "static")
+BUILD_DIR = os.path.join(HERE, "build")
+MANIFEST = "manifest.json"
+URL_PREFIX = "/static/"
+
+# In build order: a file's references are rewritten before it is hashed
+ASSETS = ("styles.css", "script.js", "menu/GameIntegration.js", "index.html")
+
+HASH_LENGTH = 12
+# Suffixes in the order they are preferred when the client accepts several
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+def _scan_string(text: str, start: int) -> int:
+    """Index just past the string, template or regex literal opening at start"""
+    quote = text[start]
+    i = start + 1
+    in_class = False  # inside [...] of a regex, where / does not close it
+    while i < len(text):
+        char = text[i]
+        if char == "\\":
+            i += 2
+            continue
+        if quote == "/" and char == "[":
+            in_class = True
+        elif quote == "/" and char == "]":
+            in_class = False
+        elif char == quote and not in_class:
+            return i + 1
+        elif char == "\n" and quote in "'\"/":
+            break  # unterminated; leave the rest of the line alone
+        i += 1
+    return i
+
+
+# What a slash dividing something follows: a name, number or closing bracket
+_OPERAND_END = re.compile(r"([\w$]+|[)\]])\s*\Z")
+# Keywords that look like names but are followed by an expression
+_REGEX_AFTER = {"return", "typeof", "case", "do", "else", "in", "of", "void", "delete",
+                "instanceof", "new", "yield", "await"}
+
+
+def minify_js(text: str) -> str:
+    """Drop comments and indentation, keeping line breaks for semicolon insertion.
+
+    Strings, template literals and regex literals are copied as they are.
+    """
+    out = []
+
+    def space(gap):
+        # One gap between tokens, a line break if any of it was one
+        if out and out[-1] in (" ", "\n"):
+            if gap == "\n":
+                out[-1] = gap
+        elif out:
+            out.append(gap)
+
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char in "'\"`":
+            end = _scan_string(text, i)
+            out.append(text[i:end])
+            i = end
+        elif text.startswith("//", i):
+            end = text.find("\n", i)
+            i = len(text) if end < 0 else end
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = len(text) if end < 0 else end + 2
+            space(" ")
+        elif char == "/":
+            # A slash after an operand divides; anywhere else it opens a regex
+            operand = _OPERAND_END.search(text, max(0, i - 64), i)
+            if operand and operand.group(1) not in _REGEX_AFTER:
+                out.append(char)
+                i += 1
+            else:
+                end = _scan_string(text, i)
+                out.append(text[i:end])
+                i = end
+        elif char.isspace():
+            end = i
+            while end < len(text) and text[end].isspace():
+                end += 1
+            space("\n" if "\n" in text[i:end] else " ")
+            i = end
+        else:
+            out.append(char)
+            i += 1
+    return "".join(out).rstrip() + "\n"
+
+
+def _minify_css_code(code: str) -> str:
+    code = re.sub(r"\s+", " ", code)
+    code = re.sub(r" ?([{};,>]) ?", r"\1", code)
+    return code.replace(": ", ":").replace(";}", "}")
+
+
+def minify_css(text: str) -> str:
+    """Drop comments and the whitespace around braces, colons, semicolons and commas"""
+    out = []
+    code = []  # text since the last string, comments dropped
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char in "'\"":
+            end = _scan_string(text, i)
+            out.append(_minify_css_code("".join(code)))
+            out.append(text[i:end])
+            code = []
+            i = end
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = len(text) if end < 0 else end + 2
+            code.append(" ")
+        else:
+            code.append(char)
+            i += 1
+    out.append(_minify_css_code("".join(code)))
+    return "".join(out).strip() + "\n"
+
+
+# Elements whose whitespace is content, or not HTML
+_VERBATIM = re.compile(r"(<(pre|textarea|script|style)\b.*?</\2\s*>)", re.S | re.I)
+
+
+def minify_html(text: str) -> str:
+    """Drop comments and collapse runs of whitespace to one space"""
+    parts = _VERBATIM.split(text)
+    out = []
+    # split() gives text, then the whole verbatim element and its tag name
+    for index in range(0, len(parts), 3):
+        chunk = re.sub(r"<!--.*?-->", "", parts[index], flags=re.S)
+        out.append(re.sub(r"\s+", " ", chunk))
+        if index + 1 < len(parts):
+            out.append(parts[index + 1])
+    return "".join(out).strip() + "\n"
+
+
+MINIFIERS = {".js": minify_js, ".css": minify_css, ".html": minify_html}
+
+
+def fingerprint(name: str, content: bytes) -> str:
+    """script.js -> script.<hash of content>.js"""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def compress(content: bytes) -> dict:
+    """Suffix -> compressed content, for the encodings that make it smaller"""
+    variants = {".gz": gzip.compress(content, 9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(content, quality=11)
+    return {suffix: data for suffix, data in variants.items() if len(data) < len(content)}
+
+
+def build(static_dir: str = STATIC_DIR, build_dir: str = BUILD_DIR) -> dict:
+    """Write every asset's build into build_dir and return the manifest"""
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    manifest = {}
+    for name in ASSETS:
+        with open(os.path.join(static_dir, name), encoding="utf-8") as f:
+            text = f.read()
+        for built_name, built in manifest.items():
+            text = text.replace(URL_PREFIX + built_name, URL_PREFIX + built)
+        minify = MINIFIERS.get(os.path.splitext(name)[1])
+        content = (minify(text) if minify else text).encode("utf-8")
+        manifest[name] = fingerprint(name, content)
+        path = os.path.join(build_dir, manifest[name])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for suffix, data in [("", content)] + list(compress(content).items()):
+            with open(path + suffix, "wb") as f:
+                f.write(data)
+    with open(os.path.join(build_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(build_dir: str = BUILD_DIR) -> dict:
+    """The manifest of the last build, or {} if nothing has been built"""
+    try:
+        with open(os.path.join(build_dir, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def accepted_encodings(header: str) -> dict:
+    """Accept-Encoding as coding -> quality"""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(header: str, available) -> str:
+    """The preferred coding in available the client accepts, or "identity\""""
+    accepted = accepted_encodings(header)
+    best, best_quality = "identity", 0.0
+    for coding, _ in ENCODINGS:
+        if coding not in available:
+            continue
+        quality = accepted.get(coding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class Asset:
+    """A fingerprinted file held in memory with its compressed variants"""
+    __slots__ = ("media_type", "hash", "bodies")
+
+    def __init__(self, name: str, path: str):
+        self.media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if self.media_type.startswith("text/") or self.media_type.endswith("javascript"):
+            self.media_type += "; charset=utf-8"
+        self.hash = os.path.splitext(name)[0].rsplit(".", 1)[-1]
+        self.bodies = {}  # coding -> content
+        for coding, suffix in (("identity", ""),) + ENCODINGS:
+            if os.path.exists(path + suffix):
+                with open(path + suffix, "rb") as f:
+                    self.bodies[coding] = f.read()
+
+    def response(self, request_headers: Headers, head: bool) -> Response:
+        coding = choose_encoding(request_headers.get("accept-encoding", ""), self.bodies)
+        etag = f'"{self.hash}"' if coding == "identity" else f'"{self.hash}-{coding}"'
+        headers = {"cache-control": IMMUTABLE, "etag": etag, "vary": "Accept-Encoding"}
+        if coding != "identity":
+            headers["content-encoding"] = coding
+        if_none_match = request_headers.get("if-none-match", "")
+        if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")) or \
+                if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+        body = self.bodies[coding]
+        if head:
+            headers["content-length"] = str(len(body))
+            body = b""
+        return Response(body, media_type=self.media_type, headers=headers)
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles that answers fingerprinted names from the last build"""
+
+    def __init__(self, directory: str = STATIC_DIR, build_dir: str = BUILD_DIR):
+        super().__init__(directory=directory)
+        self.manifest = load_manifest(build_dir)
+        self.assets = {built: Asset(built, os.path.join(build_dir, built))
+                       for built in self.manifest.values()}
+
+    def url(self, name: str) -> str:
+        """Where name is served: its fingerprinted build if there is one"""
+        return URL_PREFIX + self.manifest.get(name, name)
+
+    async def get_response(self, path: str, scope) -> Response:
+        asset = self.assets.get(path.replace(os.sep, "/"))
+        if asset is None:
+            response = await super().get_response(path, scope)
+            response.headers["cache-control"] = REVALIDATE
+            return response
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        return asset.response(Headers(scope=scope), scope["method"] == "HEAD")
+
+
+def main():
+    manifest = build()
+    print(f"{'':36} {'source':>7} {'built':>7} {'br':>7} {'gzip':>7}")
+    for name, built in manifest.items():
+        sizes = [os.path.getsize(os.path.join(STATIC_DIR, name))]
+        for suffix in ("",) + tuple(suffix for _, suffix in ENCODINGS):
+            path = os.path.join(BUILD_DIR, built + suffix)
+            sizes.append(os.path.getsize(path) if os.path.exists(path) else None)
+        print(f"{built:36} " + " ".join(f"{size if size is not None else '-':>7}" for size in sizes))
+    if brotli is None:
+        print("brotli is not installed; built gzip variants only", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Time the per-move work of a game on boards of growing size.
+
+Usage: python bench_boards.py [games]
+
+For each board size and plane count in BOARDS, plays games through Game
+(record_placement for every plane, then record_shot at random cells until
+one side has hit every head) and reports, per operation:
+
+    place    validating and storing one plane
+    fire     resolving one shot
+    sync     one fire event as a state_delta in each codec, and the desktop
+             server's UPDATE frame with half the board shot
+    resume   the whole event log as one state_delta (spectators, resumes)
+    bot      one bot.next_shot halfway through the game
+
+Everything the server does per move should cost about the same on any
+board; only the bot, the resume delta and the desktop UPDATE (which carries
+every shot result) grow with it.
+"""
+import os
+import random
+import sys
+import time
+
+import codec
+import protocol
+from game import Game
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "desktop"))
+import bot
+import wire
+from airplane import random_fleet
+
+BOARDS = ((10, 3), (30, 12), (100, 100))
+BOT_MOVES = 20
+
+
+def play(rng, size, planes, timings):
+    """Play one game, adding seconds per operation to timings"""
+    game = Game("0", size, planes)
+    for player_id in ("1", "2"):
+        game.seat(player_id, protocol.PROTOCOL_VERSION)
+    for player_id in ("1", "2"):
+        for head, cells in random_fleet(rng, planes, size):
+            cells = [list(cell) for cell in cells]
+            start = time.perf_counter()
+            error = game.record_placement(player_id, list(head), cells)
+            timings["place"].append(time.perf_counter() - start)
+            assert error is None, error
+    game.check_placement_complete()
+
+    targets = {player_id: rng.sample(range(size * size), size * size) for player_id in ("1", "2")}
+    while not game.is_over():
+        player_id = game.current_player
+        row, col = divmod(targets[player_id].pop(), size)
+        start = time.perf_counter()
+        game.record_shot(player_id, row, col)
+        timings["fire"].append(time.perf_counter() - start)
+
+        delta = protocol.state_delta(len(game.events), game.events[-1:])
+        for name, message_codec in codec.CODECS.items():
+            start = time.perf_counter()
+            message_codec.encode(delta)
+            timings[f"sync {name}"].append(time.perf_counter() - start)
+        if len(targets[player_id]) == size * size // 2:
+            # Its size grows with the shots, so it is timed once, halfway
+            update = game.legacy_update(player_id)
+            update["opponent_shots"] = game.boards[player_id].shots
+            update["shot_results"] = game.boards[game.current_player].shot_results()
+            start = time.perf_counter()
+            wire.encode_update(update, size)
+            timings["sync desktop"].append(time.perf_counter() - start)
+
+    full = protocol.state_delta(len(game.events), game.events)
+    for name, message_codec in codec.CODECS.items():
+        start = time.perf_counter()
+        message_codec.encode(full)
+        timings[f"resume {name}"].append(time.perf_counter() - start)
+    return game
+
+
+def time_bot(rng, size, planes):
+    """Seconds per bot move on a board with half its cells shot"""
+    game = Game("0", size, planes)
+    for head, cells in random_fleet(rng, planes, size):
+        game.boards["1"].add_plane(head, cells)
+    board = game.boards["1"]
+    for cell in rng.sample(range(size * size), size * size // 2):
+        if board.heads_hit + 1 < planes or not board.heads >> cell & 1:
+            board.fire(*divmod(cell, size))
+    bot.next_shot(board)  # build the placement tables outside the timing
+    start = time.perf_counter()
+    for _ in range(BOT_MOVES):
+        bot.next_shot(board)
+    return (time.perf_counter() - start) / BOT_MOVES
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rng = random.Random(0)
+    names = ["place", "fire"] + [f"sync {name}" for name in codec.CODECS] + ["sync desktop"] + \
+            [f"resume {name}" for name in codec.CODECS]
+    results = {}
+    for size, planes in BOARDS:
+        timings = {name: [] for name in names}
+        for _ in range(games):
+            play(rng, size, planes, timings)
+        # A lucky game can end before half the board is shot
+        results[size, planes] = {name: sum(values) / len(values)
+                                 for name, values in timings.items() if values}
+        results[size, planes]["bot"] = time_bot(rng, size, planes)
+
+    boards = [f"{size}x{size}/{planes}" for size, planes in BOARDS]
+    print(f"{games} games per board, microseconds per operation")
+    print(f"{'':16}" + "".join(f"{board:>14}" for board in boards))
+    for name in names + ["bot"]:
+        print(f"{name:16}" + "".join(f"{results[mode][name] * 1e6:14.1f}" if name in results[mode]
+                                     else f"{'-':>14}" for mode in BOARDS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Encode and decode recorded game traffic with every codec in codec.py.
+
+Usage: python bench_codec.py [games]
+
+Plays games between random fleets and random shots through Game, keeping
+the messages a protocol v2 session exchanges: placements, shots and acks
+from the clients; init, one state_delta per applied message and a full
+catch-up delta (as on a resume) from the server. A protocol v1 full-state
+message, which only JSON can carry, is timed for comparison.
+"""
+import os
+import random
+import sys
+import time
+
+import codec
+import protocol
+from game import Game, WHITE
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "desktop"))
+from airplane import random_fleet
+
+
+def record_game(rng, game_id):
+    """The client and server messages of one game, in order"""
+    game = Game(str(game_id))
+    client, server = [], []
+    for player_id in ("1", "2"):
+        token = game.seat(player_id, protocol.PROTOCOL_VERSION)
+        server.append({"type": "init", "player_id": player_id, "game_id": game.game_id,
+                       "protocol": protocol.PROTOCOL_VERSION, "size": game.size,
+                       "planes": game.planes, "resume_token": token, "resumed": False})
+
+    def apply(message, player_id):
+        since = len(game.events)
+        client.append(message)
+        if message["type"] == "place":
+            game.record_placement(player_id, message["head"], message["cells"])
+            game.check_placement_complete()
+        else:
+            game.record_shot(player_id, message["row"], message["col"])
+        server.append(protocol.state_delta(len(game.events), game.events[since:]))
+        client.append({"type": "ack", "seq": len(game.events)})
+
+    for player_id in ("1", "2"):
+        for head, cells in random_fleet(rng, protocol.MAX_PLANES, protocol.BOARD_SIZE):
+            apply({"type": "place", "head": list(head), "cells": [list(cell) for cell in cells]},
+                  player_id)
+    targets = {player_id: rng.sample(range(protocol.BOARD_SIZE ** 2), protocol.BOARD_SIZE ** 2)
+               for player_id in ("1", "2")}
+    while not game.is_over():
+        row, col = divmod(targets[game.current_player].pop(), protocol.BOARD_SIZE)
+        apply({"type": "fire", "row": row, "col": col}, game.current_player)
+    server.append(protocol.state_delta(len(game.events), game.events))
+    return client, server
+
+
+def legacy_message(rng):
+    """A protocol v1 message: the whole colour grid, shots matrix and heads"""
+    grid = [[WHITE] * protocol.BOARD_SIZE for _ in range(protocol.BOARD_SIZE)]
+    heads = []
+    for head, cells in random_fleet(rng, protocol.MAX_PLANES, protocol.BOARD_SIZE):
+        heads.append(list(head))
+        for row, col in cells:
+            grid[row][col] = [0, 0, 255]
+    shots = [[rng.random() < 0.3 for _ in range(protocol.BOARD_SIZE)]
+             for _ in range(protocol.BOARD_SIZE)]
+    return {"grid": grid, "shots": shots, "head_positions": heads}
+
+
+def timed(function, items):
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    return results, (time.perf_counter() - start) * 1e6 / len(items)
+
+
+def measure(message_codec, messages):
+    """(bytes per message, encode us, decode us), checking the round trip"""
+    payloads, encode_us = timed(message_codec.encode, messages)
+    decoded, decode_us = timed(message_codec.decode, payloads)
+    assert decoded == messages, f"{message_codec.name} does not round-trip"
+    size = sum(len(payload) for payload in payloads) / len(payloads)
+    return size, encode_us, decode_us
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(0)
+    client, server = [], []
+    for game_id in range(games):
+        game_client, game_server = record_game(rng, game_id)
+        client.extend(game_client)
+        server.extend(game_server)
+    legacy = [legacy_message(rng) for _ in range(games)]
+
+    print(f"{games} games: {len(client)} client and {len(server)} server messages")
+    print(f"{'':8} {'':8} {'bytes/msg':>10} {'encode us':>10} {'decode us':>10}")
+    for name, message_codec in sorted(codec.CODECS.items()):
+        for direction, messages in (("client", client), ("server", server)):
+            size, encode_us, decode_us = measure(message_codec, messages)
+            print(f"{name:8} {direction:8} {size:10.1f} {encode_us:10.2f} {decode_us:10.2f}")
+    for name, message_codec in sorted(codec.CODECS.items()):
+        if not message_codec.binary:
+            size, encode_us, decode_us = measure(message_codec, legacy)
+            print(f"{name:8} {'v1 grid':8} {size:10.1f} {encode_us:10.2f} {decode_us:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Join and leave many games through the matchmaker and through the old linear scan.
+
+Usage: python bench_matchmaking.py [games]
+"""
+import sys
+import time
+
+from matchmaking import Matchmaker
+
+
+class ScanMatchmaker:
+    """The original find_game/create_new_game logic, minus the websockets"""
+
+    def __init__(self):
+        self.games = {}
+        self.active_games = set()
+
+    def join(self):
+        for game_id in list(self.active_games):
+            if not self.games[game_id]:
+                self.leave(game_id)
+        for game_id in list(self.active_games):
+            if self.games[game_id] < 2:
+                self.games[game_id] += 1
+                return game_id
+        game_id = "0"
+        while game_id in self.active_games:
+            game_id = str(int(game_id) + 1)
+        self.games[game_id] = 1
+        self.active_games.add(game_id)
+        return game_id
+
+    def leave(self, game_id):
+        self.games.pop(game_id, None)
+        self.active_games.discard(game_id)
+
+
+def run_matchmaker(games, rooms=False):
+    matchmaker = Matchmaker()
+    start = time.perf_counter()
+    joined = []
+    for index in range(games):
+        room = f"room{index}" if rooms else None
+        game_id, _ = matchmaker.join(room)
+        other, _ = matchmaker.join(room)
+        assert game_id == other
+        joined.append(game_id)
+    for game_id in joined:
+        matchmaker.discard(game_id)
+    assert matchmaker.queue_depth == 0
+    return time.perf_counter() - start
+
+
+def run_scan(games):
+    matchmaker = ScanMatchmaker()
+    start = time.perf_counter()
+    joined = []
+    for _ in range(games):
+        joined.append(matchmaker.join())
+        matchmaker.join()
+    for game_id in joined:
+        matchmaker.leave(game_id)
+    return time.perf_counter() - start
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    # The scan is quadratic, so only time it on a slice and report per game
+    scan_games = min(games, 2000)
+
+    queue_time = run_matchmaker(games)
+    room_time = run_matchmaker(games, rooms=True)
+    scan_time = run_scan(scan_games)
+    print(f"{games} games joined by two players and left")
+    print(f"matchmaker queue: {queue_time * 1e6 / games:8.2f} us/game  ({queue_time:.2f}s total)")
+    print(f"private rooms:    {room_time * 1e6 / games:8.2f} us/game  ({room_time:.2f}s total)")
+    print(f"linear scan:      {scan_time * 1e6 / scan_games:8.2f} us/game  (only {scan_games} games)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Churn game deadlines through the timer wheel and through a heap.
+
+Usage: python bench_reaper.py [games] [touches]
+
+Games start at a steady rate and each is touched (its deadline pushed back)
+once a second for touches seconds before it is left to expire. The heap has
+no way to move an entry, so it pushes a new one per touch and skips stale
+ones when they come up; the wheel moves the game's single entry.
+"""
+import heapq
+import sys
+import time
+
+from reaper import TimerWheel
+
+TIMEOUT = 120.0
+STARTS_PER_SECOND = 1000
+
+
+class HeapTimers:
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def schedule(self, key, deadline):
+        self.deadlines[key] = deadline
+        heapq.heappush(self.heap, (deadline, key))
+
+    def advance(self, now):
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, key = heapq.heappop(self.heap)
+            if self.deadlines.get(key) == deadline:
+                del self.deadlines[key]
+                expired.append(key)
+        return expired
+
+
+def churn(timers, games, touches):
+    """(seconds, games expired, most entries held at once)"""
+    start = time.perf_counter()
+    expired = peak = 0
+    now = 0.0
+    for game in range(games):
+        now = game / STARTS_PER_SECOND
+        # The game starting now moves, and so do those started 1..touches seconds ago
+        for age in range(touches + 1):
+            key = game - age * STARTS_PER_SECOND
+            if key >= 0:
+                timers.schedule(key, now + TIMEOUT)
+        if game % STARTS_PER_SECOND == 0:
+            expired += len(timers.advance(now))
+            peak = max(peak, len(timers))
+    expired += len(timers.advance(now + TIMEOUT + 1))
+    return time.perf_counter() - start, expired, peak
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    touches = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"{games} games, {touches} touches each, {TIMEOUT:.0f}s timeout")
+    for name, timers in (("wheel", TimerWheel()), ("heap", HeapTimers())):
+        elapsed, expired, peak = churn(timers, games, touches)
+        operations = games * (touches + 1)
+        print(f"{name:6} {elapsed * 1e9 / operations:8.0f} ns/op  expired {expired:7d}  "
+              f"peak entries {peak:8d}")
+
+
+if __name__ == "__main__":
+    main()
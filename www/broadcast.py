@@ -0,0 +1,94 @@
+"""Serialize-once fan-out of game updates to spectators.
+
+Each published update is encoded once per codec (see codec.py), and that
+same payload is queued for every spectator of the game using the codec. Every spectator has a bounded queue drained
+by its own writer task, so a slow viewer only ever delays itself, never the
+players or the other viewers. When a viewer's queue is full the policy
+(AVIOANE_SPECTATOR_POLICY) decides:
+
+    disconnect (default)  close the viewer; it can reconnect and start over
+    drop                  throw the backlog away; the writer then sends one
+                          catch-up delta from the last seq the viewer got
+"""
+import asyncio
+import os
+
+import metrics
+
+QUEUE_SIZE = int(os.environ.get("AVIOANE_SPECTATOR_QUEUE", "64"))
+POLICY = os.environ.get("AVIOANE_SPECTATOR_POLICY", "disconnect")
+
+# Queue marker left after dropping a backlog
+_RESYNC = object()
+
+
+class Spectator:
+    __slots__ = ("websocket", "codec", "queue", "cursor", "catch_up")
+
+    def __init__(self, websocket, codec, cursor: int, catch_up):
+        self.websocket = websocket
+        self.codec = codec
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.cursor = cursor        # seq of the last event written
+        self.catch_up = catch_up    # async (cursor) -> (seq, message, final), or None if the game is gone
+
+    def offer(self, frame) -> bool:
+        """Queue a (seq, payload, final) frame; False if the viewer has to go"""
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+        metrics.SPECTATOR_OVERFLOWS.inc(POLICY)
+        if POLICY != "drop":
+            return False
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_RESYNC)
+        return True
+
+    async def run(self):
+        """Write queued frames until the game ends"""
+        while True:
+            frame = await self.queue.get()
+            if frame is _RESYNC:
+                frame = await self.catch_up(self.cursor)
+                if frame is None:
+                    return
+                seq, message, final = frame
+                frame = seq, self.codec.encode(message), final
+            seq, payload, final = frame
+            # Frames queued before a catch-up may repeat events; clients skip seen seqs
+            if seq > self.cursor:
+                metrics.MESSAGES.inc("out", "state_delta")
+                metrics.PAYLOAD_BYTES.observe(len(payload), "out")
+                if self.codec.binary:
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+                self.cursor = seq
+            if final:
+                return
+
+
+class Broadcast:
+    """The spectators of one game on this worker"""
+
+    def __init__(self):
+        self.spectators = set()
+
+    def __len__(self):
+        return len(self.spectators)
+
+    def add(self, spectator: Spectator):
+        self.spectators.add(spectator)
+
+    def discard(self, spectator: Spectator):
+        self.spectators.discard(spectator)
+
+    def publish(self, seq: int, encode, final: bool = False):
+        """Queue one update for every spectator; encode(codec) gives its payload"""
+        for spectator in list(self.spectators):
+            if not spectator.offer((seq, encode(spectator.codec), final)):
+                self.spectators.discard(spectator)
+                asyncio.create_task(spectator.websocket.close(code=1013))
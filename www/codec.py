@@ -0,0 +1,257 @@
+"""Message codecs for the /ws endpoint, negotiated as WebSocket subprotocols.
+
+A client lists the codecs it speaks, best first, in Sec-WebSocket-Protocol
+and the server accepts the first one it has:
+
+    avioane.json    stdlib json, text frames (also used when none is asked for)
+    avioane.orjson  the same JSON from orjson, when it is installed
+    avioane.struct  struct-packed binary frames, protocol v2 only
+
+avioane.struct frames start with a kind byte. Client messages:
+
+    PLACE  head row uint8, head col uint8, cell count uint8, (row, col) uint8 pairs
+    FIRE   row uint8, col uint8
+    ACK    seq uint32
+
+Server messages:
+
+    INIT         player uint8 (0 for spectators), protocol uint8, flags uint8,
+                 board size uint8, planes uint8,
+                 game ID and resume token as uint8-length-prefixed UTF-8
+    STATE_DELTA  seq uint32, event count uint16, then per event
+                 seq uint32, op, player, row, col, arg, next (uint8 each)
+    ERROR        code (uint8 length) and message (uint16 length) as UTF-8
+    JSON         anything else, as UTF-8 JSON
+
+Event fields are laid out as in eventlog.py: arg is the shot result, the
+plane count of a placement, or 1 for a bot joining or a player timing out;
+row and col of a start event are the board size and plane count; unused
+bytes are 255.
+Every codec decodes to the same dicts json.loads would give.
+"""
+import json
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import protocol
+from eventlog import NONE, OP_CODES, OPS, RESULT_CODES, RESULTS
+
+SUBPROTOCOL_PREFIX = "avioane."
+
+JSON, PLACE, FIRE, ACK = 0, 1, 2, 3
+INIT, STATE_DELTA, ERROR = 16, 17, 18
+
+_FLAG_RESUMED = 1
+_FLAG_SPECTATOR = 2
+
+_KIND = struct.Struct("!B")
+_PLACE = struct.Struct("!BBBB")
+_FIRE = struct.Struct("!BBB")
+_ACK = struct.Struct("!BI")
+_INIT = struct.Struct("!BBBBBB")
+_DELTA = struct.Struct("!BIH")
+_EVENT = struct.Struct("!IBBBBBB")
+_LENGTH8 = struct.Struct("!B")
+_LENGTH16 = struct.Struct("!H")
+
+
+class CodecError(ValueError):
+    pass
+
+
+class JSONCodec:
+    """Standard library JSON in text frames"""
+    name = "json"
+    binary = False
+
+    def encode(self, message: dict) -> str:
+        return json.dumps(message)
+
+    def decode(self, data) -> dict:
+        try:
+            return json.loads(data)
+        except (ValueError, RecursionError) as e:
+            raise CodecError(f"Malformed message: {e}")
+
+
+class OrjsonCodec(JSONCodec):
+    """The same JSON text, encoded and parsed by orjson"""
+    name = "orjson"
+
+    def encode(self, message: dict) -> str:
+        return orjson.dumps(message).decode()
+
+    def decode(self, data) -> dict:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            raise CodecError(f"Malformed message: {e}")
+
+
+def _string8(text) -> bytes:
+    data = str(text).encode()[:255]
+    return _LENGTH8.pack(len(data)) + data
+
+
+def _read_string(data: bytes, offset: int, length: struct.Struct):
+    size, = length.unpack_from(data, offset)
+    offset += length.size
+    if offset + size > len(data):
+        raise CodecError("Truncated string")
+    return data[offset:offset + size].decode(), offset + size
+
+
+def _player(value) -> int:
+    return int(value) if value else 0
+
+
+class StructCodec:
+    """Fixed struct layouts in binary frames; see the module docstring"""
+    name = "struct"
+    binary = True
+
+    def encode(self, message: dict) -> bytes:
+        kind = message.get("type")
+        if kind == "state_delta":
+            return self._encode_delta(message)
+        if kind == "init":
+            flags = (_FLAG_RESUMED if message.get("resumed") else 0) | \
+                    (_FLAG_SPECTATOR if message.get("spectator") else 0)
+            return (_INIT.pack(INIT, _player(message.get("player_id")), message["protocol"], flags,
+                               message.get("size", protocol.BOARD_SIZE),
+                               message.get("planes", protocol.MAX_PLANES)) +
+                    _string8(message["game_id"]) + _string8(message.get("resume_token", "")))
+        if kind == "error":
+            text = message["message"].encode()[:65535]
+            return (_KIND.pack(ERROR) + _string8(message.get("code", "")) +
+                    _LENGTH16.pack(len(text)) + text)
+        if kind == "place":
+            cells = message["cells"]
+            return (_PLACE.pack(PLACE, *message["head"], len(cells)) +
+                    bytes(value for cell in cells for value in cell))
+        if kind == "fire":
+            return _FIRE.pack(FIRE, message["row"], message["col"])
+        if kind == "ack":
+            return _ACK.pack(ACK, message["seq"])
+        return _KIND.pack(JSON) + json.dumps(message).encode()
+
+    def _encode_delta(self, message: dict) -> bytes:
+        records = [_DELTA.pack(STATE_DELTA, message["seq"], len(message["events"]))]
+        for event in message["events"]:
+            op = event["op"]
+            row = col = arg = following = NONE
+            player = event.get("player")
+            if op == "join":
+                arg = 1 if event.get("bot") else 0
+            elif op == "place":
+                arg = event["planes"]
+            elif op == "start":
+                following = _player(event["current_player"])
+                row, col = event.get("size", NONE), event.get("planes", NONE)
+            elif op == "fire":
+                row, col, arg = event["row"], event["col"], RESULT_CODES[event["result"]]
+                following = _player(event["next"])
+            elif op == "leave" and event.get("reason") == "timeout":
+                arg = 1
+            records.append(_EVENT.pack(event["seq"], OP_CODES[op], _player(player),
+                                       row, col, arg, following))
+        return b"".join(records)
+
+    def decode(self, data) -> dict:
+        if isinstance(data, str):
+            raise CodecError("Expected a binary frame")
+        try:
+            kind = data[0]
+            if kind == PLACE:
+                _, row, col, count = _PLACE.unpack_from(data)
+                cells = data[_PLACE.size:_PLACE.size + 2 * count]
+                if len(cells) != 2 * count:
+                    raise CodecError("Truncated placement")
+                return {"type": "place", "head": [row, col],
+                        "cells": [[cells[i], cells[i + 1]] for i in range(0, len(cells), 2)]}
+            if kind == FIRE:
+                _, row, col = _FIRE.unpack(data)
+                return {"type": "fire", "row": row, "col": col}
+            if kind == ACK:
+                _, seq = _ACK.unpack(data)
+                return {"type": "ack", "seq": seq}
+            if kind == STATE_DELTA:
+                return self._decode_delta(data)
+            if kind == INIT:
+                return self._decode_init(data)
+            if kind == ERROR:
+                code, offset = _read_string(data, 1, _LENGTH8)
+                text, _ = _read_string(data, offset, _LENGTH16)
+                return protocol.error(text, code or None)
+            if kind == JSON:
+                return json.loads(data[1:])
+        except CodecError:
+            raise
+        except (IndexError, struct.error, ValueError, RecursionError) as e:
+            raise CodecError(f"Malformed message: {e}")
+        raise CodecError(f"Unknown message kind {kind}")
+
+    def _decode_delta(self, data: bytes) -> dict:
+        _, seq, count = _DELTA.unpack_from(data)
+        events = []
+        for offset in range(_DELTA.size, _DELTA.size + count * _EVENT.size, _EVENT.size):
+            event_seq, op, player, row, col, arg, following = _EVENT.unpack_from(data, offset)
+            op = OPS[op - 1]
+            event = {"seq": event_seq, "op": op}
+            if op == "start":
+                event["current_player"] = str(following)
+                if row != NONE:
+                    event.update(size=row, planes=col)
+            else:
+                event["player"] = str(player)
+            if op == "join" and arg == 1:
+                event["bot"] = True
+            elif op == "place":
+                event["planes"] = arg
+            elif op == "fire":
+                event.update(row=row, col=col, result=RESULTS[arg], next=str(following))
+            elif op == "leave" and arg == 1:
+                event["reason"] = "timeout"
+            events.append(event)
+        return protocol.state_delta(seq, events)
+
+    def _decode_init(self, data: bytes) -> dict:
+        _, player, version, flags, size, planes = _INIT.unpack_from(data)
+        game_id, offset = _read_string(data, _INIT.size, _LENGTH8)
+        token, _ = _read_string(data, offset, _LENGTH8)
+        message = {"type": "init", "game_id": game_id, "protocol": version,
+                   "size": size, "planes": planes}
+        if flags & _FLAG_SPECTATOR:
+            message["spectator"] = True
+            return message
+        message.update(player_id=str(player), resume_token=token,
+                       resumed=bool(flags & _FLAG_RESUMED))
+        return message
+
+
+DEFAULT = JSONCodec()
+CODECS = {codec.name: codec for codec in (DEFAULT, StructCodec())}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec()
+
+
+def subprotocol(codec) -> str:
+    return SUBPROTOCOL_PREFIX + codec.name
+
+
+def negotiate(offered, binary: bool = True):
+    """The first offered codec this server has, or None to fall back to json.
+
+    Binary codecs only carry protocol v2, so pass binary=False for v1 clients.
+    """
+    for name in offered:
+        if not name.startswith(SUBPROTOCOL_PREFIX):
+            continue
+        codec = CODECS.get(name[len(SUBPROTOCOL_PREFIX):])
+        if codec is not None and (binary or not codec.binary):
+            return codec
+    return None
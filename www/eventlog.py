@@ -0,0 +1,251 @@
+"""Append-only binary archive of finished games, replayable by game ID.
+
+When a game is cleaned up its events are written as fixed-size records, one
+after another, to the worker's current segment file:
+
+    game_id uint32, seq uint32, player uint8, op uint8, row uint8, col uint8, arg uint8
+
+row/col are the shot cell, the head of a placed plane (from the game's
+placements, in the order the planes were placed), or the board size and
+plane count of the start event; arg is the shot result, the plane count after a placement, or 1 for a bot joining
+or a player timing out. Unused bytes are 255.
+
+Each worker owns its segments (<writer>-<n>.seg, rolled at SEGMENT_BYTES)
+and an index file (<writer>.idx) of game_id, segment, offset and record
+count, so workers never interleave writes. A background thread writes
+whatever games are queued in one batch, fsyncs the segment and then the
+index, and only then makes the games visible to lookup. A batch that fails
+to write is logged, counted and dropped, and the thread carries on with the
+next. Lookups are a dict hit; a miss rereads the tail of the other workers'
+index files, at most once every REFRESH_INTERVAL seconds. A game ID
+logged twice (the memory store counts from 0 again after a restart)
+replays the most recent game.
+"""
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+from collections import namedtuple
+from typing import Iterator, Optional
+
+import logs
+import metrics
+
+RECORD = struct.Struct("!IIBBBBB")
+INDEX = struct.Struct("!IIQI")  # game_id, segment, offset, records
+
+SEGMENT_BYTES = 64 << 20
+READ_RECORDS = 4096  # records read per chunk while replaying
+REFRESH_INTERVAL = 1.0  # seconds between index rereads on lookup misses
+
+NONE = 255
+OPS = ("join", "place", "start", "fire", "leave", "away", "back")
+OP_CODES = {op: code for code, op in enumerate(OPS, 1)}
+RESULTS = ("miss", "hit", "head")
+RESULT_CODES = {result: code for code, result in enumerate(RESULTS)}
+
+Location = namedtuple("Location", "writer segment offset count")
+
+
+def encode_game(game) -> bytes:
+    """Records for every event of a game, in seq order"""
+    game_id = int(game.game_id)
+    heads = {player_id: iter(game.placements.get(player_id, ()))
+             for player_id in game.boards}
+    records = []
+    for event in game.events:
+        op = OP_CODES.get(event["op"])
+        if op is None:
+            continue
+        player = event.get("player")
+        row = col = arg = NONE
+        if event["op"] == "join":
+            arg = 1 if event.get("bot") else 0
+        elif event["op"] == "place":
+            row, col = next(heads[player], (NONE, NONE))
+            arg = event["planes"]
+        elif event["op"] == "start":
+            player = event["current_player"]
+            row, col = event.get("size", NONE), event.get("planes", NONE)
+        elif event["op"] == "fire":
+            row, col, arg = event["row"], event["col"], RESULT_CODES[event["result"]]
+        elif event["op"] == "leave" and event.get("reason") == "timeout":
+            arg = 1
+        records.append(RECORD.pack(game_id, event["seq"], int(player) if player else 0,
+                                   op, row, col, arg))
+    return b"".join(records)
+
+
+def decode_record(data: bytes, offset: int = 0) -> dict:
+    game_id, seq, player, op, row, col, arg = RECORD.unpack_from(data, offset)
+    event = {"game_id": str(game_id), "seq": seq, "op": OPS[op - 1]}
+    if event["op"] == "start":
+        event["current_player"] = str(player)
+        if row != NONE:
+            event.update(size=row, planes=col)
+        return event
+    event["player"] = str(player)
+    if event["op"] == "join":
+        event["bot"] = bool(arg)
+    elif event["op"] == "place":
+        event["planes"] = arg
+        if row != NONE:
+            event["head"] = [row, col]
+    elif event["op"] == "fire":
+        event.update(row=row, col=col, result=RESULTS[arg])
+    elif event["op"] == "leave" and arg == 1:
+        event["reason"] = "timeout"
+    return event
+
+
+class EventLog:
+    def __init__(self, directory: str, segment_bytes: int = SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.writer = f"{int(time.time())}-{os.getpid()}"
+        self.index = {}          # game_id -> Location; set by the writer thread
+        self.index_read = {}     # index file -> bytes already read
+        self.refresh_lock = threading.Lock()
+        self.refreshed = 0.0     # monotonic time of the last refresh
+        self.pending = queue.SimpleQueue()
+        self.thread = None
+        self.segment = 0
+        self.segment_file = None
+        self.index_file = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.refresh()
+        self.index_file = open(self._path(f"{self.writer}.idx"), "ab")
+        self._open_segment(1)
+        self.thread = threading.Thread(target=self._run, name="eventlog", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Write out everything queued and stop the writer thread"""
+        if self.thread is not None:
+            self.pending.put(None)
+            self.thread.join()
+            self.thread = None
+            self.segment_file.close()
+            self.index_file.close()
+
+    def append(self, game):
+        """Queue a finished game; called from the event loop, never blocks"""
+        if self.thread is not None:
+            self.pending.put(game)
+
+    def lookup(self, game_id: str) -> Optional[Location]:
+        location = self.index.get(game_id)
+        # Unknown IDs are cheap to ask for; don't list the directory for each
+        if location is None and time.monotonic() - self.refreshed >= REFRESH_INTERVAL:
+            self.refresh()
+            location = self.index.get(game_id)
+        return location
+
+    def replay(self, location: Location) -> Iterator[dict]:
+        """Yield a game's events, reading READ_RECORDS records at a time"""
+        remaining = location.count
+        with open(self._path(f"{location.writer}-{location.segment:06d}.seg"), "rb") as segment:
+            segment.seek(location.offset)
+            while remaining:
+                chunk = segment.read(min(remaining, READ_RECORDS) * RECORD.size)
+                if not chunk:
+                    return
+                for offset in range(0, len(chunk) - RECORD.size + 1, RECORD.size):
+                    yield decode_record(chunk, offset)
+                remaining -= len(chunk) // RECORD.size
+
+    def refresh(self):
+        """Read index entries the other workers appended since the last refresh"""
+        with self.refresh_lock:
+            self.refreshed = time.monotonic()
+            for name in os.listdir(self.directory):
+                writer, ext = os.path.splitext(name)
+                if ext != ".idx" or writer == self.writer:
+                    continue
+                with open(self._path(name), "rb") as index_file:
+                    index_file.seek(self.index_read.get(name, 0))
+                    data = index_file.read()
+                complete = len(data) - len(data) % INDEX.size
+                self.index_read[name] = self.index_read.get(name, 0) + complete
+                for game_id, segment, offset, count in INDEX.iter_unpack(data[:complete]):
+                    self.index[str(game_id)] = Location(writer, segment, offset, count)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _open_segment(self, number: int):
+        # Opened first: if that fails, the current segment takes the next batch
+        segment_file = open(self._path(f"{self.writer}-{number:06d}.seg"), "ab")
+        if self.segment_file is not None:
+            self.segment_file.close()
+        self.segment = number
+        self.segment_file = segment_file
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            games = [self.pending.get()]
+            # Group commit: everything queued meanwhile shares one fsync
+            while True:
+                try:
+                    games.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            if None in games:
+                stopping = True
+                games = [game for game in games if game is not None]
+            if games:
+                try:
+                    self._write(games)
+                except Exception as e:
+                    metrics.EVENTLOG_DROPPED.inc(amount=len(games))
+                    logs.event(logs.GAME, logging.ERROR, "Could not archive games", exc_info=e,
+                               games=len(games), segment=self.segment)
+
+    def _write(self, games):
+        segment_start = offset = self.segment_file.tell()
+        index_start = self.index_file.tell()
+        try:
+            offset = self._append(games, offset)
+        except Exception:
+            # Cut off a partly written batch so the next one's offsets hold
+            # and the index stays whole entries
+            for file, start in ((self.segment_file, segment_start), (self.index_file, index_start)):
+                try:
+                    file.truncate(start)
+                    file.seek(start)
+                except (OSError, ValueError):
+                    pass
+            raise
+        if offset >= self.segment_bytes:
+            self._open_segment(self.segment + 1)
+
+    def _append(self, games, offset):
+        records, entries, located = [], [], []
+        for game in games:
+            data = encode_game(game)
+            count = len(data) // RECORD.size
+            records.append(data)
+            entries.append(INDEX.pack(int(game.game_id), self.segment, offset, count))
+            located.append((game.game_id, Location(self.writer, self.segment, offset, count)))
+            offset += len(data)
+        self.segment_file.write(b"".join(records))
+        self.segment_file.flush()
+        os.fsync(self.segment_file.fileno())
+        self.index_file.write(b"".join(entries))
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+        for game_id, location in located:
+            self.index[game_id] = location
+        return offset
+
+
+def open_event_log(directory: str) -> Optional[EventLog]:
+    """The event log for an AVIOANE_EVENT_LOG value; None when it is off"""
+    if directory in ("", "off"):
+        return None
+    return EventLog(directory)
@@ -0,0 +1,273 @@
+"""State of one game on the /ws endpoint.
+
+Everything about a game lives on a single Game object, which the game store
+(store.py) keeps as-is in memory or serialises with to_dict/from_dict for the
+shared backends. Sockets and per-connection cursors stay with the worker that
+owns the connection. The lock is used by the in-memory store; a player's
+message is applied and its updates pushed while holding the game's lock, so
+the two players' coroutines never interleave halfway through a turn.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import secrets
+import sys
+import time
+from typing import Optional
+
+import logs
+import protocol
+
+# The rules engine and the bot live with the desktop game
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "desktop"))
+import bot
+from airplane import orientation_of, random_fleet
+from bitboard import Board
+
+WHITE = [255, 255, 255]
+PLAYERS = ("1", "2")
+
+
+def opponent_of(player_id: str) -> str:
+    return "2" if player_id == "1" else "1"
+
+
+def parse_resume_token(token) -> Optional[tuple]:
+    """(game_id, player_id, secret) from a resume token, or None if malformed"""
+    parts = token.split(".", 2) if isinstance(token, str) else ()
+    if len(parts) != 3 or not parts[0].isdigit() or parts[1] not in PLAYERS:
+        return None
+    return tuple(parts)
+
+
+def is_airplane(head, cells, size: int = protocol.BOARD_SIZE) -> bool:
+    """Whether the (row, col) cells are a plane with its head at head, in any orientation"""
+    return orientation_of(head, cells, size) is not None
+
+
+class Game:
+    __slots__ = ("game_id", "size", "planes", "protocols", "boards", "current_player",
+                 "placement_phase", "status", "events", "placements", "tokens", "sessions", "away",
+                 "last_event", "placement_started", "lock")
+
+    def __init__(self, game_id: str, size: int = protocol.BOARD_SIZE,
+                 planes: int = protocol.MAX_PLANES):
+        self.game_id = game_id
+        self.size = size
+        self.planes = planes  # per fleet
+        self.protocols = {}  # player_id -> protocol version, for connected players
+        self.boards = {player_id: Board(size) for player_id in PLAYERS}
+        self.current_player = "1"
+        self.placement_phase = True
+        self.status = 'waiting'
+        self.events = []
+        # player_id -> heads in the order the planes were placed, for the
+        # event log; kept out of the place events, which both players see
+        self.placements = {player_id: [] for player_id in PLAYERS}
+        self.tokens = {}    # player_id -> resume secret
+        self.sessions = {}  # player_id -> connections so far; the latest one plays
+        self.away = {}      # player_id -> session that dropped, while their seat is held
+        self.last_event = time.time()  # wall clock, shared by every worker
+        self.placement_started = 0.0   # when the second player sat down
+        self.lock = asyncio.Lock()
+
+    def to_dict(self) -> dict:
+        return {
+            "game_id": self.game_id,
+            "size": self.size,
+            "planes": self.planes,
+            "protocols": self.protocols,
+            "boards": {
+                player_id: [board.occupied, board.heads, board.shots, board.hits]
+                for player_id, board in self.boards.items()
+            },
+            "current_player": self.current_player,
+            "placement_phase": self.placement_phase,
+            "status": self.status,
+            "events": self.events,
+            "placements": self.placements,
+            "tokens": self.tokens,
+            "sessions": self.sessions,
+            "away": self.away,
+            "last_event": self.last_event,
+            "placement_started": self.placement_started
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Game":
+        # Games saved before boards could vary are on the default board
+        game = cls(data["game_id"], data.get("size", protocol.BOARD_SIZE),
+                   data.get("planes", protocol.MAX_PLANES))
+        game.protocols = data["protocols"]
+        for player_id, (occupied, heads, shots, hits) in data["boards"].items():
+            board = game.boards[player_id]
+            board.occupied, board.heads, board.shots, board.hits = occupied, heads, shots, hits
+        game.current_player = data["current_player"]
+        game.placement_phase = data["placement_phase"]
+        game.status = data["status"]
+        game.events = data["events"]
+        game.placements = data.get("placements", game.placements)
+        game.tokens = data["tokens"]
+        game.sessions = data["sessions"]
+        game.away = data["away"]
+        game.last_event = data["last_event"]
+        game.placement_started = data["placement_started"]
+        return game
+
+    @property
+    def mode(self) -> tuple:
+        return self.size, self.planes
+
+    @property
+    def players(self) -> int:
+        return len(self.protocols)
+
+    def seat(self, player_id: str, version: int) -> str:
+        """Give a new player their seat and return their resume token"""
+        self.protocols[player_id] = version
+        self.sessions[player_id] = 1
+        self.tokens[player_id] = secrets.token_urlsafe(16)
+        self.record_event("join", player=player_id)
+        return f"{self.game_id}.{player_id}.{self.tokens[player_id]}"
+
+    def mark_away(self, player_id: str):
+        """Hold a disconnected player's seat until they resume or it expires"""
+        self.away[player_id] = self.sessions[player_id]
+        self.record_event("away", player=player_id)
+
+    def resume(self, player_id: str, secret: str, version: int) -> Optional[int]:
+        """Take the seat back with its token; returns the new session, or None"""
+        expected = self.tokens.get(player_id)
+        if expected is None or not hmac.compare_digest(expected, secret):
+            return None
+        self.protocols[player_id] = version
+        self.sessions[player_id] += 1
+        if self.away.pop(player_id, None) is not None:
+            self.record_event("back", player=player_id)
+        return self.sessions[player_id]
+
+    def is_over(self) -> bool:
+        return any(board.all_heads_hit() for board in self.boards.values())
+
+    def add_bot(self) -> str:
+        """Seat the computer opponent, place its fleet and return its player id"""
+        player_id = str(self.players + 1)
+        self.protocols[player_id] = protocol.BOT_VERSION
+        self.status = 'in_progress'
+        self.record_event("join", player=player_id, bot=True)
+        for head, cells in random_fleet(planes=self.planes, size=self.size):
+            self.record_placement(player_id, head, cells)
+        self.check_placement_complete()
+        self.run_bots()
+        return player_id
+
+    def run_bots(self):
+        """Let the bot take its turn, if it is the bot's turn"""
+        while (not self.placement_phase and not self.is_over() and
+               self.protocols.get(self.current_player) == protocol.BOT_VERSION):
+            row, col = bot.next_shot(self.boards[opponent_of(self.current_player)])
+            self.record_shot(self.current_player, row, col)
+
+    def record_event(self, op: str, **fields) -> dict:
+        """Append an event to the game's log and return it"""
+        event = {"seq": len(self.events) + 1, "op": op, **fields}
+        self.events.append(event)
+        self.last_event = time.time()
+        if op == "join" and self.players == 2:
+            self.placement_started = self.last_event
+        return event
+
+    def record_placement(self, player_id: str, head, cells) -> Optional[str]:
+        """Validate and store a plane placement, returning an error message if rejected"""
+        if not self.placement_phase:
+            return "Placement phase is over"
+        board = self.boards[player_id]
+        if board.planes >= self.planes:
+            return "All planes already placed"
+        if not isinstance(cells, list) or len(cells) != protocol.PLANE_CELLS:
+            return "Invalid plane"
+        try:
+            head = (head[0], head[1])
+            cells = {(cell[0], cell[1]) for cell in cells}
+        except (TypeError, IndexError, KeyError):
+            return "Invalid plane"
+        if len(cells) != protocol.PLANE_CELLS or head not in cells:
+            return "Invalid plane"
+        if not all(protocol.in_bounds(row, col, self.size) for row, col in cells):
+            return "Plane out of bounds"
+        if not is_airplane(head, cells, self.size):
+            return "Not an airplane"
+        if not board.add_plane(head, cells):
+            return "Plane overlaps another plane"
+
+        self.placements[player_id].append(list(head))
+        self.record_event("place", player=player_id, planes=board.planes)
+        return None
+
+    def record_legacy_grid(self, player_id: str, grid, head_positions):
+        """Derive placements from a full-state (protocol v1) client message"""
+        if grid is None or head_positions is None:
+            return
+        board = self.boards[player_id]
+        placed = board.planes
+        if len(head_positions) == placed:
+            return
+        board.load_grid(grid, head_positions, empty=WHITE)
+        self.placements[player_id] = [[row, col] for row, col in head_positions][:board.planes]
+        for planes in range(placed + 1, board.planes + 1):
+            self.record_event("place", player=player_id, planes=planes)
+
+    def check_placement_complete(self) -> bool:
+        """End the placement phase once both players placed all their planes"""
+        if not self.placement_phase:
+            return False
+        planes_placed_p1 = self.boards["1"].planes
+        planes_placed_p2 = self.boards["2"].planes
+        logs.event(logs.PLACEMENT, logging.DEBUG, "Checking placement", game_id=self.game_id,
+                   planes_p1=planes_placed_p1, planes_p2=planes_placed_p2)
+        if planes_placed_p1 >= self.planes and planes_placed_p2 >= self.planes:
+            self.placement_phase = False
+            self.current_player = "1"
+            self.status = 'in_progress'
+            self.record_event("start", current_player="1", size=self.size, planes=self.planes)
+            logs.event(logs.GAME, logging.INFO, "Placement complete, game started", game_id=self.game_id)
+            return True
+        return False
+
+    def record_shot(self, player_id: str, row: int, col: int) -> Optional[str]:
+        """Resolve a shot, pass the turn and return the result, or None if not allowed"""
+        if self.placement_phase or self.current_player != player_id or self.is_over():
+            return None
+        opponent_id = opponent_of(player_id)
+
+        result = self.boards[opponent_id].fire(row, col)
+        if result is None:
+            return None
+
+        self.current_player = opponent_id
+        self.record_event("fire", player=player_id, row=row, col=col,
+                          result=result, next=opponent_id)
+        return result
+
+    def legacy_update(self, player_id: str) -> dict:
+        """Build the full-state update sent to protocol v1 clients"""
+        own_board = self.boards[player_id]
+        target_board = self.boards[opponent_of(player_id)]
+        return {
+            "type": "update",
+            "opponent_ready": self.players == 2,
+            "your_turn": not self.placement_phase and self.current_player == player_id,
+            "placement_phase": self.placement_phase,
+            "opponent_shots": list(own_board.shot_cells()),
+            "heads_hit": target_board.heads_hit,
+            "opponent_heads_hit": own_board.heads_hit,
+            "shot_results": {
+                f"{row},{col}": result
+                for (row, col), result in target_board.shot_results().items()
+            },
+            "placement_status": {
+                "your_planes": own_board.planes,
+                "opponent_planes": target_board.planes
+            }
+        }
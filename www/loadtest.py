@@ -0,0 +1,312 @@
+"""Drive webServer.py with simulated players and report latency under load.
+
+Usage: python loadtest.py [--url ws://localhost:8000/ws] [--pairs 10,50,100]
+                          [--games G] [--think MS] [--timeout S] [--bot]
+                          [--codec json|orjson|struct] [--size N] [--planes P]
+                          [--server-pid PID] [--seed S]
+
+Every stage of --pairs opens that many pairs of protocol v2 clients at once.
+Each pair meets in a private room, so pairs only ever play each other, and
+plays G complete games: a placement per plane each, then shots at random
+cells until one side has hit every head. With --bot every "pair" is a single
+client playing the server's bot instead. --codec picks the WebSocket
+subprotocol every client asks for (see codec.py), --size and --planes the
+board. A game that is not over after --timeout seconds counts as an error.
+
+A message's latency is the time from sending it to receiving the state_delta
+that records it. Each stage prints messages per second, p50/p95/p99 latency,
+the worst event-loop lag of the server and of this script, and, given
+--server-pid, the peak resident memory of the server and its worker
+processes. Server lag is the avioane_event_loop_lag_seconds gauge scraped
+from /metrics at the --url host; with several workers it is whichever
+worker answered. When the client lag climbs, the latencies measure the load
+generator rather than the server.
+
+Needs nothing but the websockets package and a running server with the rate
+limit off, since simulated players answer far faster than people do, e.g.
+
+    AVIOANE_BOT_TIMEOUT=0 AVIOANE_RATE_MESSAGES=0 uvicorn webServer:app --port 8000
+
+Several workers only pair players through a shared store (AVIOANE_STORE).
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+import websockets
+
+import codec
+import metrics
+import protocol
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "desktop"))
+from airplane import random_fleet
+
+# How often the monitor samples loop lag and server memory, in seconds
+SAMPLE_INTERVAL = 0.1
+SERVER_LAG = "avioane_event_loop_lag_seconds"
+
+
+class StageStats:
+    def __init__(self):
+        self.latencies = []
+        self.sent = 0
+        self.received = 0
+        self.games = 0
+        self.abandoned = 0
+        self.errors = 0
+        self.loop_lag = 0.0  # this script's
+        self.server_lag = None  # None until /metrics answers
+        self.rss_kib = 0
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def rss_kib(pid):
+    """Resident memory of pid and all its descendants, in KiB; 0 if it is gone"""
+    total = 0
+    pending = [pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as children:
+                    pending.extend(int(child) for child in children.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return total
+
+
+async def monitor(stats, server_pid):
+    """Record the worst loop lag of this script and the server memory seen until cancelled"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(SAMPLE_INTERVAL)
+        stats.loop_lag = max(stats.loop_lag, loop.time() - start - SAMPLE_INTERVAL)
+        if server_pid:
+            stats.rss_kib = max(stats.rss_kib, rss_kib(server_pid))
+
+
+def metrics_url(ws_url):
+    """The server's /metrics, on the host of its WebSocket URL"""
+    parts = urllib.parse.urlsplit(ws_url)
+    scheme = "https" if parts.scheme == "wss" else "http"
+    return urllib.parse.urlunsplit((scheme, parts.netloc, "/metrics", "", ""))
+
+
+def scrape_lag(url):
+    """The server's latest event-loop lag sample, or None if it cannot be read"""
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            text = response.read().decode()
+    except OSError:
+        return None
+    for line in text.splitlines():
+        if line.startswith(SERVER_LAG + " "):
+            try:
+                return float(line.split()[1])
+            except ValueError:
+                return None
+    return None
+
+
+async def watch_server(stats, url):
+    """Record the worst server loop lag seen until cancelled, one scrape per server sample"""
+    while True:
+        lag = await asyncio.to_thread(scrape_lag, url)
+        if lag is not None:
+            stats.server_lag = max(stats.server_lag or 0.0, lag)
+        await asyncio.sleep(metrics.LAG_INTERVAL)
+
+
+class Player:
+    """One simulated client: places its fleet, then fires whenever it may"""
+
+    def __init__(self, websocket, rng, stats, think, message_codec):
+        self.websocket = websocket
+        self.codec = message_codec
+        self.rng = rng
+        self.stats = stats
+        self.think = think
+        self.player_id = None
+        self.size = self.planes = None  # from init
+        self.pending = {}  # event key -> time the message was sent
+        self.targets = []
+        self.my_turn = False
+        self.heads = {"1": 0, "2": 0}
+
+    async def send(self, key, message):
+        self.pending[key] = time.perf_counter()
+        self.stats.sent += 1
+        await self.websocket.send(self.codec.encode(message))
+
+    async def place_fleet(self):
+        fleet = random_fleet(self.rng, self.planes, self.size)
+        for planes, (head, cells) in enumerate(fleet, 1):
+            await self.send(("place", planes),
+                            {"type": "place", "head": list(head), "cells": cells})
+
+    async def fire(self):
+        if self.think:
+            await asyncio.sleep(self.think)
+        cell = self.targets.pop()
+        row, col = divmod(cell, self.size)
+        self.my_turn = False
+        await self.send(("fire", row, col), {"type": "fire", "row": row, "col": col})
+
+    def apply(self, event):
+        """Track the game from one event; returns 'won', 'lost', 'left' or None"""
+        op = event["op"]
+        now = time.perf_counter()
+        if event.get("player") == self.player_id:
+            if op == "place":
+                key = ("place", event["planes"])
+            else:
+                key = (op, event.get("row"), event.get("col"))
+            sent = self.pending.pop(key, None)
+            if sent is not None:
+                self.stats.latencies.append(now - sent)
+        if op == "start":
+            self.my_turn = event["current_player"] == self.player_id
+        elif op == "fire":
+            if event["result"] == "head":
+                self.heads[event["player"]] += 1
+                if self.heads[event["player"]] == self.planes:
+                    return "won" if event["player"] == self.player_id else "lost"
+            self.my_turn = event["next"] == self.player_id
+        elif op == "leave" and event["player"] != self.player_id:
+            return "left"
+        return None
+
+    async def play(self):
+        """Play until the game ends; returns how it ended"""
+        init = self.codec.decode(await self.websocket.recv())
+        if init.get("type") != "init":
+            raise RuntimeError(f"Expected init, got {init}")
+        self.player_id = init["player_id"]
+        self.size, self.planes = init["size"], init["planes"]
+        self.targets = list(range(self.size * self.size))
+        self.rng.shuffle(self.targets)
+        await self.place_fleet()
+        async for raw in self.websocket:
+            self.stats.received += 1
+            message = self.codec.decode(raw)
+            if message["type"] == "ping":
+                await self.websocket.send(self.codec.encode({"type": "pong"}))
+                continue
+            if message["type"] == "error":
+                self.stats.errors += 1
+                continue
+            for event in message.get("events", ()):
+                outcome = self.apply(event)
+                if outcome:
+                    return outcome
+            if self.my_turn and self.targets:
+                await self.fire()
+        return "left"
+
+
+async def play_game(url, rng, stats, think, timeout, message_codec):
+    """One client's game; counted once per finished game by the winner"""
+    async with websockets.connect(url, max_queue=None,
+                                  subprotocols=[codec.subprotocol(message_codec)]) as websocket:
+        if websocket.subprotocol != codec.subprotocol(message_codec):
+            raise RuntimeError(f"Server did not accept {message_codec.name}")
+        player = Player(websocket, rng, stats, think, message_codec)
+        outcome = await asyncio.wait_for(player.play(), timeout)
+    if outcome == "won":
+        stats.games += 1
+    elif outcome == "left":
+        stats.abandoned += 1
+    return outcome
+
+
+async def play_pair(url, room, games, rng, stats, think, timeout, bot, message_codec):
+    for game in range(games):
+        try:
+            if bot:
+                outcome = await play_game(f"{url}&opponent=bot", rng, stats, think,
+                                          timeout, message_codec)
+                if outcome == "lost":
+                    stats.games += 1
+                continue
+            game_url = f"{url}&room={room}-{game}"
+            await asyncio.gather(play_game(game_url, rng, stats, think, timeout, message_codec),
+                                 play_game(game_url, rng, stats, think, timeout, message_codec))
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException, RuntimeError) as e:
+            stats.errors += 1
+            print(f"  {room}: {e!r}", file=sys.stderr)
+
+
+async def run_stage(args, pairs, run_id, rng):
+    stats = StageStats()
+    watcher = asyncio.create_task(monitor(stats, args.server_pid))
+    scraper = asyncio.create_task(watch_server(stats, metrics_url(args.url)))
+    start = time.perf_counter()
+    url = f"{args.url}?protocol=2&size={args.size}&planes={args.planes}"
+    await asyncio.gather(*(
+        play_pair(url, f"lt{run_id}-{pairs}-{pair}", args.games,
+                  random.Random(rng.random()), stats, args.think / 1000, args.timeout, args.bot,
+                  codec.CODECS[args.codec])
+        for pair in range(pairs)
+    ))
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    scraper.cancel()
+
+    latencies = sorted(stats.latencies)
+    memory = f"{stats.rss_kib / 1024:7.1f} MiB" if args.server_pid else "      -    "
+    server_lag = f"{stats.server_lag * 1000:8.1f}" if stats.server_lag is not None else f"{'-':>8}"
+    print(f"{pairs:6d} {stats.games:6d} {stats.abandoned:5d} {stats.errors:5d} "
+          f"{stats.sent / elapsed:9.0f} "
+          f"{percentile(latencies, 0.50) * 1000:8.2f} {percentile(latencies, 0.95) * 1000:8.2f} "
+          f"{percentile(latencies, 0.99) * 1000:8.2f} {server_lag} {stats.loop_lag * 1000:8.1f} {memory}",
+          flush=True)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="WebSocket load generator for webServer.py")
+    parser.add_argument("--url", default="ws://localhost:8000/ws")
+    parser.add_argument("--pairs", default="10,50,100",
+                        help="comma-separated concurrency levels, one stage each")
+    parser.add_argument("--games", type=int, default=2, help="games played by each pair per stage")
+    parser.add_argument("--think", type=float, default=0, help="milliseconds before each shot")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds allowed per game")
+    parser.add_argument("--bot", action="store_true", help="play the server's bot instead of pairs")
+    parser.add_argument("--codec", default="json", choices=sorted(codec.CODECS),
+                        help="message codec to negotiate")
+    parser.add_argument("--size", type=int, default=protocol.BOARD_SIZE, help="cells a side")
+    parser.add_argument("--planes", type=int, default=protocol.MAX_PLANES, help="planes per fleet")
+    parser.add_argument("--server-pid", type=int, default=None,
+                        help="report the peak RSS of this process and its children")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    if protocol.parse_mode({"size": args.size, "planes": args.planes}) is None:
+        parser.error(protocol.INVALID_MODE)
+
+    rng = random.Random(args.seed)
+    run_id = f"{rng.getrandbits(24):06x}"
+    print(f"{'pairs':>6} {'games':>6} {'left':>5} {'errs':>5} {'msgs/s':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'srv lag':>8} {'cli lag':>8} {'server RSS':>11}")
+    for pairs in (int(level) for level in args.pairs.split(",")):
+        await run_stage(args, pairs, run_id, rng)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,166 @@
+"""Structured logging for the /ws endpoint, written off the event loop.
+
+Records go to categories under the "avioane" logger and carry fields such as
+game_id, player_id and msg_type:
+
+    logs.event(logs.MATCH, logging.INFO, "Created new game", game_id=game_id)
+
+    avioane.match      matchmaking: games opened, seats taken
+    avioane.game       joins, leaves, bots, placement phase ending
+    avioane.placement  per-message placement progress (DEBUG, sampled)
+    avioane.conn       disconnects and socket errors (rate limited)
+
+The loop only puts records on a queue; a QueueListener thread formats them
+and writes to stdout, so a slow terminal or pipe never stalls a game. Tuned
+with environment variables, categories named without the "avioane." prefix:
+
+    AVIOANE_LOG_LEVEL=INFO                 level of every category
+    AVIOANE_LOG_LEVELS=placement:DEBUG     per-category levels
+    AVIOANE_LOG_SAMPLE=placement:10        keep 1 record in N
+    AVIOANE_LOG_RATE=conn:50               at most N records per second
+    AVIOANE_LOG_FORMAT=text                or json, one object per line
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+MATCH = logging.getLogger("avioane.match")
+GAME = logging.getLogger("avioane.game")
+PLACEMENT = logging.getLogger("avioane.placement")
+CONN = logging.getLogger("avioane.conn")
+
+CATEGORIES = {"match": MATCH, "game": GAME, "placement": PLACEMENT, "conn": CONN}
+
+DEFAULT_SAMPLE = "placement:10"
+DEFAULT_RATE = "conn:50"
+
+_listener = None
+_handler = None
+
+
+def event(logger: logging.Logger, level: int, message: str, exc_info=None, **fields):
+    """Log message with structured fields; free when the level is disabled"""
+    if logger.isEnabledFor(level):
+        logger.log(level, message, exc_info=exc_info, extra={"fields": fields})
+
+
+def _parse(spec: str) -> dict:
+    """'placement:10,conn:50' -> {'placement': '10', 'conn': '50'}"""
+    settings = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        category, _, value = item.partition(":")
+        if category in CATEGORIES and value:
+            settings[category] = value
+    return settings
+
+
+class SampleFilter(logging.Filter):
+    """Keep every nth record and note how many it stands for"""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self.seen = 0
+
+    def filter(self, record):
+        self.seen += 1
+        if self.seen % self.every:
+            return False
+        record.fields = {**getattr(record, "fields", {}), "sampled": self.every}
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket of per_second records; the next one kept counts the dropped"""
+
+    def __init__(self, per_second: float):
+        super().__init__()
+        self.rate = per_second
+        self.tokens = per_second
+        self.updated = time.monotonic()
+        self.dropped = 0
+
+    def filter(self, record):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            self.dropped += 1
+            return False
+        self.tokens -= 1
+        if self.dropped:
+            record.fields = {**getattr(record, "fields", {}), "dropped": self.dropped}
+            self.dropped = 0
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(f"{key}={value}" for key, value in getattr(record, "fields", {}).items())
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()}"
+        if fields:
+            line = f"{line} {fields}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LoopQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to the listener thread as they are, formatting nothing here"""
+
+    def prepare(self, record):
+        return record
+
+
+def start():
+    """Configure the categories from the environment and start the writer thread"""
+    global _listener, _handler
+    if _listener is not None:
+        return
+    root = logging.getLogger("avioane")
+    for logger in CATEGORIES.values():
+        logger.filters.clear()
+    root.setLevel(os.environ.get("AVIOANE_LOG_LEVEL", "INFO").upper())
+    root.propagate = False
+    for category, level in _parse(os.environ.get("AVIOANE_LOG_LEVELS", "")).items():
+        CATEGORIES[category].setLevel(level.upper())
+    for category, every in _parse(os.environ.get("AVIOANE_LOG_SAMPLE", DEFAULT_SAMPLE)).items():
+        CATEGORIES[category].addFilter(SampleFilter(int(every)))
+    for category, rate in _parse(os.environ.get("AVIOANE_LOG_RATE", DEFAULT_RATE)).items():
+        CATEGORIES[category].addFilter(RateLimitFilter(float(rate)))
+
+    output = logging.StreamHandler(sys.stdout)
+    json_format = os.environ.get("AVIOANE_LOG_FORMAT", "text") == "json"
+    output.setFormatter(JSONFormatter() if json_format else TextFormatter())
+    records = queue.SimpleQueue()
+    _handler = LoopQueueHandler(records)
+    root.addHandler(_handler)
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+
+
+def stop():
+    """Flush the queue and stop the writer thread"""
+    global _listener, _handler
+    if _listener is not None:
+        logging.getLogger("avioane").removeHandler(_handler)
+        _listener.stop()
+        _listener = _handler = None
@@ -0,0 +1,105 @@
+"""Matchmaking for the /ws endpoint.
+
+Public games wait in a FIFO of open seats: a new player takes the oldest open
+seat, or opens a game of their own when there is none. Private rooms are
+joined by code and never enter the public queue. Every operation is O(1) no
+matter how many games are running.
+
+Each board size and plane count has a queue of its own, named by
+queue_name, and a room code only pairs players asking for the same board.
+The default board's queue is "", so its seats and rooms keep the keys they
+had before boards could vary.
+"""
+import itertools
+import re
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import protocol
+
+ROOM_CODE = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+
+def valid_room_code(code) -> bool:
+    return isinstance(code, str) and bool(ROOM_CODE.match(code))
+
+
+def queue_name(mode: tuple = protocol.DEFAULT_MODE) -> str:
+    """The public queue of games with this (size, planes)"""
+    return "" if mode == protocol.DEFAULT_MODE else "{}x{}".format(*mode)
+
+
+def room_key(room: str, queue: str = "") -> str:
+    """The room code scoped to a queue; @ never appears in a code"""
+    return f"{room}@{queue}" if queue else room
+
+
+class Matchmaker:
+    def __init__(self):
+        self.open_seats = {}  # queue -> OrderedDict of game_id -> None, oldest first
+        self.queue_of = {}    # game_id -> queue its open seat is in
+        self.rooms = {}       # room key -> game_id waiting for a second player
+        self.room_of = {}     # game_id -> room key
+        self._next_id = itertools.count()
+
+    def new_game_id(self) -> str:
+        """Allocate a game ID; IDs are never reused while the process runs"""
+        return str(next(self._next_id))
+
+    def take(self, room: Optional[str] = None, queue: str = "") -> Optional[str]:
+        """Take the queue's oldest open seat, or the room's seat; None if there is none"""
+        if room is not None:
+            game_id = self.rooms.pop(room_key(room, queue), None)
+            if game_id is not None:
+                del self.room_of[game_id]
+            return game_id
+        seats = self.open_seats.get(queue)
+        if seats:
+            game_id, _ = seats.popitem(last=False)
+            del self.queue_of[game_id]
+            if not seats:
+                del self.open_seats[queue]
+            return game_id
+        return None
+
+    def open(self, room: Optional[str] = None, queue: str = "") -> str:
+        """Allocate a new game and offer its second seat"""
+        game_id = self.new_game_id()
+        if room is not None:
+            key = room_key(room, queue)
+            self.rooms[key] = game_id
+            self.room_of[game_id] = key
+        else:
+            self.open_seats.setdefault(queue, OrderedDict())[game_id] = None
+            self.queue_of[game_id] = queue
+        return game_id
+
+    def join(self, room: Optional[str] = None, queue: str = "") -> Tuple[str, bool]:
+        """Return (game_id, created) for a new player.
+
+        created is True when no seat was open and the player starts a new game,
+        which then waits for an opponent.
+        """
+        game_id = self.take(room, queue)
+        if game_id is not None:
+            return game_id, False
+        return self.open(room, queue), True
+
+    def discard(self, game_id: str) -> bool:
+        """Stop offering a game's seat; returns whether it was still open"""
+        queue = self.queue_of.pop(game_id, None)
+        if queue is not None:
+            seats = self.open_seats[queue]
+            del seats[game_id]
+            if not seats:
+                del self.open_seats[queue]
+            return True
+        room = self.room_of.pop(game_id, None)
+        if room is not None:
+            del self.rooms[room]
+            return True
+        return False
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.queue_of) + len(self.rooms)
@@ -0,0 +1,153 @@
+"""Prometheus metrics for the /ws endpoint, served as text on /metrics.
+
+Metrics are plain Python numbers updated from the event loop. Every uvicorn
+worker is a single thread running one loop, so recording a sample is a dict
+update (plus a bisect for histograms) and never takes a lock. Each worker
+counts what its own sockets do; with several workers behind one port a scrape
+sees whichever worker answered, so scrape workers on separate ports when the
+totals matter.
+"""
+import asyncio
+from bisect import bisect_left
+
+# Seconds between event-loop lag samples
+LAG_INTERVAL = 0.5
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 16384, 65536)
+
+# Message types are client input; anything else is counted as "other"
+MESSAGE_TYPES = frozenset(("place", "fire", "ack", "legacy", "init", "state_delta", "update", "error",
+                           "ping", "pong"))
+
+REGISTRY = []
+
+
+def message_type(message: dict, legacy: bool = False) -> str:
+    """The label for a message, bounded to MESSAGE_TYPES"""
+    if legacy:
+        return "legacy"
+    msg_type = message.get("type") if isinstance(message, dict) else None
+    return msg_type if msg_type in MESSAGE_TYPES else "other"
+
+
+def _format_labels(names, values, extra="") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # label values tuple -> sample(s)
+        REGISTRY.append(self)
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self.values[()] = 0  # report 0 before the first event
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        state = self.values.get(labels)
+        if state is None:
+            # Per-bucket counts (the last one is +Inf) and the running sum
+            state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                extra = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, extra)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+GAMES_ACTIVE = Gauge("avioane_games_active", "Games with a player connected to this worker")
+CONNECTIONS = Gauge("avioane_connections", "Player sockets open on this worker")
+SPECTATORS = Gauge("avioane_spectators", "Spectator sockets open on this worker")
+SPECTATOR_OVERFLOWS = Counter("avioane_spectator_overflows_total",
+                              "Spectators whose queue filled up, by policy", ("policy",))
+CODECS = Counter("avioane_codec_connections_total", "Sockets accepted by negotiated codec", ("codec",))
+QUEUE_DEPTH = Gauge("avioane_matchmaking_queue_depth", "Games waiting for a second player")
+MESSAGES = Counter("avioane_messages_total", "WebSocket messages by direction and type",
+                   ("direction", "type"))
+HANDLER_SECONDS = Histogram("avioane_handler_seconds",
+                            "Time to apply a client message and push its updates", ("type",))
+PAYLOAD_BYTES = Histogram("avioane_payload_bytes", "WebSocket message sizes by direction",
+                          ("direction",), SIZE_BUCKETS)
+LOOP_LAG = Gauge("avioane_event_loop_lag_seconds", "Latest event-loop lag sample")
+LOOP_LAG_SECONDS = Histogram("avioane_event_loop_lag_distribution_seconds",
+                             "Event-loop lag samples")
+OUTBOX_MESSAGES = Gauge("avioane_outbox_messages", "Messages queued for player sockets on this worker")
+OUTBOX_COALESCED = Counter("avioane_outbox_coalesced_total",
+                           "Queued messages folded into a newer one, by type", ("type",))
+OUTBOX_CLOSES = Counter("avioane_outbox_closes_total",
+                        "Player sockets closed by their writer: overflow, heartbeat or send_timeout",
+                        ("reason",))
+REJECTED = Counter("avioane_rejected_messages_total",
+                   "Client frames refused: too_large, rate, malformed or invalid", ("reason",))
+GAMES_STARTED = Counter("avioane_games_started_total", "Games whose placement phase ended")
+GAMES_COMPLETED = Counter("avioane_games_completed_total", "Games played until every head of a fleet was hit")
+GAMES_ABANDONED = Counter("avioane_games_abandoned_total", "Started games a player left before the end")
+GAMES_EXPIRED = Counter("avioane_games_expired_total", "Games the reaper ended, by the timeout hit",
+                        ("reason",))
+TIMERS = Gauge("avioane_game_timers", "Game deadlines held in this worker's timer wheel")
+# Counted on the event log's writer thread, the only one that updates it
+EVENTLOG_DROPPED = Counter("avioane_eventlog_dropped_games_total",
+                           "Finished games the event log failed to write")
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+async def watch_loop_lag(interval: float = LAG_INTERVAL):
+    """Sample how late the loop wakes a sleeping task, until cancelled"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_SECONDS.observe(lag)
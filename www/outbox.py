@@ -0,0 +1,138 @@
+"""Per-connection send queue, drained by one writer task per player socket.
+
+Game code queues messages with put(), which never waits, so a player whose
+socket is slow or stalled holds up nobody but themselves: not the game lock,
+not the listener delivering to both players, not their opponent.
+
+While a message waits in the queue, a newer one may supersede it:
+
+    state_delta  consecutive deltas merge into one carrying all their events
+    update       a protocol v1 full-state update replaces the queued one
+
+If the queue still fills up (AVIOANE_OUTBOX messages), or a send takes longer
+than the heartbeat timeout, the socket is closed; the client reconnects and
+resumes from its last seq.
+
+Protocol v2 peers are sent {"type": "ping"} after HEARTBEAT_INTERVAL seconds
+without hearing from them, and answer {"type": "pong"}. A peer silent for
+HEARTBEAT_TIMEOUT seconds is taken for dead and its socket closed, which
+holds its seat for resuming like any other drop.
+"""
+import asyncio
+import os
+from collections import deque
+
+import metrics
+import protocol
+
+OUTBOX_SIZE = int(os.environ.get("AVIOANE_OUTBOX", "32"))
+
+PING = {"type": "ping"}
+
+# Close codes: the peer fell too far behind, or stopped answering
+CLOSE_OVERFLOW = 1013
+CLOSE_DEAD = 1001
+
+
+class Outbox:
+    __slots__ = ("websocket", "codec", "heartbeat", "queue", "ready", "last_seen",
+                 "last_ping", "close_code")
+
+    def __init__(self, websocket, codec, heartbeat: bool):
+        self.websocket = websocket
+        self.codec = codec
+        self.heartbeat = heartbeat and protocol.HEARTBEAT_INTERVAL > 0 and protocol.HEARTBEAT_TIMEOUT > 0
+        self.queue = deque()  # [message, payload or None]
+        self.ready = asyncio.Event()
+        self.last_seen = self.last_ping = asyncio.get_running_loop().time()
+        self.close_code = None
+
+    def __len__(self):
+        return len(self.queue)
+
+    def seen(self):
+        """Note that the peer sent something"""
+        self.last_seen = asyncio.get_running_loop().time()
+
+    def close(self, code: int):
+        """Have the writer close the socket, dropping whatever is still queued"""
+        if self.close_code is None:
+            self.close_code = code
+        self.ready.set()
+
+    def put(self, message: dict, payload=None):
+        """Queue a message; payload is its encoding in this codec, if already known"""
+        if self.close_code is not None:
+            return
+        if self.queue and self._coalesce(message):
+            return
+        if len(self.queue) >= OUTBOX_SIZE:
+            metrics.OUTBOX_CLOSES.inc("overflow")
+            self.close_code = CLOSE_OVERFLOW
+        else:
+            self.queue.append([message, payload])
+        self.ready.set()
+
+    def _coalesce(self, message: dict) -> bool:
+        """Fold message into the last queued one if it supersedes it"""
+        last = self.queue[-1]
+        queued, kind = last[0], message.get("type")
+        if kind != queued.get("type"):
+            return False
+        if kind == "state_delta" and message["events"] and \
+                message["events"][0]["seq"] == queued["seq"] + 1:
+            last[0] = protocol.state_delta(message["seq"], queued["events"] + message["events"])
+        elif kind == "update":
+            last[0] = message
+        else:
+            return False
+        last[1] = None
+        metrics.OUTBOX_COALESCED.inc(kind)
+        return True
+
+    def _pulse(self, now: float) -> bool:
+        """Ping a quiet peer; False once it has been silent too long"""
+        silent = now - self.last_seen
+        if silent >= protocol.HEARTBEAT_TIMEOUT:
+            return False
+        if silent >= protocol.HEARTBEAT_INTERVAL and now - self.last_ping >= protocol.HEARTBEAT_INTERVAL:
+            self.last_ping = now
+            self.queue.append([PING, None])
+        return True
+
+    async def run(self):
+        """Write queued messages until the socket is closed"""
+        loop = asyncio.get_running_loop()
+        interval = protocol.HEARTBEAT_INTERVAL if self.heartbeat else None
+        timeout = protocol.HEARTBEAT_TIMEOUT if protocol.HEARTBEAT_TIMEOUT > 0 else None
+        while True:
+            if not self.queue and self.close_code is None:
+                self.ready.clear()
+                try:
+                    await asyncio.wait_for(self.ready.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+            if self.close_code is None and self.heartbeat and not self._pulse(loop.time()):
+                metrics.OUTBOX_CLOSES.inc("heartbeat")
+                self.close_code = CLOSE_DEAD
+            if self.close_code is not None:
+                try:
+                    await asyncio.wait_for(self.websocket.close(code=self.close_code), timeout)
+                except (asyncio.TimeoutError, RuntimeError):
+                    pass  # already closed, or the peer is gone
+                return
+            if not self.queue:
+                continue
+            message, payload = self.queue.popleft()
+            if payload is None:
+                payload = self.codec.encode(message)
+            metrics.MESSAGES.inc("out", metrics.message_type(message))
+            metrics.PAYLOAD_BYTES.observe(len(payload), "out")
+            send = self.websocket.send_bytes if isinstance(payload, bytes) else self.websocket.send_text
+            try:
+                await asyncio.wait_for(send(payload), timeout)
+            except asyncio.TimeoutError:
+                metrics.OUTBOX_CLOSES.inc("send_timeout")
+                self.close_code = CLOSE_DEAD
+            except Exception:
+                return  # the socket is gone; the reader sees the disconnect
@@ -0,0 +1,146 @@
+"""Wire protocol for the /ws endpoint.
+
+Version 1 is the original full-state format: every client message carries the
+whole grid, shots matrix and head positions, and every reply carries the full
+opponent_shots list and shot_results dict.
+
+Version 2 is event based. Clients send small typed messages:
+
+    {"type": "place", "head": [row, col], "cells": [[row, col], ...]}
+    {"type": "fire", "row": row, "col": col}
+    {"type": "ack", "seq": seq}
+    {"type": "pong"}                      answers the server's {"type": "ping"}
+
+and the server answers with the events recorded since the client's cursor:
+
+    {"type": "state_delta", "seq": last_seq, "events": [{"seq": 1, "op": ...}, ...]}
+
+The init message carries a resume token. A client that lost its connection
+reconnects with /ws?resume=<token>&seq=<last seq it saw> within
+RESUME_GRACE seconds and is sent only the events it missed.
+
+Games are played on a BOARD_SIZE board with MAX_PLANES planes unless the
+client asks for another with ?size=<cells a side>&planes=<planes per fleet>;
+players are only paired with players who asked for the same. The init
+message and the game's "start" event carry the size and plane count.
+Protocol v1 clients always get the default board.
+"""
+import os
+import sys
+from typing import Optional
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "desktop"))
+from airplane import CELLS_PER_PLANE, MAX_BOARD_SIZE, MIN_BOARD_SIZE, valid_mode
+
+LEGACY_VERSION = 1
+PROTOCOL_VERSION = 2
+
+# Older script.js builds never ask for a protocol version; keep serving them
+# the full-state format unless this is switched off.
+LEGACY_PROTOCOL = os.environ.get("AVIOANE_LEGACY_PROTOCOL", "1") != "0"
+
+# Seconds a player waits in the public queue before the bot takes the other
+# seat; 0 turns the fallback off. Clients can ask for the bot with ?opponent=bot.
+BOT_TIMEOUT = float(os.environ.get("AVIOANE_BOT_TIMEOUT", "30"))
+
+# Seconds a disconnected player's seat is kept for them to resume; 0 ends
+# the game as soon as either player disconnects.
+RESUME_GRACE = float(os.environ.get("AVIOANE_RESUME_GRACE", "30"))
+
+# Protocol v2 players are pinged after HEARTBEAT_INTERVAL seconds of silence
+# and disconnected after HEARTBEAT_TIMEOUT, their seat held as for any other
+# drop; a send stuck for HEARTBEAT_TIMEOUT also disconnects. 0 turns it off.
+HEARTBEAT_INTERVAL = float(os.environ.get("AVIOANE_HEARTBEAT_INTERVAL", "5"))
+HEARTBEAT_TIMEOUT = float(os.environ.get("AVIOANE_HEARTBEAT_TIMEOUT", "15"))
+
+# Seconds before the reaper ends a game: with no events at all, with the
+# placement phase still going after both players sat down, and with the
+# current player not firing. The player holding the game up forfeits; 0
+# turns a timeout off.
+IDLE_TIMEOUT = float(os.environ.get("AVIOANE_IDLE_TIMEOUT", "600"))
+PLACEMENT_TIMEOUT = float(os.environ.get("AVIOANE_PLACEMENT_TIMEOUT", "300"))
+TURN_TIMEOUT = float(os.environ.get("AVIOANE_TURN_TIMEOUT", "120"))
+
+# Protocol "version" recorded for the server-side bot seat, which has no socket
+BOT_VERSION = 0
+
+BOARD_SIZE = 10
+PLANE_CELLS = 10
+MAX_PLANES = 3
+DEFAULT_MODE = (BOARD_SIZE, MAX_PLANES)
+INVALID_MODE = (f"Boards are {MIN_BOARD_SIZE} to {MAX_BOARD_SIZE} cells a side with at most one "
+                f"plane per {CELLS_PER_PLANE} cells (one on the smallest); protocol v1 plays only "
+                f"{BOARD_SIZE}x{BOARD_SIZE} with {MAX_PLANES} planes")
+
+
+def negotiate_version(query_params) -> int:
+    """Pick the protocol version requested in the ?protocol= query parameter"""
+    try:
+        requested = int(query_params.get("protocol", LEGACY_VERSION))
+    except (TypeError, ValueError):
+        requested = LEGACY_VERSION
+    if requested >= PROTOCOL_VERSION:
+        return PROTOCOL_VERSION
+    return LEGACY_VERSION
+
+
+def parse_mode(query_params) -> Optional[tuple]:
+    """(size, planes) from the ?size= and ?planes= query parameters, or None if not allowed"""
+    try:
+        mode = (int(query_params.get("size", BOARD_SIZE)), int(query_params.get("planes", MAX_PLANES)))
+    except (TypeError, ValueError):
+        return None
+    return mode if valid_mode(*mode) else None
+
+
+def is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def in_bounds(row, col, size: int = BOARD_SIZE) -> bool:
+    return is_int(row) and is_int(col) and 0 <= row < size and 0 <= col < size
+
+
+def is_cell(cell, size: int = BOARD_SIZE) -> bool:
+    """A [row, col] pair on the board"""
+    return isinstance(cell, (list, tuple)) and len(cell) == 2 and in_bounds(*cell, size)
+
+
+def _is_board_matrix(matrix, valid_entry) -> bool:
+    return (isinstance(matrix, list) and len(matrix) == BOARD_SIZE and
+            all(isinstance(line, list) and len(line) == BOARD_SIZE and all(map(valid_entry, line))
+                for line in matrix))
+
+
+def _is_colour(colour) -> bool:
+    return (isinstance(colour, list) and len(colour) == 3 and
+            all(is_int(channel) and 0 <= channel <= 255 for channel in colour))
+
+
+def legacy_error(data: dict) -> Optional[str]:
+    """Why a protocol v1 full-state message is malformed, or None if it is not"""
+    grid, shots, heads = data.get("grid"), data.get("shots"), data.get("head_positions")
+    if grid is not None and not _is_board_matrix(grid, _is_colour):
+        return "Invalid grid"
+    if shots is not None and not _is_board_matrix(shots, lambda shot: isinstance(shot, bool)):
+        return "Invalid shots"
+    if heads is not None and not (isinstance(heads, list) and len(heads) <= MAX_PLANES and
+                                  all(map(is_cell, heads))):
+        return "Invalid head positions"
+    return None
+
+
+def state_delta(seq: int, events: list) -> dict:
+    """Build a state_delta message for a slice of the game's event log"""
+    return {
+        "type": "state_delta",
+        "seq": seq,
+        "events": events
+    }
+
+
+def error(message: str, code: str = None) -> dict:
+    reply = {"type": "error", "message": message}
+    if code:
+        reply["code"] = code
+    return reply
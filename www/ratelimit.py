@@ -0,0 +1,75 @@
+"""Per-connection limits on what a client may send to /ws.
+
+Every frame is checked here before it is decoded. A frame over
+MAX_MESSAGE_BYTES closes the socket (1009). Otherwise it must fit two token
+buckets, one counting messages and one counting bytes, each refilled at its
+rate per second and holding up to BURST seconds of it. A frame that does
+not fit is dropped undecoded; a client that keeps sending past MAX_STRIKES
+dropped frames in a row is closed (1008). A rate of 0 turns its bucket off.
+
+    AVIOANE_MAX_MESSAGE=8192      bytes; a protocol v1 grid is about 2.5 KiB
+    AVIOANE_RATE_MESSAGES=20      messages per second
+    AVIOANE_RATE_BYTES=32768      bytes per second
+"""
+import os
+import time
+
+MAX_MESSAGE_BYTES = int(os.environ.get("AVIOANE_MAX_MESSAGE", "8192"))
+# What uvicorn buffers before the app sees a frame (--ws-max-size in the Procfile)
+PROTOCOL_MAX_BYTES = 65536
+MESSAGE_RATE = float(os.environ.get("AVIOANE_RATE_MESSAGES", "20"))
+BYTE_RATE = float(os.environ.get("AVIOANE_RATE_BYTES", "32768"))
+BURST = 2.0
+MAX_STRIKES = 50
+
+ACCEPT, LIMITED, TOO_LARGE = "accept", "limited", "too_large"
+
+CLOSE_TOO_LARGE = 1009
+CLOSE_POLICY = 1008
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float = BURST):
+        self.rate = rate
+        self.capacity = rate * burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def has(self, amount: float) -> bool:
+        return self.rate <= 0 or self.tokens >= amount
+
+    def take(self, amount: float):
+        if self.rate > 0:
+            self.tokens -= amount
+
+
+class Limiter:
+    """The buckets of one connection"""
+    __slots__ = ("messages", "bytes", "strikes")
+
+    def __init__(self):
+        self.messages = TokenBucket(MESSAGE_RATE)
+        self.bytes = TokenBucket(BYTE_RATE)
+        self.strikes = 0  # frames dropped since the last one let through
+
+    def check(self, size: int) -> str:
+        """ACCEPT, LIMITED or TOO_LARGE for a frame of size bytes"""
+        if size > MAX_MESSAGE_BYTES:
+            return TOO_LARGE
+        now = time.monotonic()
+        self.messages.refill(now)
+        self.bytes.refill(now)
+        # A frame bigger than the whole byte bucket could never be let through
+        if not self.messages.has(1) or not self.bytes.has(min(size, self.bytes.capacity)):
+            self.strikes += 1
+            return LIMITED
+        self.messages.take(1)
+        self.bytes.take(size)
+        self.strikes = 0
+        return ACCEPT
@@ -0,0 +1,90 @@
+"""Per-game deadlines for ending idle and abandoned games.
+
+Every time a game's events are published the worker works out when the game
+times out (see protocol.py for the timeouts) and files it in a hashed timer
+wheel: SLOTS buckets of TICK seconds each, indexed by deadline. Filing,
+moving and cancelling a game are dict operations, and every tick the reaper
+looks at a single bucket, so expiring a game is O(1) amortized. A game
+is in at most one bucket, which keeps the wheel's size bounded by the live
+games however often they are touched; deadlines further away than a full
+turn of the wheel stay in their bucket until the wheel comes round again.
+
+A game due in the wheel is loaded and its deadline worked out again before
+it is ended, since another worker may have moved it on since.
+"""
+import math
+from typing import Optional
+
+import protocol
+from game import Game, PLAYERS
+
+TICK = 1.0
+SLOTS = 1024
+
+
+class TimerWheel:
+    def __init__(self, tick: float = TICK, slots: int = SLOTS):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]  # key -> deadline
+        self.slot_of = {}                        # key -> index of its slot
+        self.current = None                      # next tick to expire
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def schedule(self, key, deadline: float):
+        """File key under deadline, moving it if it was already filed"""
+        tick = math.ceil(deadline / self.tick)
+        if self.current is not None:
+            tick = max(tick, self.current)
+        index = tick % len(self.slots)
+        previous = self.slot_of.get(key)
+        if previous is not None and previous != index:
+            del self.slots[previous][key]
+        self.slots[index][key] = deadline
+        self.slot_of[key] = index
+
+    def cancel(self, key):
+        index = self.slot_of.pop(key, None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def advance(self, now: float) -> list:
+        """Remove and return the keys whose deadline is not after now"""
+        last = math.floor(now / self.tick)
+        first = last if self.current is None else self.current
+        expired = []
+        # After a long stall every slot is due; visit each one once
+        for tick in range(max(first, last - len(self.slots) + 1), last + 1):
+            slot = self.slots[tick % len(self.slots)]
+            due = [key for key, deadline in slot.items() if deadline <= now]
+            for key in due:
+                del slot[key]
+                del self.slot_of[key]
+            expired.extend(due)
+        self.current = last + 1
+        return expired
+
+
+def deadline(game: Game) -> Optional[float]:
+    """When the game times out as things stand, or None if it never does"""
+    deadlines = []
+    if protocol.IDLE_TIMEOUT > 0:
+        deadlines.append(game.last_event + protocol.IDLE_TIMEOUT)
+    if game.placement_phase and game.players == 2 and protocol.PLACEMENT_TIMEOUT > 0:
+        deadlines.append(game.placement_started + protocol.PLACEMENT_TIMEOUT)
+    if not game.placement_phase and not game.is_over() and protocol.TURN_TIMEOUT > 0:
+        deadlines.append(game.last_event + protocol.TURN_TIMEOUT)
+    return min(deadlines, default=None)
+
+
+def culprit(game: Game, now: float):
+    """(player_id, reason) for a game past its deadline; player_id is None if nobody sat down"""
+    if protocol.TURN_TIMEOUT > 0 and not game.placement_phase and not game.is_over() and \
+            now >= game.last_event + protocol.TURN_TIMEOUT:
+        return game.current_player, "turn"
+    seated = [player_id for player_id in PLAYERS if player_id in game.protocols]
+    if protocol.PLACEMENT_TIMEOUT > 0 and game.placement_phase and game.players == 2 and \
+            now >= game.placement_started + protocol.PLACEMENT_TIMEOUT:
+        return min(seated, key=lambda player_id: game.boards[player_id].planes), "placement"
+    return (seated[0] if seated else None), "idle"
@@ -0,0 +1,202 @@
+"""Minimal Redis protocol (RESP2) codec and a local stand-in server.
+
+The stand-in implements just the commands the Redis game store uses, so
+several uvicorn workers can share games on one machine without installing
+Redis:
+
+    python resp.py --port 6380
+    AVIOANE_STORE=redis://localhost:6380 uvicorn webServer:app --workers 4
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict, deque
+
+
+# Lua scripts the game store runs; the stand-in recognises each and runs
+# its Python equivalent
+RELEASE_LOCK = ("if redis.call('get', KEYS[1]) == ARGV[1] then "
+                "return redis.call('del', KEYS[1]) else return 0 end")
+
+
+class RespError(Exception):
+    pass
+
+
+def encode_command(*args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """Read one RESP value; bulk strings come back as bytes"""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body.decode()
+    if prefix == b"-":
+        raise RespError(body.decode())
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if prefix == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RespError(f"Unexpected reply {line!r}")
+
+
+def _simple(value: str) -> bytes:
+    return b"+%s\r\n" % value.encode()
+
+
+def _error(value: str) -> bytes:
+    return b"-%s\r\n" % value.encode()
+
+
+def _integer(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+
+def _bulk(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _array(values) -> bytes:
+    return b"*%d\r\n" % len(values) + b"".join(values)
+
+
+class StandInServer:
+    """In-process Redis stand-in: strings with expiry, lists, pub/sub and known scripts"""
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+        self.lists = defaultdict(deque)
+        self.subscribers = defaultdict(set)
+
+    def _get(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+        return self.values.get(key)
+
+    def _delete(self, key) -> int:
+        self.expires.pop(key, None)
+        found = self._get(key) is not None or key in self.lists
+        self.values.pop(key, None)
+        self.lists.pop(key, None)
+        return int(found)
+
+    def execute(self, command, args, writer) -> bytes:
+        if command == b"PING":
+            return _simple("PONG")
+        if command == b"GET":
+            return _bulk(self._get(args[0]))
+        if command == b"GETDEL":
+            value = self._get(args[0])
+            self._delete(args[0])
+            return _bulk(value)
+        if command == b"SET":
+            key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+            if b"NX" in options and self._get(key) is not None:
+                return _bulk(None)
+            self.values[key] = value
+            self.expires.pop(key, None)
+            if b"PX" in options:
+                ttl = int(options[options.index(b"PX") + 1])
+                self.expires[key] = time.monotonic() + ttl / 1000
+            return _simple("OK")
+        if command == b"EVAL":
+            script, keys = args[0], args[2:2 + int(args[1])]
+            argv = args[2 + int(args[1]):]
+            if script == RELEASE_LOCK.encode():
+                return _integer(self._delete(keys[0]) if self._get(keys[0]) == argv[0] else 0)
+            return _error("ERR the stand-in only runs the scripts in resp.py")
+        if command == b"DEL":
+            return _integer(sum(self._delete(key) for key in args))
+        if command in (b"INCR", b"DECR"):
+            value = int(self._get(args[0]) or 0) + (1 if command == b"INCR" else -1)
+            self.values[args[0]] = str(value).encode()
+            return _integer(value)
+        if command == b"RPUSH":
+            self.lists[args[0]].extend(args[1:])
+            return _integer(len(self.lists[args[0]]))
+        if command == b"LLEN":
+            return _integer(len(self.lists.get(args[0], ())))
+        if command == b"LPOP":
+            items = self.lists.get(args[0])
+            if not items:
+                return _bulk(None)
+            value = items.popleft()
+            if not items:
+                del self.lists[args[0]]
+            return _bulk(value)
+        if command == b"PUBLISH":
+            receivers = self.subscribers.get(args[0], ())
+            message = _array([_bulk(b"message"), _bulk(args[0]), _bulk(args[1])])
+            for receiver in receivers:
+                receiver.write(message)
+            return _integer(len(receivers))
+        if command in (b"SUBSCRIBE", b"UNSUBSCRIBE"):
+            replies = []
+            for channel in args:
+                if command == b"SUBSCRIBE":
+                    self.subscribers[channel].add(writer)
+                else:
+                    self.subscribers[channel].discard(writer)
+                    if not self.subscribers[channel]:
+                        del self.subscribers[channel]
+                replies.append(_array([_bulk(command.lower()), _bulk(channel), _integer(1)]))
+            return b"".join(replies)
+        return _error(f"ERR unknown command '{command.decode(errors='replace')}'")
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_reply(reader)
+                if not isinstance(request, list) or not request:
+                    writer.write(_error("ERR protocol error"))
+                    continue
+                writer.write(self.execute(request[0].upper(), request[1:], writer))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in list(self.subscribers):
+                self.subscribers[channel].discard(writer)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+            writer.close()
+
+
+async def serve(host: str, port: int):
+    server = await asyncio.start_server(StandInServer().handle, host, port)
+    print(f"Redis stand-in listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
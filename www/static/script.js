@@ -3,13 +3,27 @@ let currentOrientation = 'up';
 let placementPhase = true;
 let myTurn = false;
 let planesPlaced = 0;
-const maxAirplanes = 3;
-let myGrid = Array(10).fill().map(() => Array(10).fill().map(() => WHITE));
-let myShots = Array(10).fill().map(() => Array(10).fill(false));
-let flags = Array(10).fill().map(() => Array(10).fill(false));
+// ?size=<cells a side>&planes=<planes per fleet> asks for another board;
+// the server's init says which one the game is played on
+const pageParams = new URLSearchParams(window.location.search);
+let boardSize = 10;
+let maxAirplanes = 3;
+let myGrid = emptyBoard(WHITE);
+let myShots = emptyBoard(false);
+let flags = emptyBoard(false);
 let headPositions = [];
 let ws;
-let opponentShots = new Set();
+let playerId = null;
+let lastSeq = 0;
+let resumeToken = null;
+let reconnectDelay = 250;
+let opponentAway = false;
+// ?spectate=<game id> watches a game from player 1's side without playing
+let spectating = new URLSearchParams(window.location.search).get('spectate');
+let opponentPlanes = 0;
+let headsHit = 0;
+let opponentHeadsHit = 0;
+let opponentShots = [];
 let shotResults = {};
 let gameStats = {
     startTime: Date.now(),
@@ -34,23 +48,79 @@ styleSheet.textContent = previewStyles;
 document.head.appendChild(styleSheet);
 
 
+function emptyBoard(value) {
+    return Array(boardSize).fill().map(() => Array(boardSize).fill(value));
+}
+
+function columnLabel(col) {
+    // A..Z, then AA, AB, ... like a spreadsheet
+    let label = '';
+    for (let n = col + 1; n > 0; n = Math.floor((n - 1) / 26)) {
+        label = String.fromCharCode(65 + (n - 1) % 26) + label;
+    }
+    return label;
+}
+
+function setBoard(size, planes) {
+    // Rebuild both grids if the game is not on the board they were built for
+    maxAirplanes = planes;
+    if (size === boardSize && document.getElementById('my-grid').children.length) return;
+    boardSize = size;
+    myGrid = emptyBoard(WHITE);
+    myShots = emptyBoard(false);
+    flags = emptyBoard(false);
+    const root = document.documentElement.style;
+    root.setProperty('--board-size', size);
+    root.setProperty('--cell-size', `${Math.max(8, Math.min(40, Math.floor(440 / size)))}px`);
+    document.querySelectorAll('.coordinate-labels').forEach(labels => {
+        labels.innerHTML = Array.from({ length: size }, (_, col) => `<div>${columnLabel(col)}</div>`).join('');
+    });
+    document.querySelectorAll('.coordinate-numbers').forEach(numbers => {
+        numbers.innerHTML = Array.from({ length: size }, (_, row) => `<div>${row + 1}</div>`).join('');
+    });
+    createGrid('my-grid');
+    createGrid('opponent-grid', true);
+}
+
 function initializeWebSocket() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    ws = new WebSocket(`${protocol}//${window.location.host}/ws`);
+    // Players opening the page with ?room=<code> are paired with each other
+    const room = new URLSearchParams(window.location.search).get('room');
+    const roomParam = room ? `&room=${encodeURIComponent(room)}` : '';
+    // ?opponent=bot skips the queue and plays the computer
+    const botParam = new URLSearchParams(window.location.search).get('opponent') === 'bot' ? '&opponent=bot' : '';
+    const modeParam = ['size', 'planes']
+        .filter(name => pageParams.has(name))
+        .map(name => `&${name}=${encodeURIComponent(pageParams.get(name))}`).join('');
+    // After a dropped connection, take our seat back and fetch only what we missed
+    let params = resumeToken
+        ? `&resume=${encodeURIComponent(resumeToken)}&seq=${lastSeq}`
+        : `${roomParam}${botParam}${modeParam}`;
+    if (spectating) {
+        params = `&spectate=${encodeURIComponent(spectating)}`;
+    }
+    // Same JSON either way; the server encodes faster with orjson when it has it
+    ws = new WebSocket(`${protocol}//${window.location.host}/ws?protocol=2${params}`,
+                       ['avioane.orjson', 'avioane.json']);
     
     ws.onopen = () => {
         console.log('WebSocket Connected');
-        document.getElementById('status').textContent = 'Connected! Waiting for opponent...';
+        reconnectDelay = 250;
+        if (!resumeToken) {
+            document.getElementById('status').textContent = 'Connected! Waiting for opponent...';
+        }
     };
     
     ws.onclose = () => {
         console.log('WebSocket Disconnected');
-        document.getElementById('status').textContent = 'Disconnected from server';
-        // Try to reconnect after 3 seconds
+        if (spectating === false) return;  // the watched game is over
+        document.getElementById('status').textContent = 'Connection lost, reconnecting...';
+        // Retry quickly at first, backing off to once every 5 seconds
         setTimeout(() => {
             console.log('Attempting to reconnect...');
             initializeWebSocket();
-        }, 3000);
+        }, reconnectDelay);
+        reconnectDelay = Math.min(reconnectDelay * 2, 5000);
     };
     
     ws.onerror = (error) => {
@@ -76,8 +146,8 @@ function showAirplanePreview(row, col) {
     const myGridElement = document.getElementById('my-grid');
     
     airplane.forEach(([previewRow, previewCol]) => {
-        if (previewRow >= 0 && previewRow < 10 && previewCol >= 0 && previewCol < 10) {
-            const cell = myGridElement.children[previewRow * 10 + previewCol];
+        if (previewRow >= 0 && previewRow < boardSize && previewCol >= 0 && previewCol < boardSize) {
+            const cell = myGridElement.children[previewRow * boardSize + previewCol];
             const preview = document.createElement('div');
             preview.className = 'preview-cell';
             if (!isValid) {
@@ -97,8 +167,8 @@ function createGrid(elementId, isOpponentGrid = false) {
     const grid = document.getElementById(elementId);
     grid.innerHTML = '';
     
-    for (let row = 0; row < 10; row++) {
-        for (let col = 0; col < 10; col++) {
+    for (let row = 0; row < boardSize; row++) {
+        for (let col = 0; col < boardSize; col++) {
             const cell = document.createElement('div');
             cell.className = 'cell';
             cell.dataset.row = row;
@@ -124,9 +194,9 @@ function createGrid(elementId, isOpponentGrid = false) {
 
 function updateGridDisplay() {
     const myGridElement = document.getElementById('my-grid');
-    for (let row = 0; row < 10; row++) {
-        for (let col = 0; col < 10; col++) {
-            const cell = myGridElement.children[row * 10 + col];
+    for (let row = 0; row < boardSize; row++) {
+        for (let col = 0; col < boardSize; col++) {
+            const cell = myGridElement.children[row * boardSize + col];
             const color = myGrid[row][col];
             cell.style.backgroundColor = `rgb(${color[0]}, ${color[1]}, ${color[2]})`;
         }
@@ -142,12 +212,13 @@ function handleMyGridClick(row, col) {
         planesPlaced++;
         headPositions.push([row, col]);
         updateGridDisplay();
-        sendGameState();
+        sendMessage({ type: 'place', head: [row, col], cells: airplane });
     }
     clearAirplanePreview();
 }
 
 function handleOpponentGridClick(row, col) {
+    if (spectating) return;
     if (placementPhase || !myTurn || myShots[row][col]) {
         console.log("Cannot shoot now:", {
             placementPhase,
@@ -161,22 +232,22 @@ function handleOpponentGridClick(row, col) {
     myShots[row][col] = true;
     flags[row][col] = false;
     updateShotDisplay();
-    sendGameState();
+    sendMessage({ type: 'fire', row, col });
     myTurn = false;
     document.getElementById('status').textContent = "Opponent's turn...";
 }
 
 function handleFlag(row, col) {
-    if (placementPhase || myShots[row][col]) return;
+    if (spectating || placementPhase || myShots[row][col]) return;
     flags[row][col] = !flags[row][col];
     updateShotDisplay();
 }
 
 function updateShotDisplay() {
     const opponentGrid = document.getElementById('opponent-grid');
-    for (let row = 0; row < 10; row++) {
-        for (let col = 0; col < 10; col++) {
-            const cell = opponentGrid.children[row * 10 + col];
+    for (let row = 0; row < boardSize; row++) {
+        for (let col = 0; col < boardSize; col++) {
+            const cell = opponentGrid.children[row * boardSize + col];
             // Remove existing markers
             cell.innerHTML = '';
             
@@ -221,7 +292,7 @@ function createAirplane(x, y, orientation) {
 
 function canPlaceAirplane(positions) {
     return positions.every(([row, col]) => {
-        return row >= 0 && row < 10 && col >= 0 && col < 10 &&
+        return row >= 0 && row < boardSize && col >= 0 && col < boardSize &&
                JSON.stringify(myGrid[row][col]) === JSON.stringify(WHITE);
     });
 }
@@ -237,20 +308,16 @@ function placeAirplane(positions) {
     });
 }
 
-function sendGameState() {
-    if (ws.readyState === WebSocket.OPEN) {
-        ws.send(JSON.stringify({
-            grid: myGrid,
-            shots: myShots,
-            head_positions: headPositions
-        }));
+function sendMessage(message) {
+    if (ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify(message));
     }
 }
 
 function updateOpponentShots(opponentShots) {
     const myGridElement = document.getElementById('my-grid');
     opponentShots.forEach(([row, col]) => {
-        const cell = myGridElement.children[row * 10 + col];
+        const cell = myGridElement.children[row * boardSize + col];
         // Clear existing markers
         cell.innerHTML = '';
         const marker = document.createElement('div');
@@ -266,56 +333,156 @@ function updateOpponentShots(opponentShots) {
     });
 }
 
-function handleServerMessage(data) {
-    if (data.type === 'init') {
-        document.getElementById('status').textContent = 'Waiting for opponent...';
-    } else if (data.type === 'update' || data.type === 'opponent_update') {
-        placementPhase = data.placement_phase;
-        myTurn = data.your_turn;
-        
-        // Store shot results and track hits
-        if (data.shot_results) {
-            Object.entries(data.shot_results).forEach(([key, result]) => {
-                if (!shotResults[key] && (result === 'hit' || result === 'head')) {
-                    gameStats.hits++;
-                }
-            });
-            shotResults = { ...shotResults, ...data.shot_results };
+function applyEvent(event) {
+    if (event.op === 'place') {
+        if (event.player !== playerId) {
+            opponentPlanes = event.planes;
         }
-
-        // Update status message
-        let status = '';
-        if (placementPhase) {
-            const myPlanes = data.placement_status?.your_planes || planesPlaced;
-            const opponentPlanes = data.placement_status?.opponent_planes || 0;
-            
-            if (myPlanes < maxAirplanes) {
-                status = `Place your planes: ${myPlanes}/${maxAirplanes}`;
-            } else if (opponentPlanes < maxAirplanes) {
-                status = 'Waiting for opponent to finish placing planes...';
-            } else {
-                status = 'Game starting...';
+    } else if (event.op === 'start') {
+        placementPhase = false;
+        myTurn = event.current_player === playerId;
+    } else if (event.op === 'fire') {
+        if (event.player === playerId) {
+            shotResults[`${event.row},${event.col}`] = event.result;
+            if (event.result === 'hit' || event.result === 'head') {
+                gameStats.hits++;
+            }
+            if (event.result === 'head') {
+                headsHit++;
             }
         } else {
-            if (data.heads_hit >= 3 || data.opponent_heads_hit >= 3) {
-                const isWinner = data.heads_hit >= 3;
-                showVictoryScreen(isWinner);
-                status = isWinner ? 'You win!' : 'Opponent wins!';
-            } else {
-                status = myTurn ? 'Your turn!' : "Opponent's turn...";
+            opponentShots.push([event.row, event.col]);
+            if (event.result === 'head') {
+                opponentHeadsHit++;
             }
         }
-        document.getElementById('status').textContent = status;
+        myTurn = event.next === playerId;
+    } else if (event.op === 'away' || event.op === 'back') {
+        if (event.player !== playerId) {
+            opponentAway = event.op === 'away';
+        }
+    }
+}
+
+function updateStatus() {
+    let status = '';
+    if (spectating) {
+        updateSpectatorStatus();
+        return;
+    }
+    if (opponentAway) {
+        status = 'Opponent lost their connection, waiting for them to come back...';
+    } else if (placementPhase) {
+        if (planesPlaced < maxAirplanes) {
+            status = `Place your planes: ${planesPlaced}/${maxAirplanes}`;
+        } else if (opponentPlanes < maxAirplanes) {
+            status = 'Waiting for opponent to finish placing planes...';
+        } else {
+            status = 'Game starting...';
+        }
+    } else {
+        if (headsHit >= maxAirplanes || opponentHeadsHit >= maxAirplanes) {
+            const isWinner = headsHit >= maxAirplanes;
+            showVictoryScreen(isWinner);
+            status = isWinner ? 'You win!' : 'Opponent wins!';
+        } else {
+            status = myTurn ? 'Your turn!' : "Opponent's turn...";
+        }
+    }
+    document.getElementById('status').textContent = status;
+
+    // Update score
+    document.getElementById('score').textContent =
+        `Heads Hit - You: ${headsHit} Opponent: ${opponentHeadsHit}`;
+}
+
+function updateSpectatorStatus() {
+    let status;
+    if (placementPhase) {
+        status = `Players are placing their planes (player 2: ${opponentPlanes}/${maxAirplanes})`;
+    } else if (headsHit >= maxAirplanes || opponentHeadsHit >= maxAirplanes) {
+        status = `Player ${headsHit >= maxAirplanes ? 1 : 2} wins!`;
+    } else {
+        status = `Player ${myTurn ? 1 : 2} to fire`;
+    }
+    document.getElementById('status').textContent = `Watching game ${spectating}: ${status}`;
+    document.getElementById('score').textContent =
+        `Heads Hit - Player 1: ${headsHit} Player 2: ${opponentHeadsHit}`;
+}
 
-        // Update score
-        document.getElementById('score').textContent = 
-            `Heads Hit - You: ${data.heads_hit || 0} Opponent: ${data.opponent_heads_hit || 0}`;
+function handleServerMessage(data) {
+    if (data.type === 'ping') {
+        // The server disconnects players that stop answering
+        sendMessage({ type: 'pong' });
+    } else if (data.type === 'init' && data.spectator) {
+        // Watch from player 1's side: their shots on the right, player 2's on the left
+        setBoard(data.size, data.planes);
+        playerId = '1';
+        planesPlaced = maxAirplanes;
+        updateStatus();
+    } else if (data.type === 'init') {
+        setBoard(data.size, data.planes);
+        playerId = data.player_id;
+        resumeToken = data.resume_token;
+        if (data.resumed) {
+            updateStatus();
+            return;
+        }
+        lastSeq = 0;
+        document.getElementById('status').textContent = 'Waiting for opponent...';
+    } else if (data.type === 'state_delta') {
+        let opponentLeft = false;
+        let leftMessage = 'Opponent disconnected. Please refresh to start a new game.';
+        data.events.forEach(event => {
+            if (event.seq <= lastSeq) return;
+            lastSeq = event.seq;
+            if (event.op === 'leave') {
+                opponentLeft = true;
+                if (event.reason === 'timeout') {
+                    leftMessage = event.player === playerId
+                        ? 'You ran out of time. Please refresh to start a new game.'
+                        : 'Opponent ran out of time. Please refresh to start a new game.';
+                }
+            } else {
+                applyEvent(event);
+            }
+        });
+        if (!spectating) {
+            sendMessage({ type: 'ack', seq: lastSeq });
+        }
 
-        // Update shot displays
-        if (data.opponent_shots) {
-            updateOpponentShots(data.opponent_shots);
+        if (opponentLeft && spectating) {
+            updateOpponentShots(opponentShots);
+            updateShotDisplay();
+            updateStatus();
+            if (headsHit < maxAirplanes && opponentHeadsHit < maxAirplanes) {
+                document.getElementById('status').textContent = 'A player left, the game is over.';
+            }
+            spectating = false;
+            return;
+        }
+        if (opponentLeft) {
+            myTurn = false;
+            resumeToken = null;
+            document.getElementById('status').textContent = leftMessage;
+            return;
         }
+        updateStatus();
+        updateOpponentShots(opponentShots);
         updateShotDisplay();
+    } else if (data.type === 'error' && spectating) {
+        spectating = false;
+        document.getElementById('status').textContent = 'This game is not being played any more.';
+    } else if (data.type === 'error' && data.code === 'invalid_mode') {
+        // Asking again would get the same answer
+        ws.onclose = null;
+        document.getElementById('status').textContent = data.message;
+    } else if (data.type === 'error' && data.code === 'resume_failed') {
+        // The game ended while we were away; start over in a new one
+        resumeToken = null;
+        restartGame();
+    } else if (data.type === 'error') {
+        console.warn('Server rejected message:', data.message);
     }
 }
 
@@ -477,11 +644,19 @@ function restartGame() {
     placementPhase = true;
     myTurn = false;
     planesPlaced = 0;
-    myGrid = Array(10).fill().map(() => Array(10).fill().map(() => WHITE));
-    myShots = Array(10).fill().map(() => Array(10).fill(false));
-    flags = Array(10).fill().map(() => Array(10).fill(false));
+    myGrid = emptyBoard(WHITE);
+    myShots = emptyBoard(false);
+    flags = emptyBoard(false);
     headPositions = [];
-    opponentShots = new Set();
+    playerId = null;
+    lastSeq = 0;
+    resumeToken = null;
+    reconnectDelay = 250;
+    opponentAway = false;
+    opponentPlanes = 0;
+    headsHit = 0;
+    opponentHeadsHit = 0;
+    opponentShots = [];
     shotResults = {};
 
     // Reset game statistics
@@ -0,0 +1,542 @@
+"""Game state storage for the /ws endpoint.
+
+A store keeps games, the matchmaking seats and a per-game pub/sub channel.
+The backend is picked with AVIOANE_STORE:
+
+    memory (default)         one process; games stay Game objects in a dict
+    sqlite:///games.db       workers on one machine share a SQLite file
+                             (sqlite:////abs/path.db for an absolute path)
+    redis://host:port        workers anywhere share a Redis (or resp.py) server
+
+Workers only keep their own sockets. A worker that applies a move saves the
+game and publishes the new events on the game's channel, and whichever worker
+holds the opponent's socket pushes them on.
+
+Seats are offered per board size and plane count (a mode), in the queues and
+scoped room codes of matchmaking.py.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import urlparse
+
+import logs
+import protocol
+from game import Game
+from matchmaking import Matchmaker, queue_name, room_key
+from resp import RELEASE_LOCK, encode_command, read_reply
+
+LOCK_TIMEOUT = 5.0   # seconds a crashed worker can hold a game's lock
+LOCK_RETRY = 0.002
+POLL_INTERVAL = 0.01
+MESSAGE_TTL = 30.0   # seconds published messages are kept in SQLite
+RECONNECT_DELAY = 0.1   # first wait before reconnecting to Redis, doubled per failure
+RECONNECT_MAX_DELAY = 5.0
+
+
+class Subscription:
+    """Messages published on one game's channel, in order"""
+
+    def __init__(self, store, game_id: str):
+        self.store = store
+        self.game_id = game_id
+        self.queue = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        return await self.queue.get()
+
+    async def close(self):
+        await self.store._unsubscribe(self)
+
+
+class GameStore:
+    """Base class; backends override the storage and transport methods"""
+
+    def __init__(self):
+        self.channels = defaultdict(set)  # game_id -> local subscriptions
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def load(self, game_id: str) -> Optional[Game]:
+        raise NotImplementedError
+
+    async def save(self, game: Game):
+        raise NotImplementedError
+
+    async def delete(self, game_id: str):
+        """Remove a game and withdraw its open seat"""
+        raise NotImplementedError
+
+    def lock(self, game_id: str):
+        """Async context manager serialising changes to one game"""
+        raise NotImplementedError
+
+    async def take_seat(self, room: Optional[str] = None,
+                        mode: tuple = protocol.DEFAULT_MODE) -> Optional[str]:
+        """Pop the mode's oldest open game (or the room's game), or None if there is none"""
+        raise NotImplementedError
+
+    async def open_seat(self, room: Optional[str] = None,
+                        mode: tuple = protocol.DEFAULT_MODE) -> Optional[Game]:
+        """Create a game of the mode waiting for an opponent, or None if the room was taken meanwhile"""
+        raise NotImplementedError
+
+    async def claim_seat(self, game_id: str) -> bool:
+        """Withdraw a public game's open seat for the bot; False if a player took it"""
+        raise NotImplementedError
+
+    async def queue_depth(self) -> int:
+        """Games waiting for a second player, public or in a room"""
+        raise NotImplementedError
+
+    async def publish(self, game_id: str, message: dict):
+        raise NotImplementedError
+
+    async def subscribe(self, game_id: str) -> Subscription:
+        subscription = Subscription(self, game_id)
+        first = not self.channels[game_id]
+        self.channels[game_id].add(subscription)
+        if first:
+            await self._listen(game_id)
+        return subscription
+
+    async def _unsubscribe(self, subscription: Subscription):
+        subscriptions = self.channels.get(subscription.game_id)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self.channels[subscription.game_id]
+            await self._unlisten(subscription.game_id)
+
+    async def _listen(self, game_id: str):
+        pass
+
+    async def _unlisten(self, game_id: str):
+        pass
+
+    def _dispatch(self, game_id: str, message: dict):
+        for subscription in self.channels.get(game_id, ()):
+            subscription.queue.put_nowait(message)
+
+
+class MemoryStore(GameStore):
+    """Single-process store; load returns the live Game, so save is free"""
+
+    def __init__(self):
+        super().__init__()
+        self.games = {}
+        self.matchmaker = Matchmaker()
+
+    async def load(self, game_id):
+        return self.games.get(game_id)
+
+    async def save(self, game):
+        self.games[game.game_id] = game
+
+    async def delete(self, game_id):
+        self.games.pop(game_id, None)
+        self.matchmaker.discard(game_id)
+
+    def lock(self, game_id):
+        game = self.games.get(game_id)
+        return game.lock if game is not None else asyncio.Lock()
+
+    async def take_seat(self, room=None, mode=protocol.DEFAULT_MODE):
+        return self.matchmaker.take(room, queue_name(mode))
+
+    async def open_seat(self, room=None, mode=protocol.DEFAULT_MODE):
+        game = Game(self.matchmaker.open(room, queue_name(mode)), *mode)
+        self.games[game.game_id] = game
+        return game
+
+    async def claim_seat(self, game_id):
+        return self.matchmaker.discard(game_id)
+
+    async def queue_depth(self):
+        return self.matchmaker.queue_depth
+
+    async def publish(self, game_id, message):
+        self._dispatch(game_id, message)
+
+
+class SQLiteStore(GameStore):
+    """Workers on one machine sharing a SQLite file; pub/sub is a polled table"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS games (id TEXT PRIMARY KEY, state TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS seats (pos INTEGER PRIMARY KEY AUTOINCREMENT, game_id TEXT NOT NULL,
+                                          queue TEXT NOT NULL DEFAULT '');
+        CREATE INDEX IF NOT EXISTS seats_game ON seats (game_id);
+        CREATE TABLE IF NOT EXISTS rooms (code TEXT PRIMARY KEY, game_id TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS rooms_game ON rooms (game_id);
+        CREATE TABLE IF NOT EXISTS locks (game_id TEXT PRIMARY KEY, token TEXT NOT NULL, expires REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS ids (id INTEGER PRIMARY KEY AUTOINCREMENT);
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL,
+            payload TEXT NOT NULL, created REAL NOT NULL);
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.poller = None
+        self.last_message = 0
+
+    async def start(self):
+        self.db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(self.SCHEMA)
+        # Files made before seats had a queue get one; their seats are default games
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(seats)")]
+        if "queue" not in columns:
+            try:
+                self.db.execute("ALTER TABLE seats ADD COLUMN queue TEXT NOT NULL DEFAULT ''")
+            except sqlite3.OperationalError:
+                pass  # another worker added it first
+        self.db.execute("CREATE INDEX IF NOT EXISTS seats_queue ON seats (queue, pos)")
+        self.last_message = self.db.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+    async def close(self):
+        if self.poller:
+            self.poller.cancel()
+        if self.db:
+            self.db.close()
+
+    def _transaction(self, work):
+        """Run work(db) inside BEGIN IMMEDIATE, so it is atomic across processes"""
+        with self.db_lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(self.db)
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+            return result
+
+    async def _run(self, work):
+        return await asyncio.to_thread(self._transaction, work)
+
+    async def load(self, game_id):
+        row = await self._run(lambda db: db.execute(
+            "SELECT state FROM games WHERE id = ?", (game_id,)).fetchone())
+        return Game.from_dict(json.loads(row[0])) if row else None
+
+    async def save(self, game):
+        state = json.dumps(game.to_dict())
+        await self._run(lambda db: db.execute(
+            "INSERT OR REPLACE INTO games (id, state) VALUES (?, ?)", (game.game_id, state)))
+
+    async def delete(self, game_id):
+        def work(db):
+            db.execute("DELETE FROM games WHERE id = ?", (game_id,))
+            db.execute("DELETE FROM seats WHERE game_id = ?", (game_id,))
+            db.execute("DELETE FROM rooms WHERE game_id = ?", (game_id,))
+        await self._run(work)
+
+    @asynccontextmanager
+    async def lock(self, game_id):
+        token = uuid.uuid4().hex
+
+        def acquire(db):
+            now = time.time()
+            row = db.execute("SELECT expires FROM locks WHERE game_id = ?", (game_id,)).fetchone()
+            if row and row[0] > now:
+                return False
+            db.execute("INSERT OR REPLACE INTO locks (game_id, token, expires) VALUES (?, ?, ?)",
+                       (game_id, token, now + LOCK_TIMEOUT))
+            return True
+
+        while not await self._run(acquire):
+            await asyncio.sleep(LOCK_RETRY)
+        try:
+            yield
+        finally:
+            await self._run(lambda db: db.execute(
+                "DELETE FROM locks WHERE game_id = ? AND token = ?", (game_id, token)))
+
+    async def take_seat(self, room=None, mode=protocol.DEFAULT_MODE):
+        queue = queue_name(mode)
+
+        def work(db):
+            if room is not None:
+                code = room_key(room, queue)
+                row = db.execute("SELECT game_id FROM rooms WHERE code = ?", (code,)).fetchone()
+                if row:
+                    db.execute("DELETE FROM rooms WHERE code = ?", (code,))
+                return row[0] if row else None
+            row = db.execute("SELECT pos, game_id FROM seats WHERE queue = ? ORDER BY pos LIMIT 1",
+                             (queue,)).fetchone()
+            if row is None:
+                return None
+            db.execute("DELETE FROM seats WHERE pos = ?", (row[0],))
+            return row[1]
+        return await self._run(work)
+
+    async def open_seat(self, room=None, mode=protocol.DEFAULT_MODE):
+        queue = queue_name(mode)
+
+        def work(db):
+            row_id = db.execute("INSERT INTO ids DEFAULT VALUES").lastrowid
+            db.execute("DELETE FROM ids WHERE id < ?", (row_id,))
+            game_id = str(row_id - 1)
+            if room is not None:
+                inserted = db.execute("INSERT OR IGNORE INTO rooms (code, game_id) VALUES (?, ?)",
+                                      (room_key(room, queue), game_id)).rowcount
+                if not inserted:
+                    return None
+            game = Game(game_id, *mode)
+            db.execute("INSERT INTO games (id, state) VALUES (?, ?)",
+                       (game_id, json.dumps(game.to_dict())))
+            if room is None:
+                db.execute("INSERT INTO seats (game_id, queue) VALUES (?, ?)", (game_id, queue))
+            return game
+        return await self._run(work)
+
+    async def claim_seat(self, game_id):
+        return await self._run(lambda db: db.execute(
+            "DELETE FROM seats WHERE game_id = ?", (game_id,)).rowcount > 0)
+
+    async def queue_depth(self):
+        return await self._run(lambda db: db.execute(
+            "SELECT (SELECT COUNT(*) FROM seats) + (SELECT COUNT(*) FROM rooms)").fetchone()[0])
+
+    async def publish(self, game_id, message):
+        payload = json.dumps(message)
+        await self._run(lambda db: db.execute(
+            "INSERT INTO messages (channel, payload, created) VALUES (?, ?, ?)",
+            (game_id, payload, time.time())))
+
+    async def _listen(self, game_id):
+        if self.poller is None:
+            self.poller = asyncio.create_task(self._poll())
+
+    async def _poll(self):
+        last_prune = time.time()
+        while True:
+            rows = await self._run(lambda db: db.execute(
+                "SELECT id, channel, payload FROM messages WHERE id > ? ORDER BY id",
+                (self.last_message,)).fetchall())
+            for message_id, channel, payload in rows:
+                self.last_message = message_id
+                if channel in self.channels:
+                    self._dispatch(channel, json.loads(payload))
+            if time.time() - last_prune > MESSAGE_TTL:
+                last_prune = time.time()
+                await self._run(lambda db: db.execute(
+                    "DELETE FROM messages WHERE created < ?", (last_prune - MESSAGE_TTL,)))
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+class RedisStore(GameStore):
+    """Workers sharing a Redis-protocol server (Redis itself or resp.py)"""
+
+    POOL_SIZE = 8
+    CLAIM_TTL = 60000  # ms a deleted game's claim is kept, for its seat popped meanwhile
+
+    def __init__(self, host: str, port: int):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.pool = asyncio.Queue()
+        self.connections = []
+        self.pubsub_writer = None
+        self.pubsub_reader = None
+        self.reconnects = set()  # tasks opening pool connections in place of dropped ones
+
+    async def start(self):
+        for _ in range(self.POOL_SIZE):
+            connection = await asyncio.open_connection(self.host, self.port)
+            self.connections.append(connection)
+            self.pool.put_nowait(connection)
+        reader, self.pubsub_writer = await asyncio.open_connection(self.host, self.port)
+        self.pubsub_reader = asyncio.create_task(self._read_messages(reader))
+
+    async def close(self):
+        if self.pubsub_reader:
+            self.pubsub_reader.cancel()
+            self.pubsub_writer.close()
+        for task in self.reconnects:
+            task.cancel()
+        for _, writer in self.connections:
+            writer.close()
+
+    async def execute(self, *args):
+        reader, writer = connection = await self.pool.get()
+        try:
+            writer.write(encode_command(*args))
+            await writer.drain()
+            reply = await read_reply(reader)
+        except BaseException:
+            # Cancelled or failed mid-command, the connection may still have
+            # (part of) a reply on its way that the next caller would read
+            # as theirs; it is dropped and a fresh one takes its place
+            self._drop(connection)
+            raise
+        self.pool.put_nowait(connection)
+        return reply
+
+    def _drop(self, connection):
+        connection[1].close()
+        self.connections.remove(connection)
+        task = asyncio.create_task(self._replace())
+        self.reconnects.add(task)
+        task.add_done_callback(self.reconnects.discard)
+
+    async def _replace(self):
+        connection = await self._connect("pool")
+        self.connections.append(connection)
+        self.pool.put_nowait(connection)
+
+    async def _connect(self, purpose: str):
+        """Open a connection, retrying with backoff until the server answers"""
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                return await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                logs.event(logs.CONN, logging.WARNING, "Could not reconnect to Redis",
+                           connection=purpose, error=str(e), retry_in=delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def load(self, game_id):
+        state = await self.execute("GET", f"game:{game_id}")
+        return Game.from_dict(json.loads(state)) if state else None
+
+    async def save(self, game):
+        await self.execute("SET", f"game:{game.game_id}", json.dumps(game.to_dict()))
+
+    async def delete(self, game_id):
+        # Withdraw the seat if it is still open; entries left in the seat
+        # lists and room keys are skipped when popped
+        await self.claim_seat(game_id)
+        await self.execute("DEL", f"game:{game_id}")
+        await self.execute("SET", f"claim:{game_id}", 1, "PX", self.CLAIM_TTL)
+
+    @asynccontextmanager
+    async def lock(self, game_id):
+        key, token = f"lock:{game_id}", uuid.uuid4().hex
+        timeout = int(LOCK_TIMEOUT * 1000)
+        while await self.execute("SET", key, token, "NX", "PX", timeout) is None:
+            await asyncio.sleep(LOCK_RETRY)
+        try:
+            yield
+        finally:
+            # Only if it is still ours, in one step: it may have expired and
+            # been taken by another worker
+            await self.execute("EVAL", RELEASE_LOCK, 1, key, token)
+
+    @staticmethod
+    def _seats(queue: str) -> str:
+        return f"seats:{queue}" if queue else "seats"
+
+    async def take_seat(self, room=None, mode=protocol.DEFAULT_MODE):
+        queue = queue_name(mode)
+        if room is not None:
+            game_id = await self.execute("GETDEL", f"room:{room_key(room, queue)}")
+            if game_id is None:
+                return None
+            game_id = game_id.decode()
+            return game_id if await self._claim_live(game_id) else None
+        while True:
+            game_id = await self.execute("LPOP", self._seats(queue))
+            if game_id is None:
+                return None
+            game_id = game_id.decode()
+            if await self._claim_live(game_id):
+                return game_id
+
+    async def _claim_live(self, game_id):
+        return (await self.execute("GET", f"game:{game_id}") is not None and
+                await self.claim_seat(game_id))
+
+    async def open_seat(self, room=None, mode=protocol.DEFAULT_MODE):
+        queue = queue_name(mode)
+        game = Game(str(await self.execute("INCR", "game_ids") - 1), *mode)
+        await self.save(game)
+        if room is not None:
+            if await self.execute("SET", f"room:{room_key(room, queue)}", game.game_id, "NX") is None:
+                await self.execute("DEL", f"game:{game.game_id}")
+                return None
+            await self.execute("INCR", "open_seats")
+        else:
+            await self.execute("INCR", "open_seats")
+            await self.execute("RPUSH", self._seats(queue), game.game_id)
+        return game
+
+    async def claim_seat(self, game_id):
+        # The seat stays in its list or room key; whoever sets the claim
+        # first withdraws it
+        if await self.execute("SET", f"claim:{game_id}", 1, "NX") is None:
+            return False
+        await self.execute("DECR", "open_seats")
+        return True
+
+    async def queue_depth(self):
+        return max(0, int(await self.execute("GET", "open_seats") or 0))
+
+    async def publish(self, game_id, message):
+        await self.execute("PUBLISH", f"channel:{game_id}", json.dumps(message))
+
+    async def _listen(self, game_id):
+        await self._pubsub_command("SUBSCRIBE", f"channel:{game_id}")
+
+    async def _unlisten(self, game_id):
+        await self._pubsub_command("UNSUBSCRIBE", f"channel:{game_id}")
+
+    async def _pubsub_command(self, *args):
+        # With the connection down the command is lost, but _read_messages
+        # subscribes to every channel in use once it has reconnected
+        try:
+            self.pubsub_writer.write(encode_command(*args))
+            await self.pubsub_writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _read_messages(self, reader):
+        while True:
+            try:
+                while True:
+                    reply = await read_reply(reader)
+                    if isinstance(reply, list) and reply[0] == b"message":
+                        game_id = reply[1].decode().split(":", 1)[1]
+                        self._dispatch(game_id, json.loads(reply[2]))
+            except Exception as e:
+                logs.event(logs.CONN, logging.ERROR, "Lost the Redis subscription connection",
+                           error=repr(e), channels=len(self.channels))
+            self.pubsub_writer.close()
+            reader, self.pubsub_writer = await self._connect("pubsub")
+            # Messages published while it was down are lost
+            for game_id in list(self.channels):
+                self.pubsub_writer.write(encode_command("SUBSCRIBE", f"channel:{game_id}"))
+            await self.pubsub_writer.drain()
+
+
+def open_store(url: str) -> GameStore:
+    """Build the store described by an AVIOANE_STORE value"""
+    if url in ("", "memory"):
+        return MemoryStore()
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        return SQLiteStore(parsed.path[1:] or ":memory:")
+    if parsed.scheme == "redis":
+        return RedisStore(parsed.hostname or "localhost", parsed.port or 6379)
+    raise ValueError(f"Unknown game store: {url}")
@@ -1,286 +1,819 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
 import json
-from collections import defaultdict
+import logging
+import os
 import asyncio
+import time
+from functools import partial
 from typing import Dict, Set, List, Optional
 import uvicorn
+from collections import OrderedDict
+
+import codec
+import logs
+from assets import AssetFiles
+from broadcast import Broadcast, Spectator
+from eventlog import open_event_log
+import metrics
+import protocol
+import ratelimit
+import reaper
+from game import Game, opponent_of, parse_resume_token
+from matchmaking import valid_room_code
+from outbox import Outbox
+from store import open_store
+# From desktop/, which protocol.py puts on the path
+from posterior import Analysis, TooManyArrangements
 
 app = FastAPI()
 
-# Serve static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Serve static files, fingerprinted and precompressed by assets.py
+static_files = AssetFiles()
+app.mount("/static", static_files, name="static")
+
+# Shared by every worker; see store.py for the backends
+store = open_store(os.environ.get("AVIOANE_STORE", "memory"))
+
+# Finished games are archived here for /replay; see eventlog.py
+event_log = open_event_log(os.environ.get("AVIOANE_EVENT_LOG", "eventlog"))
+
+class Connection:
+    """A player's socket on this worker and how far it has been updated"""
+    __slots__ = ("websocket", "outbox", "limiter", "game_id", "player_id", "session", "version",
+                 "cursor", "acked")
+
+    def __init__(self, websocket: WebSocket, version: int):
+        self.websocket = websocket
+        # Everything sent to the player goes through here; see outbox.py
+        self.outbox = Outbox(websocket, websocket.state.codec,
+                             heartbeat=(version == protocol.PROTOCOL_VERSION))
+        self.limiter = ratelimit.Limiter()
+        self.game_id = None
+        self.player_id = None
+        self.session = None  # which of the player's connections this is
+        self.version = version
+        self.cursor = 0  # seq of the last event pushed
+        self.acked = 0   # seq of the last event acknowledged
 
 class GameState:
+    """The sockets this worker holds, and one listener per game they play or watch"""
+
     def __init__(self):
         self.reset_all()
 
     def reset_all(self):
         """Reset all game state"""
-        self.games = {}
-        self.grids = {}
-        self.shots = defaultdict(lambda: defaultdict(list))
-        self.head_positions = defaultdict(lambda: defaultdict(list))
-        self.heads_hit = defaultdict(lambda: defaultdict(int))
-        self.current_player = {}
-        self.placement_phase = {}
-        self.waiting_players = []  # Changed from set() to list()
-        self.shot_results = defaultdict(lambda: defaultdict(dict))
-        self.active_games = set()
-        self.game_status = {}
-
-    def cleanup_game(self, game_id: str):
-        """Clean up all game-related data"""
-        print(f"Cleaning up game {game_id}")
-        if game_id in self.games:
-            self.games.pop(game_id, None)
-        if game_id in self.grids:
-            self.grids.pop(game_id, None)
-        if game_id in self.shots:
-            self.shots.pop(game_id, None)
-        if game_id in self.head_positions:
-            self.head_positions.pop(game_id, None)
-        if game_id in self.heads_hit:
-            self.heads_hit.pop(game_id, None)
-        if game_id in self.current_player:
-            self.current_player.pop(game_id, None)
-        if game_id in self.placement_phase:
-            self.placement_phase.pop(game_id, None)
-        if game_id in self.shot_results:
-            self.shot_results.pop(game_id, None)
-        if game_id in self.active_games:
-            self.active_games.remove(game_id)
-        if game_id in self.game_status:
-            self.game_status.pop(game_id, None)
-
-    def create_new_game(self) -> str:
-        """Create a new game with a unique ID"""
-        # Clean up any stale games first
-        for game_id in list(self.active_games):
-            if game_id not in self.games or not self.games[game_id]:
-                self.cleanup_game(game_id)
-
-        # Create new game ID
-        game_id = "0"
-        while game_id in self.active_games:
-            game_id = str(int(game_id) + 1)
-        
-        # Initialize game state
-        self.games[game_id] = {}
-        self.placement_phase[game_id] = True
-        self.current_player[game_id] = "1"
-        self.active_games.add(game_id)
-        self.game_status[game_id] = 'waiting'
-        
-        print(f"Created new game {game_id}")
-        return game_id
-
-    def is_game_available(self, game_id: str) -> bool:
-        """Check if a game is available to join"""
-        return (game_id in self.active_games and 
-                game_id in self.games and 
-                len(self.games[game_id]) < 2 and
-                self.game_status[game_id] == 'waiting')
+        self.connections: Dict[str, Dict[str, Connection]] = {}
+        self.listeners: Dict[str, asyncio.Task] = {}
+        self.spectators: Dict[str, Broadcast] = {}
+        self.held_seats: Set[asyncio.Task] = set()
+
+    async def listen(self, game_id: str):
+        if game_id not in self.listeners:
+            subscription = await store.subscribe(game_id)
+            self.listeners[game_id] = asyncio.create_task(listen(game_id, subscription))
+
+    def stop_listening(self, game_id: str):
+        if game_id not in self.connections and game_id not in self.spectators:
+            listener = self.listeners.pop(game_id, None)
+            if listener:
+                listener.cancel()
+
+    async def attach(self, conn: Connection):
+        """Start receiving the game's published events"""
+        local = self.connections.setdefault(conn.game_id, {})
+        await self.listen(conn.game_id)
+        replaced = local.get(conn.player_id)
+        local[conn.player_id] = conn
+        if replaced is not None:
+            # The player came back before this worker noticed the old socket drop
+            asyncio.create_task(replaced.websocket.close())
+
+    def hold_seat(self, game_id: str, player_id: str, session: int):
+        task = asyncio.create_task(expire_seat(game_id, player_id, session))
+        self.held_seats.add(task)
+        task.add_done_callback(self.held_seats.discard)
+
+    def detach(self, conn: Connection):
+        local = self.connections.get(conn.game_id, {})
+        if local.get(conn.player_id) is conn:
+            del local[conn.player_id]
+        if not local:
+            self.connections.pop(conn.game_id, None)
+            self.stop_listening(conn.game_id)
+
+    async def add_spectator(self, game_id: str, spectator: Spectator):
+        self.spectators.setdefault(game_id, Broadcast()).add(spectator)
+        await self.listen(game_id)
+
+    def remove_spectator(self, game_id: str, spectator: Spectator):
+        broadcast = self.spectators.get(game_id)
+        if broadcast is None:
+            return
+        broadcast.discard(spectator)
+        if not broadcast:
+            del self.spectators[game_id]
+            self.stop_listening(game_id)
 
 game_state = GameState()
 
+# Deadlines of the games this worker published events for; see reaper.py
+deadlines = reaper.TimerWheel()
+
+# Each board's posterior between /analysis requests, so the next one only
+# filters by the shots fired since; least recently asked for first
+analyses: "OrderedDict[tuple, Analysis]" = OrderedDict()
+ANALYSIS_CACHE = int(os.environ.get("AVIOANE_ANALYSIS_CACHE", "256"))
+# Bytes of fleets the cached analyses may hold between them; one board early
+# in a big game can hold megabytes, so the count alone doesn't bound memory
+ANALYSIS_MEMORY = int(os.environ.get("AVIOANE_ANALYSIS_MEMORY", str(64 << 20)))
+# (game_id, player_id) -> (shots, answer) of boards with too many fleets to
+# count, answered as they are until another shot lands on them
+refused: Dict[tuple, tuple] = {}
+# Analyses running in threads at once; the rest wait their turn
+analysis_slots = asyncio.Semaphore(int(os.environ.get("AVIOANE_ANALYSIS_THREADS", "2")))
+
+lag_watcher = None
+reaper_task = None
+
+@app.on_event("startup")
+async def start_logging():
+    logs.start()
+
+@app.on_event("startup")
+async def start_store():
+    await store.start()
+
+@app.on_event("startup")
+async def start_event_log():
+    if event_log:
+        await asyncio.to_thread(event_log.start)
+
+@app.on_event("startup")
+async def start_metrics():
+    global lag_watcher
+    lag_watcher = asyncio.create_task(metrics.watch_loop_lag())
+
+@app.on_event("startup")
+async def start_reaper():
+    global reaper_task
+    reaper_task = asyncio.create_task(reap_games())
+
+@app.on_event("shutdown")
+async def stop_reaper():
+    if reaper_task:
+        reaper_task.cancel()
+
+@app.on_event("shutdown")
+async def close_store():
+    await store.close()
+
+@app.on_event("shutdown")
+async def stop_metrics():
+    if lag_watcher:
+        lag_watcher.cancel()
+
+@app.on_event("shutdown")
+async def close_event_log():
+    if event_log:
+        await asyncio.to_thread(event_log.close)
+
+@app.on_event("shutdown")
+async def stop_logging():
+    logs.stop()
+
 @app.get("/")
-async def get_index():
-    return RedirectResponse(url='/static/index.html')
-
-async def find_game(websocket: WebSocket) -> str:
-    """Find an available game or create a new one"""
-    if websocket in game_state.waiting_players:
-        game_state.waiting_players.remove(websocket)
-    
-    # Clean up any empty or stale games
-    for game_id in list(game_state.active_games):
-        if game_id not in game_state.games or not game_state.games[game_id]:
-            game_state.cleanup_game(game_id)
-    
-    # Look for available games
-    for game_id in list(game_state.active_games):
-        if game_state.is_game_available(game_id):
-            print(f"Found available game {game_id}")
-            return game_id
-    
-    # Create new game if no available games found
-    return game_state.create_new_game()
+async def get_index(request: Request):
+    # Keep ?room=, ?spectate= and the like for the page's script
+    url = static_files.url("index.html")
+    if request.url.query:
+        url += "?" + request.url.query
+    return RedirectResponse(url=url)
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    game_id = None
-    player_id = None
-    
+@app.get("/metrics")
+async def get_metrics():
+    metrics.GAMES_ACTIVE.set(len(game_state.connections))
+    metrics.CONNECTIONS.set(sum(len(local) for local in game_state.connections.values()))
+    metrics.SPECTATORS.set(sum(len(broadcast) for broadcast in game_state.spectators.values()))
+    metrics.QUEUE_DEPTH.set(await store.queue_depth())
+    metrics.TIMERS.set(len(deadlines))
+    metrics.OUTBOX_MESSAGES.set(sum(len(conn.outbox) for local in game_state.connections.values()
+                                    for conn in local.values()))
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/replay/{game_id}")
+async def replay_game(game_id: str):
+    """Stream a finished game's events as JSON lines"""
+    location = await asyncio.to_thread(event_log.lookup, game_id) if event_log else None
+    if location is None:
+        raise HTTPException(status_code=404, detail="No replay for this game")
+    lines = (json.dumps(event) + "\n" for event in event_log.replay(location))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+def board_analysis(analysis: Analysis, shots: int, hits: int, heads: int) -> dict:
+    """The odds for one board as rows of cells, None where it was shot; runs in a thread"""
     try:
-        await websocket.accept()
-        
-        game_id = await find_game(websocket)
-        player_id = str(len(game_state.games[game_id]) + 1)
-        game_state.games[game_id][player_id] = websocket
-        
-        if len(game_state.games[game_id]) == 2:
-            game_state.game_status[game_id] = 'in_progress'
-        
-        print(f"Player {player_id} joined game {game_id}")
-        
-        await websocket.send_json({
+        analysis.update(shots, hits, heads)
+    except TooManyArrangements as e:
+        return {"arrangements": None, "error": str(e)}
+    # Another request may filter the same analysis once this one lets go of
+    # it, so the cells left blank are the shots these odds were counted from
+    posterior = analysis.probabilities()
+    size = analysis.size
+
+    def grid(odds):
+        odds = odds.tolist()
+        return [[None if posterior.shots >> cell & 1 else odds[cell]
+                 for cell in range(row * size, (row + 1) * size)]
+                for row in range(size)]
+
+    return {"arrangements": posterior.arrangements,
+            "occupancy": grid(posterior.occupancy), "heads": grid(posterior.heads)}
+
+def trim_analyses():
+    """Drop the least recently asked for analyses until the cache fits its caps.
+
+    Sizes are read after the update, which is when an analysis grows or
+    shrinks; one too big for ANALYSIS_MEMORY on its own isn't kept at all.
+    """
+    memory = sum(analysis.nbytes for analysis in analyses.values())
+    while analyses and (len(analyses) > ANALYSIS_CACHE or memory > ANALYSIS_MEMORY):
+        key, analysis = analyses.popitem(last=False)
+        memory -= analysis.nbytes
+        refused.pop(key, None)
+
+@app.get("/analysis/{game_id}")
+async def analyze_game(game_id: str):
+    """Per board, the chance each unshot cell holds a plane and a head, given the shots so far.
+
+    Exact over every fleet that fits the misses, hits and heads hit; see
+    desktop/posterior.py. A board with too many fleets left to count gets an
+    error in place of its odds until more of it is shot.
+    """
+    game = await store.load(game_id)
+    if game is None:
+        raise HTTPException(status_code=404, detail="No such game")
+    boards = {}
+    for player_id, board in game.boards.items():
+        key = (game_id, player_id)
+        # The masks are read now; the game can move on while the thread runs
+        shots, hits, heads = board.shots, board.hits, board.heads & board.shots
+        if key in refused and refused[key][0] == shots:
+            boards[player_id] = refused[key][1]
+            continue
+        analysis = analyses.pop(key, None) or Analysis(game.size, game.planes)
+        analyses[key] = analysis
+        async with analysis_slots:
+            boards[player_id] = await asyncio.to_thread(board_analysis, analysis, shots, hits, heads)
+        if boards[player_id]["arrangements"] is None:
+            refused[key] = (shots, boards[player_id])
+        else:
+            refused.pop(key, None)
+        trim_analyses()
+    return {"game_id": game_id, "size": game.size, "planes": game.planes, "boards": boards}
+
+async def find_game(websocket: WebSocket, mode: tuple):
+    """Take the oldest open seat of the mode, or open a new game if there is none.
+
+    Players passing ?room=<code> are paired only with the other player using
+    the same code. Returns (game_id, bot_delay): the seconds after which the
+    bot takes the other seat of a new public game, or None for no bot.
+    """
+    room = websocket.query_params.get("room")
+    if room is not None and not valid_room_code(room):
+        room = None
+    wants_bot = websocket.query_params.get("opponent") == "bot"
+
+    while True:
+        game_id = None if wants_bot else await store.take_seat(room, mode)
+        if game_id is not None:
+            logs.event(logs.MATCH, logging.INFO, "Took open seat", game_id=game_id, room=room)
+            return game_id, None
+        game = await store.open_seat(None if wants_bot else room, mode)
+        if game is not None:
+            logs.event(logs.MATCH, logging.INFO, "Created new game", game_id=game.game_id, room=room,
+                       size=game.size, planes=game.planes)
+            if wants_bot:
+                return game.game_id, 0
+            if room is None and protocol.BOT_TIMEOUT > 0:
+                return game.game_id, protocol.BOT_TIMEOUT
+            return game.game_id, None
+
+async def bot_fallback(game_id: str, delay: float):
+    """Give the waiting player the bot if nobody took the seat in time"""
+    await asyncio.sleep(delay)
+    if not await store.claim_seat(game_id):
+        return
+    async with store.lock(game_id):
+        game = await store.load(game_id)
+        if game is None or game.players >= 2:
+            return
+        since = len(game.events)
+        bot_id = game.add_bot()
+        logs.event(logs.GAME, logging.INFO, "Bot joined", game_id=game_id, player_id=bot_id)
+        await store.save(game)
+        await publish_events(game, since)
+
+async def send_message(websocket: WebSocket, message: dict):
+    """Send a message in the socket's codec, counting it by type and size"""
+    await send_payload(websocket, websocket.state.codec.encode(message), metrics.message_type(message))
+
+async def send_payload(websocket: WebSocket, payload, msg_type: str):
+    """Send an already encoded message"""
+    metrics.MESSAGES.inc("out", msg_type)
+    metrics.PAYLOAD_BYTES.observe(len(payload), "out")
+    if isinstance(payload, bytes):
+        await websocket.send_bytes(payload)
+    else:
+        await websocket.send_text(payload)
+
+async def receive_payload(websocket: WebSocket):
+    """The next text or binary frame"""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    return message.get("text") if message.get("text") is not None else message.get("bytes")
+
+def push_update(game: Game, conn: Connection, force: bool = False):
+    """Queue whatever happened since the player's cursor.
+
+    Protocol v2 players get only the new events; protocol v1 players get the
+    full state, and only when something changed unless force is set.
+    """
+    log = game.events
+    cursor = conn.cursor
+    if cursor >= len(log) and not force:
+        return
+    conn.cursor = len(log)
+
+    if conn.version == protocol.PROTOCOL_VERSION:
+        conn.outbox.put(protocol.state_delta(len(log), log[cursor:]))
+    else:
+        conn.outbox.put(game.legacy_update(conn.player_id))
+
+async def publish_events(game: Game, since: int):
+    """Tell every worker about the events recorded after seq `since`"""
+    if len(game.events) > since:
+        await store.publish(game.game_id, {"seq": len(game.events), "events": game.events[since:]})
+        game_deadline = reaper.deadline(game)
+        if game_deadline is None:
+            deadlines.cancel(game.game_id)
+        else:
+            deadlines.schedule(game.game_id, game_deadline)
+
+async def deliver(game_id: str, message: dict):
+    """Push a published message to this worker's sockets in the game.
+
+    The message is encoded once per codec, for every spectator and every
+    player who needs all of it; only players further behind get a delta of
+    their own.
+    """
+    game = None
+    delta = protocol.state_delta(message["seq"], message["events"])
+    encoded = {}
+
+    def encode(codec):
+        if codec.name not in encoded:
+            encoded[codec.name] = codec.encode(delta)
+        return encoded[codec.name]
+
+    final = any(event["op"] == "leave" for event in message["events"])
+    broadcast = game_state.spectators.get(game_id)
+    if broadcast:
+        broadcast.publish(message["seq"], encode, final)
+    for conn in list(game_state.connections.get(game_id, {}).values()):
+        if conn.cursor >= message["seq"]:
+            continue
+        try:
+            events = [event for event in message["events"] if event["seq"] > conn.cursor]
+            if any(event["op"] == "leave" for event in events):
+                notify_left(conn, message["seq"], events)
+                continue
+            if conn.version == protocol.PROTOCOL_VERSION and events[0]["seq"] == conn.cursor + 1:
+                # The message carries everything this player is missing
+                conn.cursor = message["seq"]
+                if len(events) < len(message["events"]):
+                    conn.outbox.put(protocol.state_delta(message["seq"], events))
+                    continue
+                conn.outbox.put(delta, encode(conn.outbox.codec))
+                continue
+            if game is None:
+                game = await store.load(game_id)
+                if game is None:
+                    return
+            push_update(game, conn)
+        except Exception as e:
+            logs.event(logs.CONN, logging.WARNING, "Could not send update",
+                       game_id=game_id, player_id=conn.player_id, error=repr(e))
+
+async def catch_up(game_id: str, cursor: int):
+    """One delta with every event after cursor, for a spectator that fell behind"""
+    game = await store.load(game_id)
+    if game is None:
+        return None
+    seq = len(game.events)
+    return seq, protocol.state_delta(seq, game.events[cursor:]), False
+
+async def watch_game(websocket: WebSocket, game_id: str):
+    """Stream a game's events to a spectator until the game or the spectator ends"""
+    async with store.lock(game_id):
+        game = await store.load(game_id)
+        if game is None:
+            await send_message(websocket, protocol.error("No such game"))
+            await websocket.close()
+            return
+        spectator = Spectator(websocket, websocket.state.codec, len(game.events),
+                              partial(catch_up, game_id))
+        await send_message(websocket, {
             "type": "init",
-            "player_id": player_id,
-            "game_id": game_id
+            "spectator": True,
+            "game_id": game_id,
+            "protocol": protocol.PROTOCOL_VERSION,
+            "size": game.size,
+            "planes": game.planes
         })
-        
-        while True:
-            data = await websocket.receive_json()
-            
-            if "grid" in data:
-                if game_id not in game_state.grids:
-                    game_state.grids[game_id] = {}
-                game_state.grids[game_id][player_id] = data["grid"]
-                
-            if "head_positions" in data:
-                game_state.head_positions[game_id][player_id] = data["head_positions"]
-                
-            opponent_id = "2" if player_id == "1" else "1"
-            
-            # Check if placement phase should end
-            placement_phase_just_ended = False
-            if game_state.placement_phase[game_id]:
-                if game_id in game_state.grids and len(game_state.grids[game_id]) == 2:
-                    planes_placed_p1 = len(game_state.head_positions[game_id].get("1", []))
-                    planes_placed_p2 = len(game_state.head_positions[game_id].get("2", []))
-                    print(f"Checking placement status - P1: {planes_placed_p1}, P2: {planes_placed_p2}")
-                    
-                    if planes_placed_p1 >= 3 and planes_placed_p2 >= 3:
-                        game_state.placement_phase[game_id] = False
-                        game_state.current_player[game_id] = "1"
-                        placement_phase_just_ended = True
-                        game_state.game_status[game_id] = 'in_progress'
-                        print(f"Game {game_id} placement phase complete. P1: {planes_placed_p1}, P2: {planes_placed_p2}")
-            
-            if placement_phase_just_ended:
-                # Send immediate updates to both players
-                for pid, ws in game_state.games[game_id].items():
-                    try:
-                        is_player_one = pid == "1"
-                        other_player = "2" if is_player_one else "1"
-                        update_msg = {
-                            "type": "update",
-                            "opponent_ready": True,
-                            "your_turn": is_player_one,
-                            "placement_phase": False,
-                            "opponent_shots": game_state.shots[game_id][other_player],
-                            "heads_hit": game_state.heads_hit[game_id][pid],
-                            "opponent_heads_hit": game_state.heads_hit[game_id][other_player],
-                            "shot_results": game_state.shot_results[game_id][pid]
-                        }
-                        await ws.send_json(update_msg)
-                        print(f"Sent placement complete to P{pid}, turn: {is_player_one}")
-                    except Exception as e:
-                        print(f"Error sending placement complete to P{pid}: {e}")
-                continue
+        await send_message(websocket, protocol.state_delta(len(game.events), game.events))
+        await game_state.add_spectator(game_id, spectator)
+    logs.event(logs.GAME, logging.INFO, "Spectator joined", game_id=game_id)
+
+    writer = asyncio.create_task(spectator.run())
+    # Spectators send nothing; reading only notices them leaving
+    reader = asyncio.create_task(drain_socket(websocket))
+    try:
+        await asyncio.wait((writer, reader), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        writer.cancel()
+        reader.cancel()
+        game_state.remove_spectator(game_id, spectator)
+        if writer.done() and not writer.cancelled() and writer.exception() is None:
+            await websocket.close()
+
+async def drain_socket(websocket: WebSocket):
+    while True:
+        await receive_payload(websocket)
+
+async def listen(game_id: str, subscription):
+    try:
+        async for message in subscription:
+            await deliver(game_id, message)
+    finally:
+        await subscription.close()
+
+def notify_left(conn: Connection, seq: int, events: list):
+    """Tell a player their opponent left"""
+    conn.cursor = seq
+    if conn.version == protocol.PROTOCOL_VERSION:
+        conn.outbox.put(protocol.state_delta(seq, events))
+        return
+    conn.outbox.put({
+        "type": "update",
+        "opponent_ready": False,
+        "your_turn": False,
+        "placement_phase": True,
+        "message": "Opponent disconnected. Please refresh to start a new game."
+    })
+
+def handle_message(game: Game, player_id: str, data: dict) -> Optional[dict]:
+    """Apply a protocol v2 message, returning an error reply if it was rejected"""
+    msg_type = data.get("type")
+    if msg_type == "place":
+        message = game.record_placement(player_id, data.get("head"), data.get("cells"))
+        if message:
+            return protocol.error(message)
+        game.check_placement_complete()
+    elif msg_type == "fire":
+        row, col = data.get("row"), data.get("col")
+        if not protocol.in_bounds(row, col, game.size):
+            return protocol.error("Shot out of bounds")
+        if game.record_shot(player_id, row, col) is None:
+            return protocol.error("Cannot fire now")
+    else:
+        return protocol.error(f"Unknown message type: {msg_type}")
+    return None
+
+def handle_legacy_message(game: Game, player_id: str, data: dict):
+    """Apply a protocol v1 full-state message"""
+    game.record_legacy_grid(player_id, data.get("grid"), data.get("head_positions"))
+    if game.placement_phase:
+        game.check_placement_complete()
+        return
+
+    current_shots = data.get("shots", [])
+    for row in range(len(current_shots)):
+        for col in range(len(current_shots[row])):
+            if current_shots[row][col] and game.record_shot(player_id, row, col):
+                return
+
+async def join_game(conn: Connection) -> bool:
+    """Take a seat in the game and announce it; False if the game is gone"""
+    async with store.lock(conn.game_id):
+        game = await store.load(conn.game_id)
+        if game is None or game.players >= 2:
+            return False
+        conn.player_id = str(game.players + 1)
+        conn.session = 1
+        since = len(game.events)
+        token = game.seat(conn.player_id, conn.version)
+        if game.players == 2:
+            game.status = 'in_progress'
+        await store.save(game)
+
+        logs.event(logs.GAME, logging.INFO, "Player joined", game_id=conn.game_id,
+                   player_id=conn.player_id, protocol=conn.version)
+        send_init(conn, game, token)
+        push_update(game, conn, force=True)
+        # Only now take published events: anything older was just pushed
+        await game_state.attach(conn)
+        await publish_events(game, since)
+    return True
+
+async def resume_game(conn: Connection, token: str, seq) -> bool:
+    """Put a returning player back in their seat and send what they missed"""
+    parsed = parse_resume_token(token)
+    if parsed is None:
+        return False
+    conn.game_id, conn.player_id, secret = parsed
+    async with store.lock(conn.game_id):
+        game = await store.load(conn.game_id)
+        if game is None or conn.player_id not in game.protocols:
+            return False
+        since = len(game.events)
+        conn.session = game.resume(conn.player_id, secret, conn.version)
+        if conn.session is None:
+            return False
+        await store.save(game)
+
+        logs.event(logs.GAME, logging.INFO, "Player resumed", game_id=conn.game_id,
+                   player_id=conn.player_id, session=conn.session, seq=seq)
+        conn.cursor = min(seq, since) if isinstance(seq, int) and seq > 0 else 0
+        send_init(conn, game, token, resumed=True)
+        push_update(game, conn, force=(conn.version == protocol.LEGACY_VERSION))
+        await game_state.attach(conn)
+        await publish_events(game, since)
+    return True
+
+def send_init(conn: Connection, game: Game, token: str, resumed: bool = False):
+    conn.outbox.put({
+        "type": "init",
+        "player_id": conn.player_id,
+        "game_id": conn.game_id,
+        "protocol": conn.version,
+        "size": game.size,
+        "planes": game.planes,
+        "resume_token": token,
+        "resumed": resumed
+    })
+
+async def leave_game(conn: Connection):
+    """Hold the player's seat for the resume grace period, or end the game"""
+    async with store.lock(conn.game_id):
+        game = await store.load(conn.game_id)
+        # A newer connection of the same player has taken over the seat
+        if game is None or game.sessions.get(conn.player_id) != conn.session:
+            return
+        if protocol.RESUME_GRACE > 0 and game.players == 2 and not game.is_over():
+            since = len(game.events)
+            game.mark_away(conn.player_id)
+            await store.save(game)
+            await publish_events(game, since)
+            game_state.hold_seat(conn.game_id, conn.player_id, conn.session)
+            logs.event(logs.GAME, logging.INFO, "Player away, holding seat",
+                       game_id=conn.game_id, player_id=conn.player_id)
+            return
+        await end_game(game, conn.player_id)
+
+async def expire_seat(game_id: str, player_id: str, session: int):
+    """End the game if the player did not come back in time"""
+    await asyncio.sleep(protocol.RESUME_GRACE)
+    async with store.lock(game_id):
+        game = await store.load(game_id)
+        if game is not None and game.away.get(player_id) == session:
+            await end_game(game, player_id)
+
+async def end_game(game: Game, player_id: str, reason: str = None):
+    """Record the player's departure and end the game for everyone; holds the lock"""
+    del game.protocols[player_id]
+    if not game.placement_phase and not game.is_over():
+        metrics.GAMES_ABANDONED.inc()
+    since = len(game.events)
+    if reason:
+        game.record_event("leave", player=player_id, reason=reason)
+    else:
+        game.record_event("leave", player=player_id)
+    await publish_events(game, since)
+    deadlines.cancel(game.game_id)
+
+    # Archive the game, then clean it up completely
+    if event_log:
+        event_log.append(game)
+    logs.event(logs.GAME, logging.INFO, "Player left, closing game",
+               game_id=game.game_id, player_id=player_id)
+    await store.delete(game.game_id)
+    for player_id in game.boards:
+        analyses.pop((game.game_id, player_id), None)
+        refused.pop((game.game_id, player_id), None)
+
+async def reap_games():
+    """End the games whose deadline passed, one wheel tick at a time"""
+    while True:
+        await asyncio.sleep(reaper.TICK)
+        for game_id in deadlines.advance(time.time()):
+            try:
+                await expire_game(game_id)
+            except Exception:
+                logs.event(logs.GAME, logging.ERROR, "Could not expire game",
+                           exc_info=True, game_id=game_id)
+
+async def expire_game(game_id: str):
+    """End a game that timed out, unless it moved on in the meantime"""
+    async with store.lock(game_id):
+        game = await store.load(game_id)
+        if game is None:
+            return
+        now = time.time()
+        game_deadline = reaper.deadline(game)
+        if game_deadline is None:
+            return
+        if game_deadline > now:
+            deadlines.schedule(game_id, game_deadline)
+            return
+        player_id, reason = reaper.culprit(game, now)
+        metrics.GAMES_EXPIRED.inc(reason)
+        logs.event(logs.GAME, logging.INFO, "Game timed out", game_id=game_id,
+                   player_id=player_id, reason=reason)
+        if player_id is None:
+            await store.delete(game_id)
+            return
+        await end_game(game, player_id, reason="timeout")
+
+async def apply_message(conn: Connection, data: dict):
+    """Apply one client message and push its updates"""
+    if conn.version == protocol.PROTOCOL_VERSION and data.get("type") == "ack":
+        seq = data.get("seq")
+        if isinstance(seq, int):
+            conn.acked = min(seq, conn.cursor)
+        return
+
+    # Apply the message and push its updates as one step, so the
+    # opponent's coroutine never sees a half-applied turn
+    game_id, player_id = conn.game_id, conn.player_id
+    async with store.lock(game_id):
+        game = await store.load(game_id)
+        if game is None:
+            conn.outbox.put(protocol.error("Game is over"))
+            return
+        if game.sessions.get(player_id) != conn.session:
+            conn.outbox.put(protocol.error("Resumed on another connection"))
+            return
+        since = len(game.events)
+        was_over = game.is_over()
+
+        if conn.version == protocol.PROTOCOL_VERSION:
+            reply = handle_message(game, player_id, data)
+            if reply:
+                conn.outbox.put(reply)
+                return
+        else:
+            handle_legacy_message(game, player_id, data)
+        game.run_bots()
+
+        if any(event["op"] == "start" for event in game.events[since:]):
+            metrics.GAMES_STARTED.inc()
+        if not was_over and game.is_over():
+            metrics.GAMES_COMPLETED.inc()
+
+        if len(game.events) > since:
+            await store.save(game)
+        push_update(game, conn, force=(conn.version == protocol.LEGACY_VERSION))
+        await publish_events(game, since)
+
+        if game.placement_phase:
+            boards = game.boards
+            logs.event(logs.PLACEMENT, logging.DEBUG, "Placement status", game_id=game_id,
+                       player_id=player_id, msg_type=data.get("type", "legacy"),
+                       planes=boards[player_id].planes,
+                       opponent_planes=boards[opponent_of(player_id)].planes)
+
+async def receive_messages(conn: Connection):
+    """Apply the player's messages until they disconnect"""
+    legacy = conn.version == protocol.LEGACY_VERSION
+    while True:
+        payload = await receive_payload(conn.websocket)
+        conn.outbox.seen()
+        # Size and rate are checked before anything is decoded
+        verdict = conn.limiter.check(len(payload))
+        if verdict == ratelimit.TOO_LARGE:
+            metrics.REJECTED.inc("too_large")
+            conn.outbox.close(ratelimit.CLOSE_TOO_LARGE)
+            return
+        if verdict == ratelimit.LIMITED:
+            metrics.REJECTED.inc("rate")
+            if conn.limiter.strikes == 1:
+                conn.outbox.put(protocol.error("Too many messages, slow down", code="rate_limited"))
+            elif conn.limiter.strikes > ratelimit.MAX_STRIKES:
+                conn.outbox.close(ratelimit.CLOSE_POLICY)
+                return
+            continue
+        try:
+            data = conn.outbox.codec.decode(payload)
+        except codec.CodecError as e:
+            metrics.REJECTED.inc("malformed")
+            conn.outbox.put(protocol.error(str(e)))
+            continue
+        if not isinstance(data, dict):
+            reason = "Messages must be objects"
+        else:
+            reason = protocol.legacy_error(data) if legacy else None
+        if reason:
+            metrics.REJECTED.inc("invalid")
+            conn.outbox.put(protocol.error(reason))
+            continue
+        msg_type = metrics.message_type(data, legacy=legacy)
+        metrics.MESSAGES.inc("in", msg_type)
+        metrics.PAYLOAD_BYTES.observe(len(payload), "in")
+        if msg_type == "pong":
+            continue
+        start = time.perf_counter()
+        await apply_message(conn, data)
+        metrics.HANDLER_SECONDS.observe(time.perf_counter() - start, msg_type)
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    conn = None
+    bot_task = reader = writer = None
+
+    try:
+        spectate = websocket.query_params.get("spectate")
+        version = protocol.negotiate_version(websocket.query_params)
+        # Binary codecs carry protocol v2 only; spectators always get v2 deltas
+        chosen = codec.negotiate(websocket.scope.get("subprotocols", ()),
+                                 binary=spectate is not None or version == protocol.PROTOCOL_VERSION)
+        websocket.state.codec = chosen or codec.DEFAULT
+        await websocket.accept(subprotocol=chosen and codec.subprotocol(chosen))
+        metrics.CODECS.inc(websocket.state.codec.name)
+
+        if spectate is not None:
+            await watch_game(websocket, spectate)
+            return
+
+        if version == protocol.LEGACY_VERSION and not protocol.LEGACY_PROTOCOL:
+            await send_message(websocket, protocol.error("Protocol v1 is disabled, please update your client"))
+            await websocket.close()
+            return
+
+        # The full-state format only has room for the default board
+        mode = protocol.parse_mode(websocket.query_params)
+        if mode is None or (version == protocol.LEGACY_VERSION and mode != protocol.DEFAULT_MODE):
+            await send_message(websocket, protocol.error(protocol.INVALID_MODE, code="invalid_mode"))
+            await websocket.close()
+            return
+
+        conn = Connection(websocket, version)
+        writer = asyncio.create_task(conn.outbox.run())
+        token = websocket.query_params.get("resume")
+        if token is not None:
+            try:
+                seq = int(websocket.query_params.get("seq", 0))
+            except ValueError:
+                seq = 0
+            if not await resume_game(conn, token, seq):
+                conn.player_id = None
+                await send_message(websocket, protocol.error("This game can no longer be resumed",
+                                                             code="resume_failed"))
+                await websocket.close()
+                return
+            bot_delay = None
+        else:
+            conn.game_id, bot_delay = await find_game(websocket, mode)
+            while not await join_game(conn):
+                conn.game_id, bot_delay = await find_game(websocket, mode)
+        if bot_delay is not None:
+            bot_task = asyncio.create_task(bot_fallback(conn.game_id, bot_delay))
+
+        # Until the player leaves, or the writer closes the socket on them
+        reader = asyncio.create_task(receive_messages(conn))
+        await asyncio.wait((reader, writer), return_when=asyncio.FIRST_COMPLETED)
+        if reader.done():
+            reader.result()
+        if conn.outbox.close_code is not None:
+            await writer
+            logs.event(logs.CONN, logging.INFO, "Closed player socket", game_id=conn.game_id,
+                       player_id=conn.player_id, code=conn.outbox.close_code)
 
-            current_shots = data.get("shots", [])
-            if (not game_state.placement_phase[game_id] and 
-                game_state.current_player[game_id] == player_id):
-                for row in range(len(current_shots)):
-                    for col in range(len(current_shots[row])):
-                        if (current_shots[row][col] and 
-                            (row, col) not in game_state.shots[game_id][player_id]):
-                            
-                            game_state.shots[game_id][player_id].append((row, col))
-                            coords = f"{row},{col}"
-                            
-                            in_head_positions = any(row == hr and col == hc 
-                                                  for hr, hc in game_state.head_positions[game_id][opponent_id])
-                            if in_head_positions:
-                                game_state.shot_results[game_id][player_id][coords] = "head"
-                                game_state.heads_hit[game_id][player_id] += 1
-                            elif (opponent_id in game_state.grids[game_id] and 
-                                  game_state.grids[game_id][opponent_id][row][col] != [255, 255, 255]):
-                                game_state.shot_results[game_id][player_id][coords] = "hit"
-                            else:
-                                game_state.shot_results[game_id][player_id][coords] = "miss"
-                            
-                            game_state.current_player[game_id] = opponent_id
-                            
-                            shooter_response = {
-                                "type": "update",
-                                "opponent_ready": True,
-                                "your_turn": False,
-                                "placement_phase": False,
-                                "opponent_shots": game_state.shots[game_id][opponent_id],
-                                "heads_hit": game_state.heads_hit[game_id][player_id],
-                                "opponent_heads_hit": game_state.heads_hit[game_id][opponent_id],
-                                "shot_results": game_state.shot_results[game_id][player_id]
-                            }
-                            await websocket.send_json(shooter_response)
-                            
-                            if opponent_id in game_state.games[game_id]:
-                                try:
-                                    opponent_response = {
-                                        "type": "update",
-                                        "opponent_ready": True,
-                                        "your_turn": True,
-                                        "placement_phase": False,
-                                        "opponent_shots": game_state.shots[game_id][player_id],
-                                        "heads_hit": game_state.heads_hit[game_id][opponent_id],
-                                        "opponent_heads_hit": game_state.heads_hit[game_id][player_id]
-                                    }
-                                    await game_state.games[game_id][opponent_id].send_json(opponent_response)
-                                except Exception as e:
-                                    print(f"Error sending update to opponent: {e}")
-                            continue
-
-            response = {
-                "type": "update",
-                "opponent_ready": len(game_state.games[game_id]) == 2,
-                "your_turn": game_state.current_player[game_id] == player_id,
-                "placement_phase": game_state.placement_phase[game_id],
-                "opponent_shots": game_state.shots[game_id][opponent_id],
-                "heads_hit": game_state.heads_hit[game_id][player_id],
-                "opponent_heads_hit": game_state.heads_hit[game_id][opponent_id],
-                "shot_results": game_state.shot_results[game_id][player_id],
-                "placement_status": {
-                    "your_planes": len(game_state.head_positions[game_id].get(player_id, [])),
-                    "opponent_planes": len(game_state.head_positions[game_id].get(opponent_id, []))
-                }
-            }
-            
-            # Add debug logging
-            if game_state.placement_phase[game_id]:
-                print(f"Game {game_id} - P{player_id} placement status: " +
-                      f"Own planes: {len(game_state.head_positions[game_id].get(player_id, []))}, " +
-                      f"Opponent planes: {len(game_state.head_positions[game_id].get(opponent_id, []))}")
-            
-            await websocket.send_json(response)
-            
     except WebSocketDisconnect:
-        print(f"Player {player_id} disconnected from game {game_id}")
-    except Exception as e:
-        print(f"Error in game {game_id}, player {player_id}: {e}")
+        logs.event(logs.CONN, logging.INFO, "Player disconnected",
+                   game_id=conn and conn.game_id, player_id=conn and conn.player_id)
+    except Exception:
+        logs.event(logs.CONN, logging.ERROR, "Connection failed", exc_info=True,
+                   game_id=conn and conn.game_id, player_id=conn and conn.player_id)
     finally:
-        if game_id and player_id and game_id in game_state.games:
-            if player_id in game_state.games[game_id]:
-                del game_state.games[game_id][player_id]
-                
-                # Clean up the game completely
-                game_state.cleanup_game(game_id)
-                
-                # If there's a remaining player, notify them
-                remaining_players = list(game_state.games.get(game_id, {}).values())
-                for remaining_ws in remaining_players:
-                    try:
-                        await remaining_ws.send_json({
-                            "type": "update",
-                            "opponent_ready": False,
-                            "your_turn": False,
-                            "placement_phase": True,
-                            "message": "Opponent disconnected. Please refresh to start a new game."
-                        })
-                    except:
-                        pass
+        for task in (bot_task, reader, writer):
+            if task is not None:
+                task.cancel()
+        if conn is not None and conn.player_id is not None:
+            game_state.detach(conn)
+            await leave_game(conn)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_max_size=ratelimit.PROTOCOL_MAX_BYTES)